@@ -0,0 +1,225 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+# Measures python_bayeux against python_bayeux.stubserver.StubServer, in one
+# process, and writes the results as JSON:
+#
+#     python benchmarks/bench.py --clients 1,10,100 --batch-sizes 1,10,100 \
+#         --output results.json
+#
+# * push: pushed messages per second across all clients, and the latency
+#   from the server publishing a message to its callback running
+# * publish: outbound publishes per second from one client, per batch size
+# * memory: resident memory per connected, subscribed client
+#
+# Compare the output of two runs to spot regressions between releases.
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import gc
+import os
+import platform
+import resource
+import sys
+import time
+
+import gevent
+import gevent.event
+import simplejson as json
+
+from python_bayeux import BayeuxClient
+from python_bayeux.stubserver import StubServer
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        # Peak rather than current, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def connect_clients(server, count, channel, callback, **kwargs):
+    clients = [BayeuxClient(server.url, **kwargs) for i in range(count)]
+    gevent.joinall([
+        gevent.spawn(client.subscribe(channel, callback).get)
+        for client in clients
+    ], raise_error=True)
+    for client in clients:
+        client.go()
+    return clients
+
+
+def shutdown_clients(server, clients):
+    gevent.joinall([gevent.spawn(client.shutdown) for client in clients])
+
+
+def bench_push(server, clients, messages, timeout):
+    latencies = []
+    expected = clients * messages
+    done = gevent.event.Event()
+
+    def handle(message):
+        latencies.append(time.monotonic() - message['data']['sent'])
+        if len(latencies) >= expected:
+            done.set()
+
+    bayeux_clients = connect_clients(server, clients, '/bench/push', handle)
+
+    started = time.monotonic()
+    for n in range(messages):
+        server.publish('/bench/push', {'n': n, 'sent': time.monotonic()})
+        if n % 100 == 99:
+            # Let the held connects come back while we publish
+            gevent.sleep(0)
+    done.wait(timeout)
+    elapsed = time.monotonic() - started
+
+    shutdown_clients(server, bayeux_clients)
+    return {
+        'benchmark': 'push',
+        'clients': clients,
+        'messages': expected,
+        'received': len(latencies),
+        'seconds': elapsed,
+        'messages_per_second': len(latencies) / elapsed,
+        'p50_latency_ms': _milliseconds(percentile(latencies, 0.5)),
+        'p99_latency_ms': _milliseconds(percentile(latencies, 0.99)),
+    }
+
+
+def bench_publish(server, batch_size, messages, timeout):
+    client = BayeuxClient(server.url, max_batch_size=batch_size)
+    requests_before = server.http_requests
+
+    started = time.monotonic()
+    results = [client.publish('/bench/publish', {'n': n})
+               for n in range(messages)]
+    gevent.joinall(
+        [gevent.spawn(result.get) for result in results],
+        timeout=timeout
+    )
+    elapsed = time.monotonic() - started
+    published = sum(1 for result in results if result.successful())
+
+    shutdown_clients(server, [client])
+    return {
+        'benchmark': 'publish',
+        'batch_size': batch_size,
+        'messages': messages,
+        'published': published,
+        'seconds': elapsed,
+        'messages_per_second': published / elapsed,
+        'http_requests': server.http_requests - requests_before,
+    }
+
+
+def bench_memory(server, clients):
+    gc.collect()
+    before = rss_bytes()
+    bayeux_clients = connect_clients(server, clients, '/bench/memory',
+                                     lambda message: None)
+    gevent.sleep(0.1)
+    gc.collect()
+    after = rss_bytes()
+
+    shutdown_clients(server, bayeux_clients)
+    return {
+        'benchmark': 'memory',
+        'clients': clients,
+        'rss_bytes': after,
+        'rss_bytes_per_client': (after - before) / float(clients),
+    }
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else seconds * 1000.0
+
+
+def _counts(value):
+    return [int(count) for count in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark python_bayeux against an in-process server'
+    )
+    parser.add_argument('--clients', type=_counts, default=[1, 10, 100],
+                        help='comma separated client counts')
+    parser.add_argument('--batch-sizes', type=_counts, default=[1, 10, 100],
+                        help='comma separated max_batch_size values')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='messages per push or publish run')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for each run')
+    parser.add_argument('--output', help='file for the JSON results '
+                        '(default: standard output)')
+    arguments = parser.parse_args(argv)
+
+    results = []
+    with StubServer(timeout=1000) as server:
+        # Memory first, before the other runs have grown the heap
+        for clients in arguments.clients:
+            results.append(bench_memory(server, clients))
+        for clients in arguments.clients:
+            results.append(bench_push(server, clients, arguments.messages,
+                                      arguments.timeout))
+        for batch_size in arguments.batch_sizes:
+            results.append(bench_publish(server, batch_size,
+                                         arguments.messages,
+                                         arguments.timeout))
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if arguments.output is None:
+        print(output)
+    else:
+        with open(arguments.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
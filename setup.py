@@ -17,6 +17,13 @@ install_requires = [
     'simplejson'
 ]
 
+extras_require = {
+    'asyncio': ['httpx'],
+    'http2': ['h2'],
+    'orjson': ['orjson'],
+    'websocket': ['websocket-client'],
+}
+
 
 setup(name='python-bayeux',
     version=version,
@@ -35,6 +42,7 @@ setup(name='python-bayeux',
     package_dir = {'': 'src'},include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
+    extras_require=extras_require,
     entry_points={
     }
 )
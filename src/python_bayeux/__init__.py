@@ -28,63 +28,300 @@
     POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import simplejson as json
 import gevent
+import gevent.event
 import gevent.queue
 import requests
 import requests.exceptions
+import heapq
+import itertools
+import time
+import zlib
 from datetime import datetime
-from copy import deepcopy
+from urllib3.exceptions import ReadTimeoutError
+
+from python_bayeux.channels import ChannelTrie
+from python_bayeux.checkpoint import ReplayCheckpointer
+from python_bayeux.checkpoint import replay_id_of
+from python_bayeux.codec import default_codec
+from python_bayeux.dispatch import KeyedDispatcher
+from python_bayeux.message import StreamSplitter
+from python_bayeux.message import parse_message
+from python_bayeux.message import parse_messages
+from python_bayeux.offload import OffloadPool
+from python_bayeux.queues import BoundedMessageQueue
+from python_bayeux.queues import TenantQueue
+from python_bayeux.reconnect import Reconnector
+from python_bayeux.transport import TransportClosedException
+from python_bayeux.spool import SpoolQueue
 
 import logging
 LOG = logging.getLogger('python_bayeux')
 
+# zlib window bits for a gzip header and trailer
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Put on the outbound queues to tell their greenlets to stop
+_STOP = object()
+
 # See https://docs.cometd.org/current/reference/#_bayeux for bayeux reference
 
 
 class BayeuxClient(object):
-    def __init__(self, endpoint=None, oauth_session=None, start=True):
+    def __init__(self, endpoint=None, oauth_session=None, start=True,
+                 max_batch_size=1, batch_linger=0, request_timeout=None,
+                 tracer=None, dispatch_concurrency=1, dispatch_key=None,
+                 handler_processes=0, handler_batch_size=100,
+                 max_queue_messages=None, max_queue_bytes=None,
+                 overflow_policy='block', spill_directory=None, spool=None,
+                 checkpoint_store=None, default_replay_id=None, codec=None,
+                 lazy_messages=False, streaming_connect=False,
+                 stream_chunk_size=65536, hub=None, tenant=None,
+                 transports=(), compression=None,
+                 compression_threshold=16384, reconnect_backoff=0.5,
+                 max_reconnect_backoff=60, max_network_delay=10,
+                 dedup=None):
         self.endpoint = endpoint
         self.oauth_session = \
             requests.Session() if oauth_session is None else oauth_session
         self.shutdown_called = False
         self.shutdown_completed = False
-
-        # Inbound
-        self.message_queue = gevent.queue.Queue()
+        self.shutdown_event = gevent.event.Event()
+        self.client_id = None
+
+        # Follows the server's reconnect advice.  After a failed handshake or
+        # connect, the next attempt waits the advised interval plus a random
+        # part of reconnect_backoff seconds, doubling with each failure up to
+        # max_reconnect_backoff.  Connects time out max_network_delay seconds
+        # after the advised timeout.  See python_bayeux.reconnect.
+        self.reconnector = Reconnector(
+            backoff=reconnect_backoff,
+            max_backoff=max_reconnect_backoff
+        )
+        self.max_network_delay = max_network_delay
+
+        # Set with stop_greenlets; see below
+        self.stop_event = gevent.event.Event()
+
+        # See python_bayeux.codec; by default, orjson if it is installed
+        self.codec = default_codec() if codec is None else codec
+
+        # If lazy_messages is set, connect responses are split into
+        # python_bayeux.message.Message views, which only decode a message's
+        # data when a callback uses it
+        self.lazy_messages = lazy_messages
+
+        # If streaming_connect is set, connect responses are read
+        # stream_chunk_size bytes at a time, and each pushed message is queued
+        # for its callbacks as soon as it has arrived, rather than once the
+        # whole response has been read and decoded
+        self.streaming_connect = streaming_connect
+        self.stream_chunk_size = stream_chunk_size
+
+        # If compression is 'gzip' or 'deflate', request bodies of at least
+        # compression_threshold bytes are compressed, once per request, so a
+        # batch is compressed as a whole.  If the server answers a compressed
+        # request with 400 or 415 but accepts it uncompressed, we stop
+        # compressing for that endpoint.
+        if compression not in (None, 'gzip', 'deflate'):
+            raise ValueError(
+                'unknown compression {0!r}'.format(compression)
+            )
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.uncompressed_endpoints = set()
+
+        # transports are python_bayeux.transport.Transports to offer in the
+        # handshake, in order of preference, before long-polling.  If the
+        # server supports one, it carries everything but handshakes; if it
+        # fails, we handshake again without it.
+        self.transports = list(transports)
+        self.failed_transports = set()
+        self.transport = None
+
+        # If hub (a python_bayeux.hub.BayeuxHub) is given, this client is one
+        # of its tenants, named by tenant: the hub sends our outbound
+        # messages and runs our callbacks, and we handshake lazily, so none
+        # of the options for our own greenlets, queues or workers apply
+        self.hub = hub
+        self.tenant = tenant
+        if self.hub is not None:
+            if self.tenant is None:
+                raise ValueError('a tenant is required with hub')
+            if request_timeout is not None or dispatch_concurrency > 1 or \
+               handler_processes != 0 or spool is not None or \
+               max_queue_messages is not None or max_queue_bytes is not None:
+                raise ValueError(
+                    'request_timeout, dispatch_concurrency, '
+                    'handler_processes, spool and max_queue_* cannot be '
+                    'used with hub'
+                )
+            max_batch_size = max(max_batch_size, self.hub.max_batch_size)
+
+        # Inbound.  See python_bayeux.queues.BoundedMessageQueue for the
+        # overflow policies when max_queue_messages or max_queue_bytes is set.
+        # If spool (a python_bayeux.spool.SegmentSpool) is given, pushed
+        # messages are kept on disk until their callbacks have run instead,
+        # and any left over from a previous run are handled first.
+        self.spool = spool
+        if self.hub is not None:
+            self.message_queue = TenantQueue(self.hub, self)
+        elif self.spool is not None:
+            self.message_queue = SpoolQueue(spool)
+        else:
+            self.message_queue = BoundedMessageQueue(
+                max_messages=max_queue_messages,
+                max_bytes=max_queue_bytes,
+                overflow_policy=overflow_policy,
+                spill_directory=spill_directory
+            )
 
         # Outbound
         self.subscription_queue = gevent.queue.Queue()
         self.unsubscription_queue = gevent.queue.Queue()
         self.publication_queue = gevent.queue.Queue()
 
+        # If max_batch_size is greater than 1, a single greenlet drains all of
+        # the outbound queues and sends up to max_batch_size messages per
+        # HTTP request, after waiting batch_linger seconds for more work
+        self.max_batch_size = max_batch_size
+        self.batch_linger = batch_linger
+        self.outbound_event = gevent.event.Event()
+        # Numbers outbound messages in the order they were queued, so a batch
+        # keeps that order across the three queues
+        self.outbound_sequence = itertools.count()
+
+        # subscribe(), unsubscribe() and publish() return an AsyncResult that
+        # is resolved when the response with the matching id comes back.
+        # While a request is in flight, its AsyncResult is kept here by
+        # message id.  If request_timeout is set, requests without a response
+        # after that many seconds fail with RequestTimeoutException.
+        self.request_timeout = request_timeout
+        self.pending_requests = {}
+        self.request_deadlines = []
+        self.request_sequence = itertools.count()
+        self.pending_event = gevent.event.Event()
+
         self.channel_ids = {}
 
         self.subscription_callbacks = {}
+        self.subscription_results = {}
+
+        # The state of each subscribed channel: 'pending' until the server
+        # confirms it, then 'subscribed', or 'failed' if the server refused
+        # it.  After a re-handshake, every subscribed channel is restored in
+        # one request, and dispatch waits on subscriptions_ready meanwhile.
+        self.subscription_states = {}
+        self.subscriptions_ready = gevent.event.Event()
+        self.subscriptions_ready.set()
+
+        # Matches the channel of a pushed message to the subscribed channels,
+        # which may include wildcards, that it was sent for
+        self.channel_trie = ChannelTrie()
+
+        # Callbacks are resolved to callables when they are subscribed, not
+        # when messages arrive.  dispatch_table maps each subscribed channel
+        # to a tuple of (callback, callable) pairs, and dispatch_cache maps
+        # the channels of pushed messages to every pair that applies.
+        self.dispatch_table = {}
+        self.dispatch_cache = {}
+
+        # See python_bayeux.tracing.Tracer
+        self.tracer = tracer
+
+        # If dispatch_concurrency is greater than 1, callbacks run on that
+        # many worker greenlets.  Messages are sharded by dispatch_key(message)
+        # (by default, the channel), so messages with the same key are handled
+        # in order, and messages with different keys run concurrently.  If
+        # the message queue is bounded, the workers only take as many
+        # messages as they can run at once, and the rest stay in the queue,
+        # subject to its overflow policy.
+        self.dispatcher = None
+        if dispatch_concurrency > 1:
+            bounded = max_queue_messages is not None or \
+                max_queue_bytes is not None
+            self.dispatcher = KeyedDispatcher(
+                self._dispatch_message,
+                dispatch_concurrency,
+                key=dispatch_key,
+                max_pending=dispatch_concurrency if bounded else None
+            )
+
+        # If handler_processes is set, callbacks run in that many worker
+        # processes instead (None means one per CPU).  Callbacks must then be
+        # functions defined at module level, rather than method names.
+        # Messages go to the workers in batches of up to handler_batch_size,
+        # and results and exceptions come back to handler_result() and
+        # handler_exception().
+        self.offload_pool = None
+        if handler_processes != 0:
+            if self.dispatcher is not None:
+                raise ValueError(
+                    'handler_processes and dispatch_concurrency '
+                    'cannot be used together'
+                )
+            self.offload_pool = OffloadPool(
+                handler_processes,
+                handler_batch_size
+            )
 
-        # handshake() has a side effect of initializing self.message_counter
-        self.handshake()
+        # If checkpoint_store (a python_bayeux.checkpoint.CheckpointStore) is
+        # given, the replay id of the last message handled on each channel is
+        # saved there, and sent back in the replay extension when subscribing,
+        # so that no events are missed across re-handshakes and restarts.
+        # Channels without a checkpoint are subscribed from default_replay_id
+        # (-1 for new events only, -2 for every retained event), if given.
+        self.checkpointer = None \
+            if checkpoint_store is None \
+            else ReplayCheckpointer(checkpoint_store)
+        self.default_replay_id = default_replay_id
+
+        # If dedup (a python_bayeux.dedup.DedupCache) is given, pushed
+        # messages it has already seen are dropped before any callback runs.
+        # A message is only remembered once its callbacks have finished, and
+        # with a spool, once it has been committed.
+        self.dedup = dedup
+
+        # Message ids keep increasing across handshakes, so a request still
+        # in flight when we handshake again isn't mistaken for a new one
+        self.message_counter = 1
+        if self.hub is None:
+            self.handshake()
+        else:
+            self.hub.add(self)
 
-        self.connect_timeout = None
         self.disconnect_complete = False
         self.executing = False
         self.stop_greenlets = False
-        self.waiting_for_resubscribe = False
         self.go_called = False
         self.exception = None
+        self.successive_timeouts = 0
+
+        if self.hub is not None:
+            outbound_methods = ()
+        elif self.max_batch_size > 1:
+            outbound_methods = (self._batch_greenlet,)
+        else:
+            outbound_methods = (self._subscribe_greenlet,
+                                self._unsubscribe_greenlet,
+                                self._publish_greenlet)
+
+        if self.request_timeout is not None:
+            outbound_methods += (self._request_timeout_greenlet,)
 
         self.outbound_greenlets = []
-        for method in (self._subscribe_greenlet,
-                       self._unsubscribe_greenlet,
-                       self._publish_greenlet):
+        for method in outbound_methods:
             new_greenlet = gevent.Greenlet(method)
             new_greenlet.link_exception(self._exception_callback)
             self.outbound_greenlets.append(new_greenlet)
 
+        # With a hub, the connect greenlet is only created once we have
+        # subscribed; see _start_connect_greenlet()
         self.inbound_greenlets = []
-        connect_greenlet = gevent.Greenlet(self._connect_greenlet)
-        connect_greenlet.link_exception(self._exception_callback)
-        self.inbound_greenlets.append(connect_greenlet)
+        if self.hub is None:
+            connect_greenlet = gevent.Greenlet(self._connect_greenlet)
+            connect_greenlet.link_exception(self._exception_callback)
+            self.inbound_greenlets.append(connect_greenlet)
 
         self.greenlets = self.outbound_greenlets + self.inbound_greenlets
 
@@ -92,34 +329,113 @@ class BayeuxClient(object):
             self.start()
 
     def handshake(self, **kwargs):
-        self.message_counter = 1
+        started = time.monotonic()
+
+        # Handshakes always go over long-polling
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+        offered = [transport for transport in self.transports
+                   if transport not in self.failed_transports]
 
         handshake_payload = {
             # MUST
             'channel': '/meta/handshake',
-            'supportedConnectionTypes': ['long-polling'],
+            'supportedConnectionTypes': self._connection_types(offered),
             'version': '1.0',
             # MAY
             'id': None,
             'minimumVersion': '1.0'
         }
+        if self.checkpointer is not None:
+            handshake_payload['ext'] = {'replay': True}
         handshake_payload.update(kwargs)
-        handshake_response = self._send_message(handshake_payload)
+        handshake_response = self._send_message(handshake_payload)[0]
+        if not handshake_response.get('successful', False):
+            self.reconnector.unsuccessful(handshake_response)
+            raise UnsuccessfulResponseException(handshake_response)
+
+        self.client_id = handshake_response['clientId']
+        self.reconnector.handshook(handshake_response)
+        self._negotiate_transport(
+            offered,
+            handshake_response.get('supportedConnectionTypes', ())
+        )
 
-        # TODO: No error checking here
-        self.client_id = handshake_response[0]['clientId']
+        # Connect one time to get the server's timeout advice
+        try:
+            initial_connect_response = self.connect(initial=True)
+        except TransportClosedException as e:
+            self._transport_failed(e)
+            initial_connect_response = self.connect(initial=True)
+        self._follow_connect_advice(initial_connect_response[0])
+
+        if self.tracer is not None:
+            self.tracer.handshake(self, time.monotonic() - started)
+
+    # The advice of the last connect, in seconds; None until a connect has
+    # given any
+    @property
+    def connect_timeout(self):
+        return self.reconnector.timeout
+
+    # One of the states in python_bayeux.reconnect
+    @property
+    def connection_state(self):
+        return self.reconnector.state
+
+    def _follow_connect_advice(self, element):
+        if element.get('successful', False):
+            self.reconnector.connected(element)
+        else:
+            LOG.warning(
+                'client id %s connect failed: %s',
+                self.client_id,
+                element.get('error')
+            )
+            self.reconnector.unsuccessful(element)
+
+    def _connection_types(self, offered):
+        connection_types = []
+        for transport in offered:
+            if transport.connection_type not in connection_types:
+                connection_types.append(transport.connection_type)
+        if 'long-polling' not in connection_types:
+            connection_types.append('long-polling')
+        return connection_types
+
+    def _negotiate_transport(self, offered, supported):
+        for transport in offered:
+            if transport.connection_type not in supported:
+                continue
+            try:
+                transport.open(self)
+            except Exception as e:
+                LOG.warning(
+                    'client id %s could not open %s, falling back: %s',
+                    self.client_id,
+                    type(transport).__name__,
+                    e
+                )
+                self.failed_transports.add(transport)
+                continue
 
-        # Connect one time to get the server's timeout advive
-        initial_connect_response = self.connect(initial=True)
-        initial_connect_response_payload = initial_connect_response[0]
+            self.transport = transport
+            return
 
-        # TODO: handle other 'reconnect' values
-        if initial_connect_response_payload['successful']:
-            # Convert to seconds
-            if 'advice' in initial_connect_response_payload:
-                advice = initial_connect_response_payload['advice']
-                self.connect_timeout = advice['timeout'] / 1000.0
-        # TODO: if not successful, then what?
+    # Stops using the current transport, and doesn't offer it again
+    def _transport_failed(self, exception):
+        LOG.warning(
+            'client id %s lost its %s transport, falling back to '
+            'long-polling: %s',
+            self.client_id,
+            type(self.transport).__name__,
+            exception
+        )
+        self.failed_transports.add(self.transport)
+        self.transport.close()
+        self.transport = None
 
     def disconnect(self):
         disconnect_response = self._send_message({
@@ -136,13 +452,26 @@ class BayeuxClient(object):
         connect_request_payload = {
             # MUST
             'channel': '/meta/connect',
-            'connectionType': 'long-polling',
+            'connectionType': 'long-polling'
+            if self.transport is None
+            else self.transport.connection_type,
             'clientId': None,
             # MAY
             'id': None
         }
 
-        timeout = None if initial else self.connect_timeout
+        timeout = None \
+            if initial or self.connect_timeout is None \
+            else self.connect_timeout + self.max_network_delay
+
+        # The initial connect only matters for its advice, so it isn't
+        # streamed.  Other transports deliver pushes as they arrive anyway.
+        if self.streaming_connect and not initial and \
+           self.transport is None:
+            return self._stream_message(
+                connect_request_payload,
+                timeout=timeout
+            )
 
         connect_response = self._send_message(
             connect_request_payload,
@@ -152,171 +481,528 @@ class BayeuxClient(object):
         return connect_response
 
     def _send_message(self, payload, **kwargs):
-        if 'id' in payload:
-            payload['id'] = str(self.message_counter)
-            self.message_counter += 1
+        if self.transport is not None and \
+           (isinstance(payload, list) or
+                payload['channel'] != '/meta/handshake'):
+            return self._send_over_transport(payload, **kwargs)
+
+        response = self._post(payload, **kwargs)
+        self._check_server_error(payload, response.status_code)
+
+        # Only touch the body once: no response.text, and no response.json(),
+        # which would decode it to text again
+        content = response.content
+
+        LOG.info(
+            '_send_message(): response status code: %s  response content: %s',
+            response.status_code,
+            content
+        )
+
+        if len(content) == 0:
+            return ''
+
+        if self.lazy_messages and not isinstance(payload, list) and \
+           payload['channel'] == '/meta/connect':
+            return parse_messages(content)
+
+        return self.codec.loads(content)
+
+    # Like _send_message(), but yields the elements of the response one at a
+    # time, as soon as each has been read.  Raises ValueError if the response
+    # isn't a complete JSON array of objects.
+    def _stream_message(self, payload, **kwargs):
+        response = self._post(payload, stream=True, **kwargs)
+        LOG.info(
+            '_stream_message(): response status code: %s',
+            response.status_code
+        )
+        try:
+            self._check_server_error(payload, response.status_code)
+        except ServerErrorException:
+            response.close()
+            raise
+
+        splitter = StreamSplitter()
+        try:
+            try:
+                for chunk in response.iter_content(self.stream_chunk_size):
+                    for raw in splitter.feed(chunk):
+                        if self.lazy_messages:
+                            yield parse_message(raw)
+                        else:
+                            yield self.codec.loads(raw)
+            except requests.exceptions.ConnectionError as e:
+                # requests reports a read timeout part way through the body as
+                # a ConnectionError
+                if e.args and isinstance(e.args[0], ReadTimeoutError):
+                    raise requests.exceptions.ReadTimeout(e.args[0])
+                raise
+        finally:
+            response.close()
+
+        if not splitter.finished:
+            raise ValueError('incomplete response')
+
+    # Handshakes and connects that get a 5xx response are retried with
+    # backoff by the connect greenlet.  Transports call this too.
+    def _check_server_error(self, payload, status_code):
+        if status_code < 500 or isinstance(payload, list) or \
+           payload['channel'] not in ('/meta/handshake', '/meta/connect'):
+            return
 
-        if 'clientId' in payload:
-            payload['clientId'] = self.client_id
+        raise ServerErrorException(status_code)
+
+    def _post(self, payload, **kwargs):
+        self._prepare_payload(payload)
+        LOG.info('_post(): payload: %s  kwargs: %s', payload, kwargs)
+
+        started = time.monotonic()
+        body = self.codec.dumps(payload)
+        if self.compression is None or \
+           len(body) < self.compression_threshold or \
+           self.endpoint in self.uncompressed_endpoints:
+            response = self.oauth_session.post(
+                self.endpoint,
+                data=body,
+                **kwargs
+            )
+        else:
+            response = self._post_compressed(body, **kwargs)
+        self._trace_send(payload, started)
 
-        LOG.info('_send_message(): payload: {0}  kwargs: {1}'.format(
-            str(payload),
-            str(kwargs)
-        ))
+        return response
 
+    def _post_compressed(self, body, **kwargs):
         response = self.oauth_session.post(
             self.endpoint,
-            data=json.dumps(payload),
+            data=self._compress(body),
+            headers={'Content-Encoding': self.compression},
             **kwargs
         )
+        if response.status_code not in (400, 415):
+            return response
 
-        LOG.info(
-            u'_send_message(): response status code: {0}  '
-            u'response.text: {1}'.format(
-                response.status_code,
-                response.text
+        # Maybe the server doesn't take compressed requests
+        response.close()
+        response = self.oauth_session.post(
+            self.endpoint,
+            data=body,
+            **kwargs
+        )
+        if response.status_code not in (400, 415):
+            LOG.warning(
+                'client id %s: %s does not accept %s requests, sending '
+                'them uncompressed',
+                self.client_id,
+                self.endpoint,
+                self.compression
             )
+            self.uncompressed_endpoints.add(self.endpoint)
+
+        return response
+
+    def _compress(self, body):
+        started = time.monotonic()
+        compressor = zlib.compressobj(
+            6,
+            zlib.DEFLATED,
+            _GZIP_WBITS if self.compression == 'gzip' else zlib.MAX_WBITS
         )
+        compressed = compressor.compress(body) + compressor.flush()
+
+        if self.tracer is not None:
+            self.tracer.compress(
+                self,
+                self.compression,
+                len(body),
+                len(compressed),
+                time.monotonic() - started
+            )
 
-        if len(response.text) == 0:
-            return ''
+        return compressed
+
+    def _send_over_transport(self, payload, timeout=None):
+        self._prepare_payload(payload)
+        LOG.info(
+            '_send_over_transport(): %s payload: %s',
+            self.transport.connection_type,
+            payload
+        )
 
-        return response.json()
+        started = time.monotonic()
+        response = self.transport.send(self, payload, timeout=timeout)
+        self._trace_send(payload, started)
+
+        return response
+
+    def _prepare_payload(self, payload):
+        # payload may be a single message, or a list of messages to be sent
+        # in one request
+        for message in payload if isinstance(payload, list) else [payload]:
+            if 'id' in message and message['id'] is None:
+                message['id'] = str(self.message_counter)
+                self.message_counter += 1
+
+            if 'clientId' in message:
+                message['clientId'] = self.client_id
+
+    def _trace_send(self, payload, started):
+        if self.tracer is not None:
+            self.tracer.send(
+                self,
+                [message['channel'] for message in payload]
+                if isinstance(payload, list)
+                else [payload['channel']],
+                time.monotonic() - started
+            )
 
     def _connect_greenlet(self):
-        connect_response = None
+        reconnector = self.reconnector
 
         while not self.stop_greenlets:
+            if self.stop_event.wait(reconnector.delay()):
+                break
+
+            reconnector.attempting()
+            started = time.monotonic()
             try:
+                if reconnector.handshake_required:
+                    self.handshake()
+                    self._resubscribe()
+                    continue
+
                 connect_response = self.connect()
-            except requests.exceptions.ReadTimeout:
+                message_count, connect_element = \
+                    self._handle_connect_response(connect_response)
+            except TransportClosedException as e:
+                self._transport_failed(e)
+                reconnector.handshake_required = True
+                reconnector.failed()
+                continue
+            except (requests.exceptions.ReadTimeout,
+                    requests.exceptions.ConnectionError,
+                    ServerErrorException,
+                    UnsuccessfulResponseException) as e:
                 LOG.info(
-                    'connect greenlet timed out {0}'.format(
-                        datetime.now()
-                    )
+                    'client id %s connect greenlet failed %s: %s',
+                    self.client_id,
+                    datetime.now(),
+                    e
                 )
+                # handshake() has already counted an unsuccessful response
+                if not isinstance(e, UnsuccessfulResponseException):
+                    reconnector.failed()
+                self._check_reconnect_refused()
+                continue
+            except ValueError as e:
+                # A streamed response that isn't a complete JSON array
+                if not self.streaming_connect:
+                    raise
+                raise UnexpectedConnectResponseException(str(e))
+
+            if connect_element is None:
+                # A streamed response cut short
+                reconnector.failed()
             else:
-                if not isinstance(connect_response, list):
-                    raise UnexpectedConnectResponseException(
-                        str(connect_response)
-                    )
+                self._follow_connect_advice(connect_element)
+            self._check_reconnect_refused()
+
+            if self.tracer is not None:
+                self.tracer.connect(
+                    self,
+                    time.monotonic() - started,
+                    message_count
+                )
 
-                messages = []
-                handshake_required = False
-                for element in connect_response:
-                    channel = element['channel']
+    def _check_reconnect_refused(self):
+        if self.reconnector.stopped and not self.stop_greenlets:
+            raise ReconnectRefusedException()
+
+    # Queues the pushed messages in the elements of a connect response for
+    # their callbacks, and returns (the number of messages, the /meta/connect
+    # element, if any).  When streaming, connect_response is a generator, and
+    # each message is queued as soon as it has been read.
+    def _handle_connect_response(self, connect_response):
+        if not self.streaming_connect and \
+           not isinstance(connect_response, list):
+            raise UnexpectedConnectResponseException(
+                str(connect_response)
+            )
 
-                    if channel == '/meta/connect':
-                        if not element['successful'] and \
-                           element['error'] == '403::Unknown client':
+        messages = []
+        message_count = 0
+        connect_element = None
+        for element in connect_response:
+            channel = element['channel']
 
-                            # TODO: support handshake advice interval
-                            if element['advice']['reconnect'] == 'handshake':
-                                handshake_required = True
-                    else:
-                        # We got a push!
-                        messages.append(element)
+            if channel == '/meta/connect':
+                connect_element = element
+            else:
+                # We got a push!
+                message_count += 1
+                if self.streaming_connect:
+                    self._queue_pushes([element])
+                else:
+                    messages.append(element)
 
-                if len(messages) > 0:
-                    self.message_queue.put(messages)
+        if len(messages) > 0:
+            self._queue_pushes(messages)
 
-                if handshake_required:
-                    self.handshake()
-                    self._resubscribe()
+        return message_count, connect_element
+
+    def _queue_pushes(self, messages):
+        if self.tracer is not None:
+            self.tracer.receive(self, messages)
+        self.message_queue.put((time.monotonic(), messages))
 
     def _execute_greenlet(self):
         self.executing = True
-        channel = None
         while True:
             try:
-                message_queue_messages = self.message_queue.get(
-                    timeout=1
-                )
+                # Only raises Empty once we are stopping and every message
+                # has been handled
+                enqueued, message_queue_messages = self.message_queue.get()
             except gevent.queue.Empty:
-                if self.stop_greenlets:
-                    LOG.info(
-                        'execute greenlet is stopping: '
-                        'client id {0} at {1}'.format(
-                            self.client_id,
-                            str(datetime.now())
-                        )
-                    )
-                    break
-                else:
-                    LOG.info(
-                        'execute greenlet is NOT stopping: '
-                        'client id {0} at {1}'.format(
-                            self.client_id,
-                            str(datetime.now())
-                        )
-                    )
-                    continue
+                LOG.info(
+                    'execute greenlet is stopping: client id %s at %s',
+                    self.client_id,
+                    datetime.now()
+                )
+                break
 
-            LOG.info('client id {0} found message info {1} at {2}'.format(
+            # Lazily formatted: the messages can be large
+            LOG.info(
+                'client id %s found message info %s at %s',
                 self.client_id,
                 message_queue_messages,
                 datetime.now()
-            ))
+            )
 
-            while self.waiting_for_resubscribe:
-                gevent.sleep(0.5)
+            if self.tracer is not None:
+                self.tracer.queue_wait(
+                    self,
+                    'message',
+                    time.monotonic() - enqueued
+                )
+
+            self.subscriptions_ready.wait()
+
+            if self.dedup is not None:
+                message_queue_messages = self.dedup.filter(
+                    message_queue_messages
+                )
+
+            if self.offload_pool is not None:
+                self._offload_messages(message_queue_messages)
+            else:
+                for message_queue_message in message_queue_messages:
+                    if self.dispatcher is None:
+                        self._dispatch_message(message_queue_message)
+                    else:
+                        self.dispatcher.dispatch(message_queue_message)
+
+            if self.spool is not None:
+                # Only mark messages as handled once their callbacks are done
+                if self.dispatcher is not None:
+                    self.dispatcher.join()
+                self.message_queue.commit()
+                if self.dedup is not None:
+                    for message_queue_message in message_queue_messages:
+                        self.dedup.remember(message_queue_message)
+
+    def _callbacks_for(self, channel):
+        try:
+            return self.dispatch_cache[channel]
+        except KeyError:
+            pass
+
+        callbacks = ()
+        for subscription in self.channel_trie.match(channel):
+            callbacks += self.dispatch_table.get(subscription, ())
+
+        if len(callbacks) == 0:
+            LOG.info('no subscription for message on channel %s', channel)
+
+        if len(self.dispatch_cache) >= self.channel_trie.max_cache_size:
+            self.dispatch_cache.clear()
+        self.dispatch_cache[channel] = callbacks
+
+        return callbacks
+
+    def _dispatch_message(self, message):
+        channel = message['channel']
+        if self.tracer is not None:
+            self.tracer.dispatch(self, channel)
+        for callback, function in self._callbacks_for(channel):
+            if self.tracer is None:
+                function(message)
+            else:
+                started = time.monotonic()
+                function(message)
+                self.tracer.callback(
+                    self,
+                    channel,
+                    callback,
+                    time.monotonic() - started
+                )
+
+        if self.checkpointer is not None:
+            self._checkpoint(message)
+        if self.dedup is not None and self.spool is None:
+            self.dedup.remember(message)
+
+    def _checkpoint(self, message):
+        replay_id = replay_id_of(message)
+        if replay_id is not None:
+            self.checkpointer.update(message['channel'], replay_id)
+
+    def _offload_messages(self, messages):
+        if self.tracer is not None:
+            for message in messages:
+                self.tracer.dispatch(self, message['channel'])
+
+        outcomes = self.offload_pool.run(
+            messages,
+            lambda message: [
+                function
+                for callback, function in self._callbacks_for(
+                    message['channel']
+                )
+            ]
+        )
+        for callback, message, result, exception, duration in outcomes:
+            if self.tracer is not None:
+                self.tracer.callback(
+                    self,
+                    message['channel'],
+                    callback,
+                    duration
+                )
+
+            if exception is None:
+                self.handler_result(message, callback, result)
+            else:
+                self.handler_exception(message, callback, exception)
+
+        if self.checkpointer is not None:
+            for message in messages:
+                self._checkpoint(message)
+        if self.dedup is not None and self.spool is None:
+            for message in messages:
+                self.dedup.remember(message)
 
-            for message_queue_message in message_queue_messages:
-                channel = message_queue_message['channel']
-                for callback in self.subscription_callbacks[channel]:
-                    getattr(self, callback)(message_queue_message)
+    # With handler_processes, called with the return value of every callback
+    def handler_result(self, message, callback, result):
+        pass
+
+    # With handler_processes, called with any exception a callback raises.
+    # As with callbacks run in the client, the exception stops the client.
+    def handler_exception(self, message, callback, exception):
+        raise exception
 
     def subscribe(self, channel, callback=None, **kwargs):
-        LOG.info('enqueueing subscription for channel {0}'.format(
-            channel
-        ))
+        if self.offload_pool is not None and not callable(callback):
+            raise ValueError(
+                'with handler_processes, callbacks must be functions'
+            )
+
+        LOG.info('enqueueing subscription for channel %s', channel)
         subscription_queue_message = {
-            'channel': channel
+            'channel': channel,
+            'result': gevent.event.AsyncResult()
         }
         subscription_queue_message.update(kwargs)
 
         if channel not in self.subscription_callbacks:
+            self.channel_trie.add(channel)
             self.subscription_callbacks[channel] = []
-            self.subscription_queue.put(subscription_queue_message)
+            self.subscription_states[channel] = 'pending'
+            self.subscription_results[channel] = \
+                subscription_queue_message['result']
+            self._enqueue(self.subscription_queue, subscription_queue_message)
 
         self.subscription_callbacks[channel].append(callback)
-
+        if callback is not None:
+            self.dispatch_table[channel] = \
+                self.dispatch_table.get(channel, ()) + \
+                ((callback, self._bind_callback(callback)),)
+            self.dispatch_cache.clear()
+
+        return self.subscription_results[channel]
+
+    # Callbacks may be the names of methods of this client, or any callable
+    def _bind_callback(self, callback):
+        return callback if callable(callback) else getattr(self, callback)
+
+    def _remove_subscription(self, channel):
+        self.subscription_callbacks.pop(channel, None)
+        self.subscription_results.pop(channel, None)
+        self.subscription_states.pop(channel, None)
+        self.channel_trie.remove(channel)
+        self.dispatch_table.pop(channel, None)
+        self.dispatch_cache.clear()
+
+    # After a re-handshake, sends a /meta/subscribe for every subscribed
+    # channel in one request.  Callbacks stay registered throughout.
+    # Channels still pending go out from the subscription queue as usual.
     def _resubscribe(self):
-        self.waiting_for_resubscribe = True
+        batch = []
+        for channel, state in self.subscription_states.items():
+            if state != 'subscribed':
+                continue
+
+            item = {
+                'channel': channel,
+                'result': gevent.event.AsyncResult()
+            }
+            self.subscription_results[channel] = item['result']
+            payload = self._subscribe_payload(item)
+            self._track_request(payload, item['result'])
+            batch.append((self.subscription_queue, item, payload))
 
-        current_subscriptions = deepcopy(self.subscription_callbacks)
-        self.subscription_callbacks.clear()
-        for channel, callbacks in current_subscriptions.items():
-            for callback in callbacks:
-                self.subscribe(channel, callback)
+        if len(batch) == 0:
+            return
 
-        self.waiting_for_resubscribe = False
+        started = time.monotonic()
+        self.subscriptions_ready.clear()
+        try:
+            if not self._send_batch(batch):
+                raise requests.exceptions.ReadTimeout(
+                    'resubscribe timed out'
+                )
+        except Exception:
+            # The channels are still marked subscribed, so the next
+            # handshake tries them again
+            self.reconnector.handshake_required = True
+            raise
+        finally:
+            self.subscriptions_ready.set()
+
+        if self.tracer is not None:
+            self.tracer.resubscribe(
+                self,
+                len(batch),
+                time.monotonic() - started
+            )
 
     def _subscribe_greenlet(self, successive_timeout_threshold=20,
                             timeout_wait=5):
-        channel = None
-
         successive_timeouts = 0
         while True:
-            try:
-                subscription_queue_message = self.subscription_queue.get(
-                    timeout=1
-                )
-                channel = subscription_queue_message['channel']
-            except gevent.queue.Empty:
-                if self.stop_greenlets:
-                    break
-                else:
-                    continue
+            subscription_queue_message = self.subscription_queue.get()
+            if subscription_queue_message is _STOP:
+                break
 
-            subscribe_request_payload = {
-                # MUST
-                'channel': '/meta/subscribe',
-                'subscription': channel,
-                'clientId': None,
-                # MAY
-                'id': None
-            }
+            self._trace_queue_wait('subscription', subscription_queue_message)
+
+            subscribe_request_payload = self._subscribe_payload(
+                subscription_queue_message
+            )
+            self._track_request(
+                subscribe_request_payload,
+                subscription_queue_message['result']
+            )
 
             subscribe_responses = []
             try:
@@ -324,6 +1010,7 @@ class BayeuxClient(object):
                     subscribe_request_payload
                 )
             except requests.exceptions.ReadTimeout:
+                self._untrack_request(subscribe_request_payload)
                 successive_timeouts += 1
 
                 if successive_timeouts > successive_timeout_threshold:
@@ -334,44 +1021,91 @@ class BayeuxClient(object):
             else:
                 successive_timeouts = 0
 
-            for element in subscribe_responses:
-                if not element['successful'] and \
-                   element['error'] == '403::Unknown client':
-                    # Just try again, and eventually connect() will re-try a
-                    # handshake
-                    self.subscription_queue.put(subscription_queue_message)
+            self._handle_subscribe_response(
+                subscription_queue_message,
+                subscribe_request_payload,
+                self._match_responses(subscribe_responses).get(
+                    subscribe_request_payload['id']
+                )
+            )
+
+    def _subscribe_payload(self, subscription_queue_message):
+        channel = subscription_queue_message['channel']
+        subscribe_request_payload = {
+            # MUST
+            'channel': '/meta/subscribe',
+            'subscription': channel,
+            'clientId': None,
+            # MAY
+            'id': None
+        }
+
+        # Built when the subscription is sent, so that a resubscribe picks up
+        # from the latest checkpoint
+        replay_id = None
+        if self.checkpointer is not None:
+            replay_id = self.checkpointer.get(channel)
+        if replay_id is None:
+            replay_id = self.default_replay_id
+        if replay_id is not None:
+            subscribe_request_payload['ext'] = {
+                'replay': {channel: replay_id}
+            }
+
+        return subscribe_request_payload
+
+    def _handle_subscribe_response(self, subscription_queue_message,
+                                   payload, element):
+        if element is not None and not element['successful'] and \
+           element.get('error') == '403::Unknown client':
+            # Just try again, and eventually connect() will re-try a
+            # handshake
+            self._untrack_request(payload)
+            self._enqueue(self.subscription_queue, subscription_queue_message)
+            return
+
+        channel = subscription_queue_message['channel']
+        if element is not None and channel in self.subscription_states:
+            self.subscription_states[channel] = \
+                'subscribed' if element.get('successful', True) \
+                else 'failed'
+        self._resolve_request(payload, element)
 
     def unsubscribe(self, subscription):
-        LOG.info('enqueueing unsubscription for channel {0}'.format(
-            subscription
-        ))
-        self.unsubscription_queue.put(subscription)
+        LOG.info('enqueueing unsubscription for channel %s', subscription)
+        self._remove_subscription(subscription)
+        result = gevent.event.AsyncResult()
+        self._enqueue(self.unsubscription_queue, {
+            'subscription': subscription,
+            'result': result
+        })
+        return result
 
     def _unsubscribe_greenlet(self, successive_timeout_threshold=20,
                               timeout_wait=5):
         successive_timeouts = 0
         while True:
-            unsubscription = None
-            try:
-                unsubscription = self.unsubscription_queue.get(timeout=1)
-            except gevent.queue.Empty:
-                if self.stop_greenlets:
-                    break
-                else:
-                    continue
+            unsubscription = self.unsubscription_queue.get()
+            if unsubscription is _STOP:
+                break
 
-            unsubscribe_request_payload = {
-                # MUST
-                'channel': '/meta/unsubscribe',
-                'subscription': unsubscription,
-                'clientId': None,
-                # MAY
-                'id': None
-            }
+            self._trace_queue_wait('unsubscription', unsubscription)
 
+            unsubscribe_request_payload = self._unsubscribe_payload(
+                unsubscription
+            )
+            self._track_request(
+                unsubscribe_request_payload,
+                unsubscription['result']
+            )
+
+            unsubscribe_responses = []
             try:
-                self._send_message(unsubscribe_request_payload)
+                unsubscribe_responses = self._send_message(
+                    unsubscribe_request_payload
+                )
             except requests.exceptions.ReadTimeout:
+                self._untrack_request(unsubscribe_request_payload)
                 successive_timeouts += 1
 
                 if successive_timeouts > successive_timeout_threshold:
@@ -382,41 +1116,321 @@ class BayeuxClient(object):
             else:
                 successive_timeouts = 0
 
+            self._resolve_request(
+                unsubscribe_request_payload,
+                self._match_responses(unsubscribe_responses).get(
+                    unsubscribe_request_payload['id']
+                )
+            )
+
+    def _unsubscribe_payload(self, unsubscription):
+        return {
+            # MUST
+            'channel': '/meta/unsubscribe',
+            'subscription': unsubscription['subscription'],
+            'clientId': None,
+            # MAY
+            'id': None
+        }
+
     def publish(self, channel, payload):
-        self.publication_queue.put({
+        result = gevent.event.AsyncResult()
+        self._enqueue(self.publication_queue, {
             'channel': channel,
-            'payload': payload
+            'payload': payload,
+            'result': result
         })
+        return result
 
-    def _publish_greenlet(self):
+    def _publish_greenlet(self, successive_timeout_threshold=20,
+                          timeout_wait=5):
+        successive_timeouts = 0
         while True:
-            publication = None
+            publication = self.publication_queue.get()
+            if publication is _STOP:
+                break
+
+            self._trace_queue_wait('publication', publication)
+
+            publish_request_payload = self._publish_payload(publication)
+            self._track_request(
+                publish_request_payload,
+                publication['result']
+            )
+
+            # A lost transport is retried, as subscribes are, once the
+            # connect greenlet has handshaken again.  Directly raise other
+            # exceptions: after a plain timeout the server may well have
+            # the publication, and we won't send it twice.
             try:
-                publication = self.publication_queue.get(timeout=1)
-            except gevent.queue.Empty:
-                if self.stop_greenlets:
+                publish_response = self._send_message(publish_request_payload)
+            except TransportClosedException:
+                successive_timeouts += 1
+
+                if successive_timeouts > successive_timeout_threshold:
+                    exception = RepeatedTimeoutException('publish')
+                    self._fail_request(publish_request_payload, exception)
+                    raise exception
+
+                self._untrack_request(publish_request_payload)
+                gevent.sleep(timeout_wait)
+                self.publication_queue.put(publication)
+                continue
+            except Exception as e:
+                self._fail_request(publish_request_payload, e)
+                raise
+
+            successive_timeouts = 0
+
+            LOG.info('publish response: %s', publish_response)
+
+            self._resolve_request(
+                publish_request_payload,
+                self._match_responses(publish_response).get(
+                    publish_request_payload['id']
+                )
+            )
+
+    def _publish_payload(self, publication):
+        return {
+            # MUST
+            'channel': publication['channel'],
+            'data': publication['payload'],
+            # MAY
+            'clientId': None,
+            'id': None
+        }
+
+    def _enqueue(self, queue, item):
+        item['enqueued'] = time.monotonic()
+        item['sequence'] = next(self.outbound_sequence)
+        queue.put(item)
+        self.outbound_event.set()
+        if self.hub is not None:
+            self.hub.schedule(self)
+
+    def _trace_queue_wait(self, queue_name, item):
+        if self.tracer is not None:
+            self.tracer.queue_wait(
+                self,
+                queue_name,
+                time.monotonic() - item['enqueued']
+            )
+
+    def _track_request(self, payload, result):
+        # Assign the id now, rather than in _send_message(), so the request
+        # is in the table before it goes over the wire
+        payload['id'] = str(self.message_counter)
+        self.message_counter += 1
+
+        self.pending_requests[payload['id']] = result
+        if self.request_timeout is not None:
+            # The deadline carries its result, so it only ever expires the
+            # request it was set for
+            heapq.heappush(
+                self.request_deadlines,
+                (time.monotonic() + self.request_timeout,
+                 next(self.request_sequence), payload['id'], result)
+            )
+            self.pending_event.set()
+
+    def _untrack_request(self, payload):
+        return self.pending_requests.pop(payload['id'], None)
+
+    def _fail_request(self, payload, exception):
+        result = self._untrack_request(payload)
+        if result is not None:
+            result.set_exception(exception)
+
+    def _resolve_request(self, payload, element):
+        result = self._untrack_request(payload)
+        if result is None:
+            # Already timed out
+            return
+
+        if element is None:
+            result.set_exception(MissingResponseException(payload['id']))
+        elif element.get('successful', True):
+            result.set(element)
+        else:
+            result.set_exception(UnsuccessfulResponseException(element))
+
+    # At shutdown, fails the results of requests in flight and of messages
+    # that were never sent, so nobody waits on them forever
+    def _fail_outstanding(self):
+        for message_id, result in list(self.pending_requests.items()):
+            result.set_exception(ClientShutdownException())
+        self.pending_requests.clear()
+
+        for queue in (self.subscription_queue, self.unsubscription_queue,
+                      self.publication_queue):
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except gevent.queue.Empty:
                     break
-                else:
-                    continue
+                if item is not _STOP and not item['result'].ready():
+                    item['result'].set_exception(ClientShutdownException())
 
-            channel = publication['channel']
+    def _match_responses(self, responses):
+        responses_by_id = {}
+        for element in responses or []:
+            responses_by_id[element.get('id')] = element
 
-            # Note that this return value isn't going anywhere.
-            publish_request_payload = {
-                # MUST
-                'channel': channel,
-                'data': publication['payload'],
-                # MAY
-                'clientId': None,
-                'id': None
-            }
+        return responses_by_id
 
-            # Directly raise exceptions
-            publish_response = self._send_message(publish_request_payload)
+    def _request_timeout_greenlet(self):
+        while not self.stop_greenlets:
+            if len(self.request_deadlines) == 0:
+                self.pending_event.clear()
+                self.pending_event.wait()
+                continue
+
+            deadline, sequence, message_id, result = \
+                self.request_deadlines[0]
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                # Deadlines only ever come later, so the first one stays
+                # first
+                self.pending_event.clear()
+                self.pending_event.wait(remaining)
+                continue
+
+            heapq.heappop(self.request_deadlines)
+            if self.pending_requests.get(message_id) is result:
+                del self.pending_requests[message_id]
+                result.set_exception(RequestTimeoutException(message_id))
+
+    def _drain_outbound(self):
+        # Messages go in the order they were queued, whichever queue they are
+        # on, so unsubscribing and then subscribing again leaves us
+        # subscribed, and a publish doesn't get ahead of an earlier subscribe
+        queues = (
+            (self.subscription_queue, 'subscription',
+             self._subscribe_payload),
+            (self.unsubscription_queue, 'unsubscription',
+             self._unsubscribe_payload),
+            (self.publication_queue, 'publication',
+             self._publish_payload)
+        )
+        batch = []
+        while len(batch) < self.max_batch_size:
+            heads = []
+            for queue, queue_name, payload_method in queues:
+                try:
+                    heads.append((queue.peek_nowait()['sequence'], queue,
+                                  queue_name, payload_method))
+                except gevent.queue.Empty:
+                    pass
+            if len(heads) == 0:
+                break
+
+            sequence, queue, queue_name, payload_method = \
+                min(heads, key=lambda head: head[0])
+            item = queue.get_nowait()
+            self._trace_queue_wait(queue_name, item)
+            payload = payload_method(item)
+            self._track_request(payload, item['result'])
+            batch.append((queue, item, payload))
+
+        return batch
+
+    def _batch_greenlet(self, successive_timeout_threshold=20,
+                        timeout_wait=5):
+        while True:
+            self.outbound_event.wait()
+            if self.stop_greenlets and not self._has_outbound():
+                break
+
+            if self.batch_linger:
+                gevent.sleep(self.batch_linger)
+
+            self.outbound_event.clear()
+            self._send_outbound(successive_timeout_threshold, timeout_wait)
+            if self._has_outbound() or self.stop_greenlets:
+                # There is more than one batch's worth of work, or we need to
+                # see that there isn't before we stop
+                self.outbound_event.set()
+
+    def _outbound_size(self):
+        return self.subscription_queue.qsize() + \
+            self.unsubscription_queue.qsize() + \
+            self.publication_queue.qsize()
+
+    def _has_outbound(self):
+        return self._outbound_size() > 0
+
+    # Sends up to max_batch_size queued messages in one request, and returns
+    # how many requests were made.  Timed out messages are queued again.
+    def _send_outbound(self, successive_timeout_threshold=20,
+                       timeout_wait=5):
+        if self.client_id is None:
+            # With a hub, we handshake when we first have work
+            self.handshake()
+
+        batch = self._drain_outbound()
+        if len(batch) == 0:
+            return 0
+
+        if self._send_batch(batch):
+            self.successive_timeouts = 0
+            return 1
+
+        self.successive_timeouts += 1
+        if self.successive_timeouts > successive_timeout_threshold:
+            raise RepeatedTimeoutException('batch')
+
+        gevent.sleep(timeout_wait)
+        for queue, item, payload in batch:
+            self._enqueue(queue, item)
+        return 1
+
+    # Returns False if the request timed out
+    def _send_batch(self, batch):
+        try:
+            batch_responses = self._send_message(
+                [payload for queue, item, payload in batch]
+            )
+        except requests.exceptions.ReadTimeout:
+            for queue, item, payload in batch:
+                self._untrack_request(payload)
+            return False
+        except Exception as e:
+            for queue, item, payload in batch:
+                self._fail_request(payload, e)
+            raise
+
+        # Split the array response back out to the messages that caused
+        # each element
+        responses_by_id = self._match_responses(batch_responses)
+
+        for queue, item, payload in batch:
+            element = responses_by_id.get(payload['id'])
+
+            if queue is self.subscription_queue:
+                self._handle_subscribe_response(item, payload, element)
+            else:
+                LOG.info('%s response: %s', payload['channel'], element)
+                self._resolve_request(payload, element)
+
+        return True
+
+    # With a hub, called once we have subscribed
+    def _start_connect_greenlet(self):
+        if len(self.inbound_greenlets) > 0 or self.stop_greenlets:
+            return
 
-            LOG.info('publish response: {0}'.format(str(publish_response)))
+        connect_greenlet = gevent.Greenlet(self._connect_greenlet)
+        connect_greenlet.link_exception(self._exception_callback)
+        self.inbound_greenlets.append(connect_greenlet)
+        self.greenlets.append(connect_greenlet)
+        connect_greenlet.start()
 
     def start(self):
+        if self.tracer is not None:
+            self.tracer.start(self)
+        if self.dispatcher is not None:
+            self.dispatcher.start(self._exception_callback)
         for greenlet in self.outbound_greenlets:
             greenlet.start()
         for greenlet in self.inbound_greenlets:
@@ -435,15 +1449,24 @@ class BayeuxClient(object):
         block_greenlet.start()
         # give the execute greenlet a chance to start, so self.executing is
         # True if we call block() later
-        gevent.sleep(0.1)
+        gevent.sleep(0)
 
     def block(self):
-        if not self.executing:
+        if self.hub is not None:
+            # The hub runs our callbacks
+            self.hub.block()
+        elif not self.executing:
             self._execute_greenlet()
         else:
-            # block the main greenlet
-            while self.exception is None and any(self.greenlets):
-                gevent.sleep(1)
+            # block the main greenlet until we have shut down, a greenlet
+            # has failed, or every greenlet has finished
+            current = gevent.getcurrent()
+            while self.exception is None and not self.shutdown_completed:
+                running = [greenlet for greenlet in self.greenlets
+                           if greenlet and greenlet is not current]
+                if len(running) == 0:
+                    break
+                gevent.wait([self.shutdown_event] + running, count=1)
 
         if self.exception is not None:
             raise self.exception
@@ -456,20 +1479,88 @@ class BayeuxClient(object):
 
             LOG.info('client id {0} is shutting down'.format(self.client_id))
 
-            # disconnect() runs in the main greenlet, so we want to give the
-            # others a chance to finish
             # If we have been called by a callback (that is, the client wants
             # to shut down itself), then we don't want to wait for the execute
             # greenlet to stop, because we'll deadlock.
             # This also means that subclasses should not change self.greenlets
             relevant_greenlets = \
                 self.greenlets[:-1] \
-                if gevent.getcurrent() == self.greenlets[-1] \
+                if self.greenlets and \
+                gevent.getcurrent() == self.greenlets[-1] \
                 else self.greenlets
+            # Those never started (with start=False) have nothing to finish
+            relevant_greenlets = [greenlet for greenlet in relevant_greenlets
+                                  if greenlet.started]
+
+            # Likewise, if a dispatch worker called us, the execute greenlet
+            # may be waiting for that worker to make room, or to finish
+            # before committing to the spool
+            if self.dispatcher is not None and \
+               gevent.getcurrent() in self.dispatcher.workers:
+                self.dispatcher.release()
+
+            # Let the outbound greenlets send what they have, then
+            # disconnect, which has the server answer a connect it is
+            # holding, so we don't wait out the long poll before the connect
+            # greenlet sees it should stop
+            gevent.joinall([greenlet for greenlet in relevant_greenlets
+                            if greenlet in self.outbound_greenlets])
+            if self.client_id is not None:
+                try:
+                    self.disconnect()
+                except Exception as e:
+                    LOG.warning(
+                        'client id %s could not disconnect: %s',
+                        self.client_id,
+                        e
+                    )
 
             gevent.joinall(relevant_greenlets)
-            self.disconnect()
+            self._fail_outstanding()
+            if self.dispatcher is not None:
+                # Let callbacks finish the messages they have already been
+                # given
+                self.dispatcher.shutdown()
+            if self.offload_pool is not None:
+                self.offload_pool.shutdown()
+            if self.spool is not None:
+                self.spool.close()
+            if self.checkpointer is not None:
+                self.checkpointer.close()
+            if self.dedup is not None:
+                self.dedup.close()
+            if self.hub is not None:
+                self.hub.remove(self)
+            if self.transport is not None:
+                self.transport.close()
+            if self.tracer is not None:
+                self.tracer.stop(self)
             self.shutdown_completed = True
+            self.shutdown_event.set()
+
+    # Setting stop_greenlets wakes every greenlet that is waiting for work, so
+    # that each finishes what it has and stops, without having to poll
+    @property
+    def stop_greenlets(self):
+        return self.stop_event.is_set()
+
+    @stop_greenlets.setter
+    def stop_greenlets(self, stop):
+        if not stop:
+            self.stop_event.clear()
+            return
+        if self.stop_event.is_set():
+            return
+
+        self.stop_event.set()
+        if self.hub is None and self.max_batch_size <= 1:
+            self.subscription_queue.put(_STOP)
+            self.unsubscription_queue.put(_STOP)
+            self.publication_queue.put(_STOP)
+        self.outbound_event.set()
+        self.pending_event.set()
+        # The execute greenlet stops once the queue is empty
+        self.message_queue.close()
 
     def _exception_callback(self, failed_greenlet):
         LOG.info(
@@ -496,8 +1587,8 @@ class BayeuxClient(object):
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.shutdown()
-        while not self.shutdown_completed:
-            gevent.sleep(0.5)
+        # If shutdown() is already running elsewhere, wait for it
+        self.shutdown_event.wait()
 
 
 class RepeatedTimeoutException(Exception):
@@ -511,3 +1602,49 @@ class RepeatedTimeoutException(Exception):
 class UnexpectedConnectResponseException(Exception):
     def __init__(self, message):
         super(UnexpectedConnectResponseException, self).__init__(message)
+
+
+class ServerErrorException(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        super(ServerErrorException, self).__init__(
+            'Server error {0}'.format(status_code)
+        )
+
+
+class ReconnectRefusedException(Exception):
+    def __init__(self):
+        super(ReconnectRefusedException, self).__init__(
+            'The server advised us not to reconnect'
+        )
+
+
+class UnsuccessfulResponseException(Exception):
+    def __init__(self, response):
+        self.response = response
+        super(UnsuccessfulResponseException, self).__init__(
+            response.get('error', str(response))
+        )
+
+
+class MissingResponseException(Exception):
+    def __init__(self, message_id):
+        self.message_id = message_id
+        super(MissingResponseException, self).__init__(
+            'No response element for message {0}'.format(message_id)
+        )
+
+
+class ClientShutdownException(Exception):
+    def __init__(self):
+        super(ClientShutdownException, self).__init__(
+            'The client shut down before a response came'
+        )
+
+
+class RequestTimeoutException(Exception):
+    def __init__(self, message_id):
+        self.message_id = message_id
+        super(RequestTimeoutException, self).__init__(
+            'No response to message {0}'.format(message_id)
+        )
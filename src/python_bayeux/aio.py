@@ -0,0 +1,441 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import asyncio
+import logging
+
+from python_bayeux import ReconnectRefusedException
+from python_bayeux import RepeatedTimeoutException
+from python_bayeux import ServerErrorException
+from python_bayeux import UnexpectedConnectResponseException
+from python_bayeux import UnsuccessfulResponseException
+from python_bayeux.codec import default_codec
+from python_bayeux.reconnect import Reconnector
+
+LOG = logging.getLogger('python_bayeux.aio')
+
+# Put on the message queue to wake up message iterators at shutdown
+_STOP = object()
+
+
+# An asyncio counterpart to BayeuxClient.  Instead of greenlets and
+# gevent.queue.Queues, the connect loop is an asyncio task feeding an
+# asyncio.Queue, and subscribe(), unsubscribe() and publish() are coroutines
+# that return the server's response.  Requires httpx, unless an object with
+# the same async post() is passed as http_client.
+#
+#     async with AsyncBayeuxClient(endpoint) as client:
+#         await client.subscribe('/chat/demo')
+#         async for message in client:
+#             ...
+class AsyncBayeuxClient(object):
+    def __init__(self, endpoint=None, http_client=None,
+                 successive_timeout_threshold=20, timeout_wait=5,
+                 codec=None, reconnect_backoff=0.5,
+                 max_reconnect_backoff=60):
+        self.endpoint = endpoint
+        self.codec = default_codec() if codec is None else codec
+        self.http_client = http_client
+        self.owns_http_client = http_client is None
+        self.successive_timeout_threshold = successive_timeout_threshold
+        self.timeout_wait = timeout_wait
+
+        self.message_queue = asyncio.Queue()
+        self.subscription_callbacks = {}
+
+        self.client_id = None
+        self.message_counter = 1
+        # See BayeuxClient and python_bayeux.reconnect
+        self.reconnector = Reconnector(
+            backoff=reconnect_backoff,
+            max_backoff=max_reconnect_backoff
+        )
+        self.connect_task = None
+        self.shutdown_called = False
+        self.disconnect_complete = False
+        self.exception = None
+
+    async def start(self):
+        if self.http_client is None:
+            import httpx
+            self.http_client = httpx.AsyncClient()
+
+        await self.handshake()
+        self.connect_task = asyncio.ensure_future(self._connect_loop())
+        self.connect_task.add_done_callback(self._connect_task_done)
+
+    async def handshake(self, **kwargs):
+        handshake_payload = {
+            # MUST
+            'channel': '/meta/handshake',
+            'supportedConnectionTypes': ['long-polling'],
+            'version': '1.0',
+            # MAY
+            'id': None,
+            'minimumVersion': '1.0'
+        }
+        handshake_payload.update(kwargs)
+        handshake_response = \
+            (await self._send_message(handshake_payload))[0]
+        if not handshake_response.get('successful', False):
+            self.reconnector.unsuccessful(handshake_response)
+            raise UnsuccessfulResponseException(handshake_response)
+
+        self.client_id = handshake_response['clientId']
+        self.reconnector.handshook(handshake_response)
+
+        # Connect one time to get the server's timeout advice
+        initial_connect_response = await self.connect(initial=True)
+        self._follow_connect_advice(initial_connect_response[0])
+
+    # The advice of the last connect, in seconds
+    @property
+    def connect_timeout(self):
+        return self.reconnector.timeout
+
+    @property
+    def connection_state(self):
+        return self.reconnector.state
+
+    def _follow_connect_advice(self, element):
+        if element.get('successful', False):
+            self.reconnector.connected(element)
+        else:
+            LOG.warning(
+                'client id %s connect failed: %s',
+                self.client_id,
+                element.get('error')
+            )
+            self.reconnector.unsuccessful(element)
+
+    async def disconnect(self):
+        disconnect_response = await self._send_message({
+            # MUST
+            'channel': '/meta/disconnect',
+            'clientId': None,
+            # MAY
+            'id': None
+        })
+        self.disconnect_complete = True
+        return disconnect_response
+
+    async def connect(self, initial=False):
+        connect_request_payload = {
+            # MUST
+            'channel': '/meta/connect',
+            'connectionType': 'long-polling',
+            'clientId': None,
+            # MAY
+            'id': None
+        }
+
+        # The server holds a connect for up to connect_timeout, so give the
+        # request a little longer than that before we give up on it
+        timeout = None
+        if not initial and self.connect_timeout is not None:
+            timeout = self.connect_timeout + self.timeout_wait
+
+        return await self._send_message(
+            connect_request_payload,
+            timeout=timeout
+        )
+
+    async def _send_message(self, payload, timeout=None):
+        for message in payload if isinstance(payload, list) else [payload]:
+            if 'id' in message and message['id'] is None:
+                message['id'] = str(self.message_counter)
+                self.message_counter += 1
+
+            if 'clientId' in message:
+                message['clientId'] = self.client_id
+
+        LOG.info('_send_message(): payload: %s', payload)
+
+        response = await self.http_client.post(
+            self.endpoint,
+            content=self.codec.dumps(payload),
+            headers={'Content-Type': 'application/json'},
+            timeout=timeout
+        )
+
+        if response.status_code >= 500 and \
+           not isinstance(payload, list) and \
+           payload['channel'] in ('/meta/handshake', '/meta/connect'):
+            raise ServerErrorException(response.status_code)
+
+        content = response.content
+
+        LOG.info(
+            '_send_message(): response status code: %s  response content: %s',
+            response.status_code,
+            content
+        )
+
+        if len(content) == 0:
+            return ''
+
+        return self.codec.loads(content)
+
+    async def _send_with_retries(self, payload, retry_name):
+        # Mirrors the subscribe and unsubscribe greenlets of BayeuxClient:
+        # retry read timeouts, and retry unknown client errors, which the
+        # connect loop will fix by handshaking again
+        import httpx
+
+        successive_timeouts = 0
+        while True:
+            payload['id'] = None
+            try:
+                responses = await self._send_message(payload)
+            except httpx.ReadTimeout:
+                successive_timeouts += 1
+                if successive_timeouts > self.successive_timeout_threshold:
+                    raise RepeatedTimeoutException(retry_name)
+                await asyncio.sleep(self.timeout_wait)
+                continue
+
+            element = self._match_response(payload, responses)
+            if element is not None and not element['successful'] and \
+               element.get('error') == '403::Unknown client':
+                await asyncio.sleep(self.timeout_wait)
+                continue
+
+            return self._check_response(element)
+
+    def _match_response(self, payload, responses):
+        for element in responses or []:
+            if element.get('id') == payload['id']:
+                return element
+        return None
+
+    def _check_response(self, element):
+        if element is not None and not element.get('successful', True):
+            raise UnsuccessfulResponseException(element)
+        return element
+
+    async def subscribe(self, channel, callback=None):
+        if channel in self.subscription_callbacks:
+            self.subscription_callbacks[channel].append(callback)
+            return None
+
+        self.subscription_callbacks[channel] = [callback]
+        return await self._send_with_retries({
+            # MUST
+            'channel': '/meta/subscribe',
+            'subscription': channel,
+            'clientId': None,
+            # MAY
+            'id': None
+        }, 'subscribe')
+
+    # After a re-handshake, restores every channel in one request
+    async def _resubscribe(self):
+        payload = [
+            {
+                'channel': '/meta/subscribe',
+                'subscription': channel,
+                'clientId': None,
+                'id': None
+            }
+            for channel in self.subscription_callbacks
+        ]
+        if len(payload) == 0:
+            return
+
+        try:
+            responses = await self._send_message(payload)
+        except Exception:
+            self.reconnector.handshake_required = True
+            raise
+
+        for message in payload:
+            element = self._match_response(message, responses)
+            if element is None or element.get('successful', True):
+                continue
+
+            LOG.warning(
+                'client id %s could not resubscribe to %s: %s',
+                self.client_id,
+                message['subscription'],
+                element.get('error')
+            )
+            if element.get('error') == '403::Unknown client':
+                self.reconnector.handshake_required = True
+
+    async def unsubscribe(self, subscription):
+        self.subscription_callbacks.pop(subscription, None)
+        return await self._send_with_retries({
+            # MUST
+            'channel': '/meta/unsubscribe',
+            'subscription': subscription,
+            'clientId': None,
+            # MAY
+            'id': None
+        }, 'unsubscribe')
+
+    async def publish(self, channel, payload):
+        publish_request_payload = {
+            # MUST
+            'channel': channel,
+            'data': payload,
+            # MAY
+            'clientId': None,
+            'id': None
+        }
+        publish_response = await self._send_message(publish_request_payload)
+        return self._check_response(
+            self._match_response(publish_request_payload, publish_response)
+        )
+
+    async def _connect_loop(self):
+        import httpx
+
+        reconnector = self.reconnector
+
+        while not self.shutdown_called:
+            await asyncio.sleep(reconnector.delay())
+            if self.shutdown_called:
+                break
+
+            reconnector.attempting()
+            try:
+                if reconnector.handshake_required:
+                    await self.handshake()
+                    await self._resubscribe()
+                    continue
+
+                connect_response = await self.connect()
+            except (httpx.TransportError,
+                    ServerErrorException,
+                    UnsuccessfulResponseException) as e:
+                LOG.info('connect loop failed: %s', e)
+                # handshake() has already counted an unsuccessful response
+                if not isinstance(e, UnsuccessfulResponseException):
+                    reconnector.failed()
+                self._check_reconnect_refused()
+                continue
+
+            if not isinstance(connect_response, list):
+                raise UnexpectedConnectResponseException(
+                    str(connect_response)
+                )
+
+            connect_element = None
+            for element in connect_response:
+                if element['channel'] == '/meta/connect':
+                    connect_element = element
+                else:
+                    # We got a push!
+                    self.message_queue.put_nowait(element)
+
+            if connect_element is None:
+                reconnector.failed()
+            else:
+                self._follow_connect_advice(connect_element)
+            self._check_reconnect_refused()
+
+    def _check_reconnect_refused(self):
+        if self.reconnector.stopped and not self.shutdown_called:
+            raise ReconnectRefusedException()
+
+    def _connect_task_done(self, task):
+        if task.cancelled():
+            return
+
+        if task.exception() is not None:
+            LOG.info(
+                'client id %s has an unhandled exception in the connect '
+                'loop: %s',
+                self.client_id,
+                task.exception()
+            )
+            self.exception = task.exception()
+            self.message_queue.put_nowait(_STOP)
+
+    async def messages(self):
+        while True:
+            message = await self.message_queue.get()
+            if message is _STOP:
+                # Let any other iterators see it too
+                self.message_queue.put_nowait(_STOP)
+                if self.exception is not None:
+                    raise self.exception
+                return
+            yield message
+
+    def __aiter__(self):
+        return self.messages()
+
+    # Runs the callbacks given to subscribe() for every message until
+    # shutdown.  Callbacks may be method names, as with BayeuxClient, or
+    # callables, and may be coroutine functions.
+    async def run(self):
+        async for message in self.messages():
+            channel = message['channel']
+            for callback in self.subscription_callbacks.get(channel, []):
+                if callback is None:
+                    continue
+                if not callable(callback):
+                    callback = getattr(self, callback)
+                result = callback(message)
+                if asyncio.iscoroutine(result):
+                    await result
+
+    async def shutdown(self):
+        if self.shutdown_called:
+            return
+        self.shutdown_called = True
+
+        LOG.info('client id %s is shutting down', self.client_id)
+
+        if self.connect_task is not None and \
+           self.connect_task is not asyncio.current_task():
+            self.connect_task.cancel()
+            try:
+                await self.connect_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # Already recorded in self.exception
+                pass
+
+        self.message_queue.put_nowait(_STOP)
+        try:
+            await self.disconnect()
+        finally:
+            if self.owns_http_client:
+                await self.http_client.aclose()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.shutdown()
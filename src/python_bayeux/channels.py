@@ -0,0 +1,158 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+# An index of subscribed channel patterns, which may end in a bayeux wildcard
+# segment: '/a/*' matches '/a/b' but not '/a/b/c', and '/a/**' matches both.
+# Wildcards are only allowed as the last segment, so matching a channel only
+# walks the channel's own segments, however many patterns there are.
+# Results are cached until the patterns change.
+class ChannelTrie(object):
+    def __init__(self, max_cache_size=10000):
+        self.root = _Node()
+        self.patterns = set()
+        self.cache = {}
+        self.max_cache_size = max_cache_size
+
+    def add(self, pattern):
+        if pattern in self.patterns:
+            return
+
+        segments = _segments(pattern)
+        for segment in segments[:-1]:
+            if segment in ('*', '**'):
+                raise ValueError(
+                    'wildcards are only allowed at the end of a channel: '
+                    '{0}'.format(pattern)
+                )
+
+        node = self.root
+        for segment in segments[:-1]:
+            node = node.children.setdefault(segment, _Node())
+
+        last = segments[-1]
+        if last == '*':
+            node.single = pattern
+        elif last == '**':
+            node.multi = pattern
+        else:
+            node.children.setdefault(last, _Node()).exact = pattern
+
+        self.patterns.add(pattern)
+        self.cache.clear()
+
+    def remove(self, pattern):
+        if pattern not in self.patterns:
+            return
+
+        segments = _segments(pattern)
+        path = [self.root]
+        for segment in segments[:-1]:
+            path.append(path[-1].children[segment])
+
+        node = path[-1]
+        last = segments[-1]
+        if last == '*':
+            node.single = None
+        elif last == '**':
+            node.multi = None
+        else:
+            path.append(node.children[last])
+            path[-1].exact = None
+
+        # Prune nodes that no longer lead anywhere
+        for depth in range(len(path) - 1, 0, -1):
+            if not path[depth].empty():
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+        self.patterns.discard(pattern)
+        self.cache.clear()
+
+    def clear(self):
+        self.root = _Node()
+        self.patterns.clear()
+        self.cache.clear()
+
+    # The subscribed patterns that match channel, most general first
+    def match(self, channel):
+        try:
+            return self.cache[channel]
+        except KeyError:
+            pass
+
+        matches = []
+        segments = _segments(channel)
+        remaining = len(segments)
+        node = self.root
+        for segment in segments:
+            if node.multi is not None:
+                matches.append(node.multi)
+            if node.single is not None and remaining == 1:
+                matches.append(node.single)
+
+            node = node.children.get(segment)
+            if node is None:
+                break
+            remaining -= 1
+        else:
+            if node.exact is not None:
+                matches.append(node.exact)
+
+        matches = tuple(matches)
+        if len(self.cache) >= self.max_cache_size:
+            self.cache.clear()
+        self.cache[channel] = matches
+
+        return matches
+
+    def __contains__(self, pattern):
+        return pattern in self.patterns
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+class _Node(object):
+    __slots__ = ('children', 'exact', 'single', 'multi')
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.single = None
+        self.multi = None
+
+    def empty(self):
+        return not self.children and self.exact is None and \
+            self.single is None and self.multi is None
+
+
+def _segments(channel):
+    return channel.strip('/').split('/')
@@ -0,0 +1,180 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os
+import sqlite3
+import time
+
+import gevent
+import simplejson as json
+
+from python_bayeux.message import Message
+
+
+# Where ReplayCheckpointer keeps the last replay id handled on each channel.
+# load() returns {channel: replay id}, and save() is given the channels that
+# changed since the last save().
+class CheckpointStore(object):
+    def load(self):
+        return {}
+
+    def save(self, checkpoints):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self):
+        self.checkpoints = {}
+
+    def load(self):
+        return dict(self.checkpoints)
+
+    def save(self, checkpoints):
+        self.checkpoints.update(checkpoints)
+
+
+# Keeps every checkpoint in one JSON file, replaced atomically on save
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, path):
+        self.path = path
+        self.checkpoints = {}
+
+    def load(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                self.checkpoints = json.load(checkpoint_file)
+        except IOError:
+            self.checkpoints = {}
+        return dict(self.checkpoints)
+
+    def save(self, checkpoints):
+        self.checkpoints.update(checkpoints)
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.checkpoints, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+
+# Keeps checkpoints in a table of an SQLite database, which may be shared by
+# several clients
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, path, table='replay_checkpoints'):
+        self.table = table
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            'channel TEXT PRIMARY KEY, replay_id INTEGER NOT NULL)'.format(
+                table
+            )
+        )
+        self.connection.commit()
+
+    def load(self):
+        return dict(self.connection.execute(
+            'SELECT channel, replay_id FROM {0}'.format(self.table)
+        ))
+
+    def save(self, checkpoints):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO {0} (channel, replay_id) '
+                'VALUES (?, ?)'.format(self.table),
+                checkpoints.items()
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+# Tracks the last replay id handled on each channel.  Updates are kept in
+# memory and saved to the store in batches: after flush_every updates, or
+# once flush_interval seconds have passed since the last save (by a timer, if
+# no update comes along to do it), and at shutdown.
+class ReplayCheckpointer(object):
+    def __init__(self, store, flush_every=100, flush_interval=1.0):
+        self.store = store
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.checkpoints = store.load()
+        self.dirty = {}
+        self.updates = 0
+        self.last_flush = time.monotonic()
+        self.flush_timer = None
+
+    def get(self, channel):
+        return self.checkpoints.get(channel)
+
+    def update(self, channel, replay_id):
+        self.checkpoints[channel] = replay_id
+        self.dirty[channel] = replay_id
+        self.updates += 1
+
+        since_flush = time.monotonic() - self.last_flush
+        if self.updates >= self.flush_every or \
+           since_flush >= self.flush_interval:
+            self.flush()
+        elif self.flush_timer is None:
+            self.flush_timer = gevent.spawn_later(
+                self.flush_interval - since_flush,
+                self._timed_flush
+            )
+
+    def _timed_flush(self):
+        self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        if self.dirty:
+            self.store.save(self.dirty)
+            self.dirty = {}
+        self.updates = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.flush_timer is not None:
+            self.flush_timer.kill()
+            self.flush_timer = None
+        self.flush()
+        self.store.close()
+
+
+# The replay id of a message, as sent by Salesforce streaming, or None
+def replay_id_of(message):
+    if isinstance(message, Message):
+        return message.replay_id
+
+    try:
+        return message['data']['event']['replayId']
+    except (KeyError, TypeError):
+        return None
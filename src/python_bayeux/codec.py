@@ -0,0 +1,86 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import simplejson
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# Turns bayeux messages into request bodies and response bodies back into
+# messages.  dumps() returns bytes and loads() takes bytes, so a response is
+# decoded once, straight from the bytes that came off the wire.
+class Codec(object):
+    name = None
+
+    def dumps(self, payload):
+        raise NotImplementedError()
+
+    def loads(self, data):
+        raise NotImplementedError()
+
+
+class SimplejsonCodec(Codec):
+    name = 'simplejson'
+
+    def dumps(self, payload):
+        return simplejson.dumps(payload).encode('utf-8')
+
+    def loads(self, data):
+        return simplejson.loads(data)
+
+
+# Several times faster than simplejson at both ends, if orjson is installed.
+# Non-string keys are encoded as strings, as simplejson does, and payloads
+# orjson can't encode at all, such as ones holding Decimals, are encoded by
+# simplejson instead, so installing orjson doesn't change what can be
+# published.
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('OrjsonCodec requires orjson')
+
+    def dumps(self, payload):
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return simplejson.dumps(payload).encode('utf-8')
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+# The fastest codec available
+def default_codec():
+    return OrjsonCodec() if orjson is not None else SimplejsonCodec()
@@ -0,0 +1,242 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import os
+import sys
+import time
+
+import simplejson as json
+
+from python_bayeux.checkpoint import replay_id_of
+
+# Roughly what each entry costs besides its key: the OrderedDict entry and
+# its links, and the expiry time
+_ENTRY_OVERHEAD = 120
+
+
+# Keys for DedupCache.  Messages without one are never treated as
+# duplicates.
+def replay_key(message):
+    replay_id = replay_id_of(message)
+    return None if replay_id is None else (message['channel'], replay_id)
+
+
+# Only safe if the server gives every message its own id.  Bayeux message ids
+# are chosen by each publisher, and usually count up from 1, so two
+# publishers, or one that has restarted, soon reuse them, and different
+# messages would be dropped as duplicates.
+def id_key(message):
+    message_id = message.get('id')
+    return None if message_id is None else (message['channel'], message_id)
+
+
+KEYS = {
+    'replay': replay_key,
+    'id': id_key,
+}
+
+
+# Remembers the keys of recently handled messages, so that one delivered
+# again (after a re-handshake, a replay, or by an at-least-once server) can be
+# dropped before it reaches any callback.
+#
+# filter() only checks messages; the client calls remember() for each once its
+# callbacks have finished (and, with a spool, once it is committed), so a
+# message whose callback failed, or that was cut short by a crash, is handled
+# again when it is redelivered.  Meanwhile, the messages filter() let through
+# are kept in in_flight, so that a copy arriving before the first is handled
+# is dropped too.
+#
+# key is 'replay', 'id', or a function of the message returning a hashable,
+# JSON serializable key or None; by default, the channel and replay id, so
+# that messages without a replay id are never dropped.  The least recently
+# seen keys are forgotten once there are more than max_entries of them, or
+# once they take up more than roughly max_bytes, and any key is forgotten
+# ttl seconds after it was last seen.
+#
+# If snapshot_path is given, the keys are saved there every
+# snapshot_interval seconds and at close(), and loaded again when the cache
+# is created, so a restart doesn't let a burst of duplicates through.
+#
+# hits counts duplicates dropped, misses new messages, and evictions keys
+# forgotten to stay under max_entries or max_bytes.
+class DedupCache(object):
+    def __init__(self, key=None, max_entries=100000, max_bytes=None,
+                 ttl=None, snapshot_path=None, snapshot_interval=60.0):
+        if key is None:
+            key = replay_key
+        elif not callable(key):
+            try:
+                key = KEYS[key]
+            except KeyError:
+                raise ValueError(
+                    'key must be a function or one of {0}'.format(
+                        ', '.join(sorted(KEYS))
+                    )
+                )
+
+        self.key = key
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+
+        # key: (wall clock expiry or None, approximate size), least recently
+        # seen first.  Expiry is wall clock time so that it survives in a
+        # snapshot.
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.in_flight = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.last_snapshot = time.monotonic()
+        if self.snapshot_path is not None:
+            self._load()
+
+    # True if message has been handled, or is being handled
+    def seen(self, message):
+        return self._seen(self.key(message))
+
+    def _seen(self, key):
+        if key is None:
+            return False
+        if key in self.in_flight:
+            return True
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if entry[0] is not None and entry[0] <= time.time():
+            self._forget(key)
+            return False
+
+        self.entries.move_to_end(key)
+        return True
+
+    # The messages that aren't duplicates, in order.  They are in flight
+    # until remember() is called for them.
+    def filter(self, messages):
+        kept = []
+        for message in messages:
+            key = self.key(message)
+            if self._seen(key):
+                self.hits += 1
+                continue
+
+            if key is not None:
+                self.misses += 1
+                self.in_flight.add(key)
+            kept.append(message)
+
+        return kept
+
+    # Records that message has been handled
+    def remember(self, message):
+        key = self.key(message)
+        if key is None:
+            return
+
+        self.in_flight.discard(key)
+        if key in self.entries:
+            self._forget(key)
+        self._remember(
+            key,
+            None if self.ttl is None else time.time() + self.ttl
+        )
+
+        if self.snapshot_path is not None and \
+           time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remember(self, key, expires):
+        size = sys.getsizeof(key) + _ENTRY_OVERHEAD
+        self.entries[key] = (expires, size)
+        self.size += size
+
+        while len(self.entries) > 1 and (
+                (self.max_entries is not None and
+                 len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            self._forget(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _forget(self, key):
+        expires, size = self.entries.pop(key)
+        self.size -= size
+
+    # Saves the keys of handled messages that haven't expired, replacing the
+    # snapshot atomically
+    def snapshot(self):
+        now = time.time()
+        entries = [
+            [key, expires]
+            for key, (expires, size) in self.entries.items()
+            if expires is None or expires > now
+        ]
+        with open(self.snapshot_path + '.tmp', 'w') as snapshot_file:
+            json.dump(entries, snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+        self.last_snapshot = time.monotonic()
+
+    def _load(self):
+        try:
+            with open(self.snapshot_path) as snapshot_file:
+                entries = json.load(snapshot_file)
+        except (IOError, ValueError):
+            return
+
+        now = time.time()
+        for key, expires in entries:
+            if expires is None or expires > now:
+                self._remember(_hashable(key), expires)
+
+    # Called when the client shuts down.  Messages still in flight weren't
+    # handled, so they are let through if they come again.
+    def close(self):
+        self.in_flight.clear()
+        if self.snapshot_path is not None:
+            self.snapshot()
+
+
+# JSON turns tuples into lists
+def _hashable(key):
+    if isinstance(key, list):
+        return tuple(_hashable(part) for part in key)
+    return key
@@ -0,0 +1,129 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import gevent
+import gevent.event
+import gevent.queue
+
+# Put on a worker's queue to tell it to stop once everything ahead of it has
+# been handled
+_STOP = object()
+
+
+# Runs handler(message) on a fixed number of worker greenlets.  Messages are
+# sharded by key(message), the channel by default, so messages with the same
+# key are handled in order by the same worker, while messages with different
+# keys may be handled concurrently.
+#
+# If max_pending is set, dispatch() waits while that many messages are
+# dispatched but not yet handled, so that messages wait for the workers
+# wherever they came from instead of piling up here.
+class KeyedDispatcher(object):
+    def __init__(self, handler, concurrency, key=None, max_pending=None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.key = key if key is not None else _channel_key
+        self.max_pending = max_pending
+        self.queues = [gevent.queue.Queue() for i in range(concurrency)]
+        self.workers = []
+
+        self.outstanding = 0
+        self.idle = gevent.event.Event()
+        self.idle.set()
+        self.not_full = gevent.event.Event()
+        self.not_full.set()
+        # Set once any worker has stopped, after which dispatch() no longer
+        # waits for room that may never come
+        self.stopped = False
+
+    def start(self, exception_callback=None):
+        for queue in self.queues:
+            worker = gevent.Greenlet(self._worker, queue)
+            if exception_callback is not None:
+                worker.link_exception(exception_callback)
+            self.workers.append(worker)
+            worker.start()
+
+    def dispatch(self, message):
+        while self.max_pending is not None and not self.stopped and \
+                self.outstanding >= self.max_pending:
+            self.not_full.clear()
+            self.not_full.wait()
+
+        shard = hash(self.key(message)) % self.concurrency
+        self.outstanding += 1
+        self.idle.clear()
+        self.queues[shard].put(message)
+
+    # Stops dispatch() and join() from waiting on the workers, for when a
+    # handler is shutting everything down and so won't return until they do
+    def release(self):
+        self.stopped = True
+        self.not_full.set()
+        self.idle.set()
+
+    # Waits until every message dispatched so far has been handled
+    def join(self):
+        self.idle.wait()
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def _worker(self, queue):
+        try:
+            while True:
+                message = queue.get()
+                if message is _STOP:
+                    break
+                try:
+                    self.handler(message)
+                finally:
+                    self.outstanding -= 1
+                    self.not_full.set()
+                    if self.outstanding == 0:
+                        self.idle.set()
+        finally:
+            self.stopped = True
+            self.not_full.set()
+
+    # Lets every worker finish what it has already been given, then stops it.
+    # Safe to call from a handler: we don't wait for the calling worker, which
+    # carries on with its queue after the handler returns.
+    def shutdown(self):
+        for queue in self.queues:
+            queue.put(_STOP)
+
+        current = gevent.getcurrent()
+        gevent.joinall([worker for worker in self.workers
+                        if worker is not current])
+
+
+def _channel_key(message):
+    return message['channel']
@@ -0,0 +1,237 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import time
+
+import gevent
+
+from python_bayeux import BayeuxClient
+from python_bayeux.stubserver import StubServer
+
+# What a Fault does to the requests it applies to:
+# * 'unknown_client': answers 403::Unknown client with reconnect: handshake,
+#   and forgets the client, as a server that has restarted would
+# * 'server_error': answers 503 with an empty body
+# * 'empty': answers 200 with an empty body
+# * 'slow': answers normally, after delay seconds; longer than the client's
+#   connect timeout, it is a read timeout
+UNKNOWN_CLIENT = 'unknown_client'
+SERVER_ERROR = 'server_error'
+EMPTY = 'empty'
+SLOW = 'slow'
+FAULTS = (UNKNOWN_CLIENT, SERVER_ERROR, EMPTY, SLOW)
+
+
+# Applies to the next count requests with a message on channel.  injected,
+# first_injected and last_injected (time.monotonic()) record when it did.
+class Fault(object):
+    def __init__(self, kind, channel='/meta/connect', count=1, delay=0):
+        if kind not in FAULTS:
+            raise ValueError(
+                'kind must be one of {0}'.format(', '.join(FAULTS))
+            )
+
+        self.kind = kind
+        self.channel = channel
+        self.count = count
+        self.delay = delay
+
+        self.injected = 0
+        self.first_injected = None
+        self.last_injected = None
+
+    @property
+    def done(self):
+        return self.injected >= self.count
+
+    def _inject(self):
+        now = time.monotonic()
+        if self.first_injected is None:
+            self.first_injected = now
+        self.last_injected = now
+        self.injected += 1
+
+
+# A StubServer that misbehaves on cue.  Faults are applied in the order they
+# were injected; each request gets at most one.
+#
+#     server.inject('server_error', count=3)
+#     server.inject('slow', channel='/meta/subscribe', delay=5)
+class FaultInjectingServer(StubServer):
+    def __init__(self, **kwargs):
+        super(FaultInjectingServer, self).__init__(**kwargs)
+        self.faults = []
+
+    def inject(self, kind, channel='/meta/connect', count=1, delay=0):
+        fault = Fault(kind, channel=channel, count=count, delay=delay)
+        self.faults.append(fault)
+        return fault
+
+    def handle(self, messages):
+        fault = self._next_fault(messages)
+        if fault is None:
+            return super(FaultInjectingServer, self).handle(messages)
+
+        fault._inject()
+        if fault.kind == SLOW:
+            gevent.sleep(fault.delay)
+            return super(FaultInjectingServer, self).handle(messages)
+
+        for message in messages:
+            self.requests[message['channel']] += 1
+
+        if fault.kind == SERVER_ERROR:
+            return '503 Service Unavailable', None
+        if fault.kind == EMPTY:
+            return '200 OK', None
+
+        responses = []
+        for message in messages:
+            client = self.clients.pop(message.get('clientId'), None)
+            if client is not None:
+                client.event.set()
+            responses.append(self._unknown_client(message))
+        return '200 OK', responses
+
+    def _next_fault(self, messages):
+        channels = set(message['channel'] for message in messages)
+        for fault in self.faults:
+            if not fault.done and fault.channel in channels:
+                return fault
+        return None
+
+
+# Runs one client against server while the server publishes messages numbered
+# messages on channel, interval seconds apart, with faults (Faults; none for
+# a baseline) injected just before the first.  Faults on handshakes and
+# subscribes only apply once the client handshakes again, so pair them with
+# an unknown_client fault on /meta/connect.  After settle more seconds,
+# returns:
+#
+# * time_to_recover: seconds from a fault first being applied until the
+#   first message published after the last fault was applied reached a
+#   callback (None if no fault was applied, or the client never recovered)
+# * lost and duplicated: how many messages never arrived, and how many
+#   arrived more than once
+# * requests: how many messages the server received, by channel
+# * exception: the exception that stopped the client, if any
+def run_scenario(server, faults=(), client_factory=None, messages=50,
+                 interval=0.01, settle=1.0, channel='/faults/probe'):
+    if client_factory is None:
+        client_factory = BayeuxClient
+
+    received = []
+
+    def probe(message):
+        received.append((message['data']['seq'], time.monotonic()))
+
+    client = client_factory(server.url)
+    client.subscribe(channel, probe).get(timeout=10)
+    client.go()
+    # Let the first connect be held
+    gevent.sleep(interval)
+
+    requests_before = collections.Counter(server.requests)
+    server.faults.extend(faults)
+
+    published = []
+    for seq in range(messages):
+        server.publish(channel, {'seq': seq})
+        published.append(time.monotonic())
+        gevent.sleep(interval)
+    gevent.sleep(settle)
+
+    requests = collections.Counter(server.requests)
+    requests.subtract(requests_before)
+    exception = client.exception
+
+    client.shutdown()
+
+    arrivals = collections.Counter(seq for seq, arrived in received)
+    return {
+        'faults': [
+            {'kind': fault.kind, 'channel': fault.channel,
+             'injected': fault.injected}
+            for fault in faults
+        ],
+        'time_to_recover': _time_to_recover(faults, published, received),
+        'published': messages,
+        'received': len(received),
+        'lost': messages - len(arrivals),
+        'duplicated': sum(count - 1 for count in arrivals.values()),
+        'requests': dict(
+            (key, count) for key, count in requests.items() if count
+        ),
+        'exception': None if exception is None else repr(exception),
+    }
+
+
+def _time_to_recover(faults, published, received):
+    applied = [fault for fault in faults if fault.injected]
+    if len(applied) == 0:
+        return None
+
+    first_injected = min(fault.first_injected for fault in applied)
+    last_injected = max(fault.last_injected for fault in applied)
+    recovered = [
+        arrived for seq, arrived in received
+        if published[seq] > last_injected
+    ]
+    if len(recovered) == 0:
+        return None
+    return min(recovered) - first_injected
+
+
+# Runs a baseline scenario, then one per scenario in scenarios, each with a
+# new client and server.  Each scenario is a list of dicts of Fault
+# arguments.  Adds extra_requests to each result: how many more messages
+# the server received, on the channels where it received more than in the
+# baseline.  (A client that is backing off sends fewer connects, which
+# doesn't make up for the handshakes and subscribes it sent again.)
+# server_kwargs go to each FaultInjectingServer, and scenario_kwargs to
+# run_scenario().
+def measure_recovery(scenarios, server_kwargs=None, **scenario_kwargs):
+    results = []
+    baseline = None
+    for scenario in [[]] + list(scenarios):
+        with FaultInjectingServer(**(server_kwargs or {})) as server:
+            faults = [Fault(**fault_kwargs) for fault_kwargs in scenario]
+            result = run_scenario(server, faults, **scenario_kwargs)
+
+        if baseline is None:
+            baseline = result['requests']
+        result['extra_requests'] = sum(
+            max(0, count - baseline.get(channel, 0))
+            for channel, count in result['requests'].items()
+        )
+        results.append(result)
+
+    return results
@@ -0,0 +1,309 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import logging
+import time
+from urllib.parse import urlsplit
+
+import gevent
+import gevent.event
+import gevent.pool
+import requests.adapters
+
+from python_bayeux import BayeuxClient
+from python_bayeux.dispatch import KeyedDispatcher
+
+LOG = logging.getLogger('python_bayeux.hub')
+
+
+# Hosts many BayeuxClients, one per tenant (for example, per org), so that the
+# cost of a client is its subscriptions and its work in flight rather than
+# its own greenlets and connections.  Clients created with hub=... then:
+#
+# * share one urllib3 connection pool per endpoint host, of up to
+#   pool_maxsize connections, while keeping their own sessions, and so their
+#   own credentials and cookies
+# * handshake the first time they have something to send, not in __init__
+# * have their subscribes, unsubscribes and publishes sent by one scheduler
+#   greenlet, in batches of up to max_batch_size messages, by at most
+#   send_concurrency greenlets at a time across every tenant
+# * only start a /meta/connect greenlet once they have subscribed
+# * have their pushed messages handled by one KeyedDispatcher of
+#   dispatch_concurrency workers, in order per tenant and channel
+#
+# A callback that raises shuts down its own client, not the hub.
+class BayeuxHub(object):
+    def __init__(self, max_batch_size=100, batch_linger=0,
+                 send_concurrency=100, dispatch_concurrency=10,
+                 pool_maxsize=100):
+        self.max_batch_size = max_batch_size
+        self.batch_linger = batch_linger
+        self.pool_maxsize = pool_maxsize
+
+        self.adapters = {}
+        self.clients = {}
+        self.stats = {}
+
+        # Clients with outbound work, in the order they asked; a dict rather
+        # than a set so that no tenant is starved
+        self.ready = {}
+        self.ready_event = gevent.event.Event()
+        self.sending = set()
+        self.senders = gevent.pool.Pool(send_concurrency)
+
+        self.dispatcher = KeyedDispatcher(
+            self._dispatch,
+            dispatch_concurrency,
+            key=_tenant_channel_key
+        )
+
+        # While a client resubscribes, its messages are held here, in order,
+        # rather than tying up a worker other tenants share, and a releaser
+        # greenlet in releasers handles them once it is done
+        self.held = {}
+        self.releasers = gevent.pool.Group()
+
+        self.scheduler = None
+        self.stop_scheduler = False
+        self.shutdown_called = False
+
+    def client(self, tenant, endpoint, oauth_session=None, **kwargs):
+        return BayeuxClient(endpoint, oauth_session, hub=self, tenant=tenant,
+                            **kwargs)
+
+    # Called by BayeuxClient.__init__()
+    def add(self, client):
+        if client.tenant in self.clients:
+            raise ValueError(
+                'tenant {0!r} already has a client'.format(client.tenant)
+            )
+        self.clients[client.tenant] = client
+        self.stats[client.tenant] = TenantStats()
+        self._mount(client.oauth_session, client.endpoint)
+
+    # Called by BayeuxClient.shutdown()
+    def remove(self, client):
+        if self.clients.get(client.tenant) is client:
+            del self.clients[client.tenant]
+            del self.stats[client.tenant]
+        self.ready.pop(client, None)
+
+    def _mount(self, session, endpoint):
+        parts = urlsplit(endpoint)
+        prefix = '{0}://{1}/'.format(parts.scheme, parts.netloc)
+        adapter = self.adapters.get(prefix)
+        if adapter is None:
+            adapter = self.adapters[prefix] = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_maxsize
+            )
+        session.mount(prefix, adapter)
+
+    # A client has outbound work
+    def schedule(self, client):
+        self.ready[client] = None
+        self.ready_event.set()
+
+    def start(self):
+        if self.scheduler is not None:
+            return
+
+        self.dispatcher.start()
+        self.scheduler = gevent.Greenlet(self._scheduler_greenlet)
+        self.scheduler.start()
+
+    def _scheduler_greenlet(self):
+        while True:
+            self.ready_event.wait()
+            if self.stop_scheduler:
+                break
+
+            if self.batch_linger:
+                gevent.sleep(self.batch_linger)
+
+            self.ready_event.clear()
+            ready = [client for client in self.ready
+                     if client not in self.sending]
+            for client in ready:
+                del self.ready[client]
+                self.sending.add(client)
+                # Blocks while send_concurrency sends are in flight
+                sender = self.senders.spawn(self._send, client)
+                sender.link_exception(client._exception_callback)
+
+    def _send(self, client):
+        try:
+            if client.stop_greenlets:
+                return
+
+            sent = client._send_outbound()
+            stats = self.stats.get(client.tenant)
+            if stats is not None:
+                stats.requests += sent
+
+            if len(client.subscription_callbacks) > 0:
+                client._start_connect_greenlet()
+        finally:
+            self.sending.discard(client)
+            # Any work that came in while we were sending, or that didn't
+            # fit in the batch
+            if client._has_outbound():
+                self.schedule(client)
+
+    # Called through the client's message_queue by its connect greenlet
+    def _put(self, client, item):
+        enqueued, messages = item
+        stats = self.stats.get(client.tenant)
+        if stats is not None:
+            stats.messages_received += len(messages)
+        # Remembered by the client once its callbacks have run
+        if client.dedup is not None:
+            messages = client.dedup.filter(messages)
+        for message in messages:
+            self.dispatcher.dispatch((client, enqueued, message))
+
+    def _dispatch(self, item):
+        client = item[0]
+        held = self.held.get(client)
+        if held is None and client.subscriptions_ready.is_set():
+            self._handle(item)
+            return
+
+        if held is None:
+            held = self.held[client] = collections.deque()
+            self.releasers.spawn(self._release, client)
+        held.append(item)
+
+    def _release(self, client):
+        held = self.held[client]
+        while len(held) > 0:
+            client.subscriptions_ready.wait()
+            self._handle(held.popleft())
+        del self.held[client]
+
+    def _handle(self, item):
+        client, enqueued, message = item
+        stats = self.stats.get(client.tenant)
+
+        if client.tracer is not None:
+            client.tracer.queue_wait(
+                client,
+                'message',
+                time.monotonic() - enqueued
+            )
+
+        try:
+            client._dispatch_message(message)
+        except Exception as e:
+            LOG.exception(
+                'callback for tenant %r failed on channel %s',
+                client.tenant,
+                message['channel']
+            )
+            if stats is not None:
+                stats.errors += 1
+            if client.exception is None:
+                client.exception = e
+                gevent.spawn(client.shutdown)
+        else:
+            if stats is not None:
+                stats.messages_handled += 1
+
+    def tenant_stats(self, tenant):
+        client = self.clients[tenant]
+        stats = self.stats[tenant].as_dict()
+        stats.update({
+            'connected': len(client.inbound_greenlets) > 0 and
+            not client.stop_greenlets,
+            'outbound_queued': client._outbound_size(),
+            'requests_in_flight': len(client.pending_requests),
+        })
+        return stats
+
+    def block(self):
+        if self.scheduler is not None:
+            self.scheduler.join()
+            if self.scheduler.exception is not None:
+                raise self.scheduler.exception
+
+    def shutdown(self):
+        if self.shutdown_called:
+            return
+        self.shutdown_called = True
+
+        LOG.info('hub is shutting down %d clients', len(self.clients))
+        gevent.joinall([
+            gevent.spawn(client.shutdown)
+            for client in list(self.clients.values())
+        ])
+
+        self.stop_scheduler = True
+        self.ready_event.set()
+        if self.scheduler is not None:
+            self.scheduler.join()
+        self.senders.join()
+        self.dispatcher.shutdown()
+        self.releasers.join()
+        for adapter in self.adapters.values():
+            adapter.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.shutdown()
+
+
+# Counters for one tenant of a BayeuxHub
+class TenantStats(object):
+    __slots__ = ('requests', 'messages_received', 'messages_handled',
+                 'errors')
+
+    def __init__(self):
+        self.requests = 0
+        self.messages_received = 0
+        self.messages_handled = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'TenantStats({0})'.format(', '.join(
+            '{0}={1}'.format(name, getattr(self, name))
+            for name in self.__slots__
+        ))
+
+
+def _tenant_channel_key(item):
+    client, enqueued, message = item
+    return client.tenant, message['channel']
@@ -0,0 +1,291 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import re
+from collections.abc import Mapping
+
+from python_bayeux.codec import default_codec
+
+_loads = default_codec().loads
+
+_STRING = br'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Everything up to and including the next bracket that isn't inside a string
+_TO_BRACKET = re.compile(
+    br'[^"\[\]{}]*(?:' + _STRING + br'[^"\[\]{}]*)*([\[\]{}])'
+)
+_ARRAY_START = re.compile(br'\s*\[\s*')
+_FIELD = re.compile(br'\s*(' + _STRING + br')\s*:\s*')
+_SCALAR = re.compile(_STRING + br'|[^,}\]\s]+')
+_AFTER_VALUE = re.compile(br'\s*([,}\]])\s*')
+_BETWEEN_ELEMENTS = re.compile(br'[\s,]*')
+
+_OPEN = frozenset(b'[{')
+_OPEN_OBJECT = ord('{')
+_OPEN_ARRAY = ord('[')
+_CLOSE_ARRAY = ord(']')
+_CLOSE_OBJECT = ord('}')
+
+
+# A read-only, dict-like view of one message in a response body.  channel, id
+# and replay_id are decoded up front; every other field, including data, is
+# decoded from the raw bytes the first time it is used.  Messages that are
+# filtered out by channel never have their data decoded at all.
+class Message(Mapping):
+    __slots__ = ('raw', 'channel', 'id', 'replay_id', '_spans', '_decoded')
+
+    def __init__(self, raw, spans):
+        self.raw = raw
+        self._spans = spans
+        self._decoded = {}
+
+        self.channel = self._decode('channel') if 'channel' in spans else None
+        self.id = self._decode('id') if 'id' in spans else None
+
+        self.replay_id = _replay_id(raw, spans)
+
+    def _decode(self, key):
+        start, end = self._spans[key]
+        value = self.raw[start:end]
+        if value[:1] == b'"' and b'\\' not in value:
+            return value[1:-1].decode('utf-8')
+        return _loads(value)
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+
+        if key not in self._spans:
+            raise KeyError(key)
+
+        value = self._decoded[key] = self._decode(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._spans
+
+    def __iter__(self):
+        return iter(self._spans)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def to_dict(self):
+        return dict((key, self[key]) for key in self._spans)
+
+    def __repr__(self):
+        return 'Message({0!r})'.format(self.raw)
+
+    def __getstate__(self):
+        return self.raw, self._spans
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+# Splits a JSON array of objects, like a bayeux response body, into Messages
+# without decoding any values.  Only the top level fields of each object are
+# looked at one by one; nested objects and arrays are skipped a bracket at a
+# time by the regular expression engine.
+def parse_messages(body):
+    messages = []
+    match = _ARRAY_START.match(body)
+    if match is None:
+        raise ValueError('expected a JSON array')
+    position = match.end()
+
+    while position < len(body) and body[position] != _CLOSE_ARRAY:
+        message, position = _parse_object(body, position)
+        messages.append(message)
+
+        # Step over the comma between elements
+        match = _AFTER_VALUE.match(body, position)
+        if match is not None and match.group(1) == b',':
+            position = match.end()
+
+    return messages
+
+
+# A Message for the bytes of one JSON object
+def parse_message(raw):
+    return _parse_object(raw, 0)[0]
+
+
+def _parse_object(body, element_start):
+    spans, position = _object_spans(body, element_start)
+    element_end = body.rindex(b'}', element_start, position) + 1
+    return Message(body[element_start:element_end], spans), position
+
+
+# The spans of the top level fields of the JSON object at element_start,
+# relative to element_start, and the position after the object
+def _object_spans(body, element_start):
+    if body[element_start] != _OPEN_OBJECT:
+        raise ValueError(
+            'expected a JSON object at {0}'.format(element_start)
+        )
+    position = element_start + 1
+    spans = {}
+
+    while True:
+        match = _FIELD.match(body, position)
+        if match is None:
+            # An empty object
+            match = _AFTER_VALUE.match(body, position)
+            position = match.end()
+            break
+
+        key = _decode_key(match.group(1))
+        value_start = match.end()
+        if body[value_start] in _OPEN:
+            value_end = _skip_nested(body, value_start)
+        else:
+            value_end = _SCALAR.match(body, value_start).end()
+        spans[key] = (value_start - element_start,
+                      value_end - element_start)
+
+        match = _AFTER_VALUE.match(body, value_end)
+        position = match.end()
+        if match.group(1)[0] == _CLOSE_OBJECT:
+            break
+
+    return spans, position
+
+
+# data.event.replayId, where replay_id_of() finds it in a dict, or None.  Only
+# the fields along that path are looked at, so a replayId elsewhere in the
+# data doesn't count.
+def _replay_id(raw, spans):
+    start = 0
+    for key in ('data', 'event', 'replayId'):
+        span = spans.get(key)
+        if span is None:
+            return None
+        start, end = start + span[0], start + span[1]
+        if key == 'replayId':
+            return _loads(raw[start:end])
+        if raw[start] != _OPEN_OBJECT:
+            return None
+        spans = _object_spans(raw, start)[0]
+
+
+# Splits a JSON array of objects that arrives in chunks, like a streamed
+# response body, into the bytes of each object as soon as it is complete.
+# Only the bytes of the object being read are kept.
+class StreamSplitter(object):
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.element_start = None
+        self.depth = 0
+        self.started = False
+        self.finished = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        buffer = self.buffer
+        elements = []
+
+        while not self.finished:
+            if self.element_start is None:
+                match = _BETWEEN_ELEMENTS.match(buffer, self.position)
+                self.position = match.end()
+                if self.position >= len(buffer):
+                    break
+
+                if not self.started:
+                    if buffer[self.position] != _OPEN_ARRAY:
+                        raise ValueError('expected a JSON array')
+                    self.started = True
+                    self.position += 1
+                    continue
+
+                if buffer[self.position] == _CLOSE_ARRAY:
+                    self.finished = True
+                    break
+                if buffer[self.position] != _OPEN_OBJECT:
+                    raise ValueError('expected a JSON object')
+
+                self.element_start = self.position
+                self.depth = 0
+
+            # Carry on from the last bracket we saw, rather than rescanning
+            # the whole element every time a chunk arrives
+            match = _TO_BRACKET.match(buffer, self.position)
+            if match is None:
+                break
+            if match.group(1)[0] in _OPEN:
+                self.depth += 1
+            else:
+                self.depth -= 1
+            self.position = match.end()
+
+            if self.depth == 0:
+                elements.append(bytes(buffer[self.element_start:
+                                             self.position]))
+                self.element_start = None
+
+        keep = self.position if self.element_start is None \
+            else self.element_start
+        del buffer[:keep]
+        self.position -= keep
+        if self.element_start is not None:
+            self.element_start = 0
+
+        return elements
+
+
+def _skip_nested(body, position):
+    depth = 0
+    while True:
+        match = _TO_BRACKET.match(body, position)
+        if match is None:
+            raise ValueError('unterminated JSON value')
+        if match.group(1)[0] in _OPEN:
+            depth += 1
+        else:
+            depth -= 1
+        position = match.end()
+        if depth == 0:
+            return position
+
+
+# The bytes a message was (or would be) sent as
+def encode_message(message, codec=None):
+    if isinstance(message, Message):
+        return message.raw
+    return (codec or default_codec()).dumps(message)
+
+
+def _decode_key(token):
+    if b'\\' in token:
+        return _loads(token)
+    return token[1:-1].decode('utf-8')
@@ -0,0 +1,322 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import bisect
+import math
+
+import gevent.pywsgi
+
+from python_bayeux.tracing import Tracer
+
+# Seconds; connects are held by the server for up to its timeout advice,
+# which is usually well over a minute
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10, 30, 60, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Counters, histograms and gauges, rendered in the Prometheus text format by
+# render(), or served over HTTP by serve().  Every update is a plain dict or
+# list operation in the calling greenlet, so there are no locks.
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = []
+        self.server = None
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    # function() returns an iterable of (label values, value), and is called
+    # when the metrics are rendered, so a gauge costs nothing until then
+    def gauge(self, name, help, function, labelnames=()):
+        return self._register(Gauge(name, help, labelnames, function))
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(
+                'metric {0} is already registered'.format(metric.name)
+            )
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(
+                metric.name,
+                metric.help.replace('\\', '\\\\').replace('\n', '\\n')
+            ))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    # Serves render() at /metrics on a gevent WSGI server, and returns the
+    # port, which is chosen for us if port is 0
+    def serve(self, host='127.0.0.1', port=0):
+        self.server = gevent.pywsgi.WSGIServer(
+            (host, port),
+            self._application,
+            log=None
+        )
+        self.server.start()
+        return self.server.server_port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop(timeout=1)
+            self.server = None
+
+    def _application(self, environ, start_response):
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found\n']
+
+        body = self.render().encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', CONTENT_TYPE),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # By tuple of label values
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        try:
+            self.values[labels] += amount
+        except KeyError:
+            self.values[labels] = amount
+
+    def get(self, labels=()):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        if not self.values and not self.labelnames:
+            yield _sample(self.name, (), (), 0)
+        for labels, value in sorted(self.values.items()):
+            yield _sample(self.name, self.labelnames, labels, value)
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # By tuple of label values: [count per bucket, and one past the
+        # last, sum, count]
+        self.values = {}
+
+    def observe(self, value, labels=()):
+        try:
+            counts, total = self.values[labels]
+        except KeyError:
+            counts = [0] * (len(self.buckets) + 1)
+            total = [0.0, 0]
+            self.values[labels] = (counts, total)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+
+    def count(self, labels=()):
+        return self.values[labels][1][1] if labels in self.values else 0
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield _sample(
+                    self.name + '_bucket',
+                    self.labelnames + ('le',),
+                    labels + (bound,),
+                    cumulative
+                )
+            yield _sample(self.name + '_sum', self.labelnames, labels,
+                          total[0])
+            yield _sample(self.name + '_count', self.labelnames, labels,
+                          total[1])
+
+
+class Gauge(object):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames, function):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+
+    def samples(self):
+        for labels, value in self.function():
+            yield _sample(self.name, self.labelnames, labels, value)
+
+
+def _sample(name, labelnames, labels, value):
+    if len(labelnames) == 0:
+        return '{0} {1}'.format(name, _format_value(value))
+
+    return '{0}{{{1}}} {2}'.format(
+        name,
+        ','.join(
+            '{0}="{1}"'.format(labelname, _escape(label))
+            for labelname, label in zip(labelnames, labels)
+        ),
+        _format_value(value)
+    )
+
+
+def _escape(label):
+    if isinstance(label, float):
+        return _format_value(label)
+    return str(label).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+    return repr(value)
+
+
+# Publishes what a client does as metrics in registry (a new
+# MetricsRegistry by default).  Several clients may share one tracer, and
+# their metrics are added up.  Channels other than /meta/ ones are counted
+# under 'publish' in bayeux_requests_total, so publishing to many channels
+# doesn't make a label for each.
+class MetricsTracer(Tracer):
+    def __init__(self, registry=None, buckets=DEFAULT_BUCKETS, **kwargs):
+        super(MetricsTracer, self).__init__(**kwargs)
+        self.registry = MetricsRegistry() if registry is None else registry
+        self.clients = set()
+
+        self.requests = self.registry.counter(
+            'bayeux_requests_total',
+            'Messages sent to the server, by meta channel',
+            ('channel',)
+        )
+        self.handshakes = self.registry.counter(
+            'bayeux_handshakes_total',
+            'Handshakes, including the first'
+        )
+        self.resubscriptions = self.registry.counter(
+            'bayeux_resubscriptions_total',
+            'Channels subscribed again after a re-handshake'
+        )
+        self.received = self.registry.counter(
+            'bayeux_messages_received_total',
+            'Pushed messages queued for callbacks, by channel',
+            ('channel',)
+        )
+        self.dispatched = self.registry.counter(
+            'bayeux_messages_dispatched_total',
+            'Pushed messages handed to callbacks, by channel',
+            ('channel',)
+        )
+        self.connect_duration = self.registry.histogram(
+            'bayeux_connect_duration_seconds',
+            'Round trip time of /meta/connect long polls',
+            buckets=buckets
+        )
+        self.callback_duration = self.registry.histogram(
+            'bayeux_callback_duration_seconds',
+            'Time spent in callbacks, by channel',
+            ('channel',),
+            buckets=buckets
+        )
+        self.registry.gauge(
+            'bayeux_queue_depth',
+            'Items waiting in the client queues',
+            self._queue_depths,
+            ('queue',)
+        )
+
+    def handshake(self, client, duration):
+        self.handshakes.inc()
+
+    def connect(self, client, duration, message_count):
+        self.connect_duration.observe(duration)
+
+    def send(self, client, channels, duration):
+        for channel in channels:
+            self.requests.inc(
+                (channel if channel.startswith('/meta/') else 'publish',)
+            )
+
+    def receive(self, client, messages):
+        for message in messages:
+            self.received.inc((message['channel'],))
+
+    def dispatch(self, client, channel):
+        self.dispatched.inc((channel,))
+
+    def resubscribe(self, client, channel_count, duration):
+        self.resubscriptions.inc(amount=channel_count)
+
+    def callback(self, client, channel, callback, duration):
+        self.callback_duration.observe(duration, (channel,))
+        super(MetricsTracer, self).callback(client, channel, callback,
+                                            duration)
+
+    def start(self, client):
+        self.clients.add(client)
+        super(MetricsTracer, self).start(client)
+
+    def stop(self, client):
+        self.clients.discard(client)
+        super(MetricsTracer, self).stop(client)
+
+    def _queue_depths(self):
+        depths = {'subscription': 0, 'unsubscription': 0, 'publication': 0,
+                  'message': 0}
+        for client in self.clients:
+            depths['subscription'] += client.subscription_queue.qsize()
+            depths['unsubscription'] += client.unsubscription_queue.qsize()
+            depths['publication'] += client.publication_queue.qsize()
+            depths['message'] += client.message_queue.qsize()
+        return (((queue,), depth) for queue, depth in sorted(depths.items()))
@@ -0,0 +1,95 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import concurrent.futures
+import multiprocessing
+import time
+
+import gevent
+
+
+# Runs handlers in a pool of worker processes, so CPU bound callbacks don't
+# hold up the gevent hub (and with it, the connect long poll).  Handlers and
+# messages are pickled to get to the workers, so handlers must be plain
+# functions defined at module level.
+class OffloadPool(object):
+    def __init__(self, processes=None, batch_size=100):
+        self.batch_size = batch_size
+        # Forked workers would inherit the parent's hub and greenlets, so
+        # start them fresh instead
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    # Sends messages to the workers in batches of up to batch_size per
+    # handler, and yields (handler, message, result, exception, duration) for
+    # every message, in the order the messages were given for each handler.
+    # handlers_for(message) returns the handlers for a message.
+    def run(self, messages, handlers_for):
+        by_handler = {}
+        for message in messages:
+            for handler in handlers_for(message):
+                by_handler.setdefault(handler, []).append(message)
+
+        submitted = []
+        for handler, handler_messages in by_handler.items():
+            for start in range(0, len(handler_messages), self.batch_size):
+                batch = handler_messages[start:start + self.batch_size]
+                submitted.append((
+                    handler,
+                    batch,
+                    self.executor.submit(run_handler_batch, handler, batch)
+                ))
+
+        threadpool = gevent.get_hub().threadpool
+        for handler, batch, future in submitted:
+            # Wait in a native thread so the hub keeps running
+            outcomes = threadpool.spawn(future.result).get()
+            for message, (result, exception, duration) in zip(batch,
+                                                              outcomes):
+                yield handler, message, result, exception, duration
+
+    def shutdown(self):
+        gevent.get_hub().threadpool.apply(self.executor.shutdown)
+
+
+# Runs in a worker process
+def run_handler_batch(handler, messages):
+    outcomes = []
+    for message in messages:
+        started = time.monotonic()
+        try:
+            outcomes.append((handler(message), None,
+                             time.monotonic() - started))
+        except Exception as exception:
+            outcomes.append((None, exception, time.monotonic() - started))
+
+    return outcomes
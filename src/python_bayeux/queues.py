@@ -0,0 +1,248 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import struct
+import tempfile
+
+import gevent.event
+import gevent.queue
+import simplejson as json
+
+from python_bayeux.message import encode_message
+
+# Spilled messages are stored as their enqueued time and length, then JSON
+_SPILL_HEADER = struct.Struct('<dI')
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+SPILL = 'spill'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL)
+
+
+# The inbound message queue.  put() takes (enqueued time, list of messages),
+# as pushed by one connect, and get() returns (enqueued time of the oldest
+# message, list of every message waiting).
+#
+# If max_messages or max_bytes (of JSON) is set, overflow_policy decides what
+# happens to messages that don't fit:
+#
+# * 'block': put() waits for room, which holds up the connect long poll and
+#   so pushes back on the server
+# * 'drop_oldest': the oldest waiting messages are dropped to make room
+# * 'drop_newest': the new messages are dropped
+# * 'spill': messages are written to a temporary file in spill_directory (or
+#   the default temporary directory) and read back in order as room frees up
+#
+# depth, depth_bytes, dropped, spilled and blocked count what has happened.
+class BoundedMessageQueue(object):
+    def __init__(self, max_messages=None, max_bytes=None,
+                 overflow_policy=BLOCK, spill_directory=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'overflow_policy must be one of {0}'.format(
+                    ', '.join(OVERFLOW_POLICIES)
+                )
+            )
+
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.spill_directory = spill_directory
+
+        # (enqueued, message, size) for every waiting message
+        self.items = collections.deque()
+        self.depth = 0
+        self.depth_bytes = 0
+
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked = 0
+
+        self.spill_file = None
+        self.spill_read_offset = 0
+        self.spill_pending = 0
+
+        self.not_empty = gevent.event.Event()
+        self.not_full = gevent.event.Event()
+        self.not_full.set()
+        self.closed = False
+
+    def put(self, item):
+        enqueued, messages = item
+        for message in messages:
+            size = 0 if self.max_bytes is None else _size(message)
+
+            if self.overflow_policy == SPILL and self.spill_pending:
+                # Stay in order behind what has already been spilled
+                self._spill(enqueued, message)
+                continue
+
+            if not self._fits(size):
+                if self.overflow_policy == BLOCK:
+                    while not self.closed and not self._fits(size):
+                        self.blocked += 1
+                        self.not_full.clear()
+                        self.not_full.wait()
+                elif self.overflow_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    continue
+                elif self.overflow_policy == DROP_OLDEST:
+                    while self.depth > 0 and not self._fits(size):
+                        self._popleft()
+                        self.dropped += 1
+                else:
+                    self._spill(enqueued, message)
+                    continue
+
+            self._append(enqueued, message, size)
+
+    # Raises Empty once the queue is closed and empty
+    def get(self, block=True, timeout=None):
+        while self.depth == 0 and self.spill_pending == 0:
+            if self.closed:
+                raise gevent.queue.Empty()
+            self.not_empty.clear()
+            if not block or not self.not_empty.wait(timeout):
+                raise gevent.queue.Empty()
+
+        self._unspill()
+
+        enqueued = self.items[0][0]
+        messages = [message for _, message, _ in self.items]
+        self.items.clear()
+        self.depth = 0
+        self.depth_bytes = 0
+        self.not_full.set()
+
+        # Refill from the spill file, so it keeps draining while we're busy
+        self._unspill()
+
+        return enqueued, messages
+
+    # Stops put() from blocking, so a connect greenlet waiting for room can
+    # finish when the client shuts down, and wakes get()
+    def close(self):
+        self.closed = True
+        self.not_full.set()
+        self.not_empty.set()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self.depth + self.spill_pending
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _fits(self, size):
+        # Always take at least one message, however big
+        if self.depth == 0:
+            return True
+        if self.max_messages is not None and \
+           self.depth + 1 > self.max_messages:
+            return False
+        if self.max_bytes is not None and \
+           self.depth_bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def _append(self, enqueued, message, size):
+        self.items.append((enqueued, message, size))
+        self.depth += 1
+        self.depth_bytes += size
+        self.not_empty.set()
+
+    def _popleft(self):
+        enqueued, message, size = self.items.popleft()
+        self.depth -= 1
+        self.depth_bytes -= size
+
+    def _spill(self, enqueued, message):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(
+                dir=self.spill_directory
+            )
+
+        data = encode_message(message)
+        self.spill_file.seek(0, 2)
+        self.spill_file.write(_SPILL_HEADER.pack(enqueued, len(data)))
+        self.spill_file.write(data)
+        self.spill_pending += 1
+        self.spilled += 1
+        self.not_empty.set()
+
+    def _unspill(self):
+        if self.spill_pending == 0:
+            return
+
+        self.spill_file.seek(self.spill_read_offset)
+        while self.spill_pending:
+            enqueued, length = _SPILL_HEADER.unpack(
+                self.spill_file.read(_SPILL_HEADER.size)
+            )
+            data = self.spill_file.read(length)
+            if not self._fits(length if self.max_bytes is not None else 0):
+                break
+
+            message = json.loads(data)
+            size = 0 if self.max_bytes is None else length
+            self.spill_read_offset += _SPILL_HEADER.size + length
+            self.spill_pending -= 1
+            self._append(enqueued, message, size)
+
+        if self.spill_pending == 0:
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.spill_read_offset = 0
+
+
+# Stands in for the message queue of a client hosted by a
+# python_bayeux.hub.BayeuxHub: pushed messages go straight to the hub's
+# dispatcher
+class TenantQueue(object):
+    def __init__(self, hub, client):
+        self.hub = hub
+        self.client = client
+
+    def put(self, item):
+        self.hub._put(self.client, item)
+
+    def qsize(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def _size(message):
+    return len(encode_message(message))
@@ -0,0 +1,132 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import random
+
+# The states a client's connection goes through.  A client starts out
+# HANDSHAKING, is CONNECTING until its first connect comes back, and is then
+# CONNECTED for as long as connects succeed.  After an error it is
+# BACKING_OFF until the next attempt, and if the server advises reconnect
+# 'none' it is DISCONNECTED for good.
+HANDSHAKING = 'handshaking'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+BACKING_OFF = 'backing_off'
+DISCONNECTED = 'disconnected'
+
+
+# Decides when, and how, a client connects next, from the server's advice
+# (reconnect, interval and timeout) and the errors seen since the last
+# successful connect.
+#
+# After an error, the next attempt waits the advised interval plus a random
+# part of an exponential backoff (backoff seconds, doubling with each error
+# up to max_backoff), so that many clients that failed together don't all
+# come back at the same moment.
+class Reconnector(object):
+    def __init__(self, backoff=0.5, max_backoff=60.0, random=random.random):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.random = random
+
+        self.state = HANDSHAKING
+        self.handshake_required = True
+        self.failures = 0
+
+        # The latest advice, in seconds
+        self.reconnect = 'retry'
+        self.interval = 0.0
+        self.timeout = None
+
+    def advise(self, advice):
+        if advice is None:
+            return
+        if 'reconnect' in advice:
+            self.reconnect = advice['reconnect']
+        if 'interval' in advice:
+            self.interval = advice['interval'] / 1000.0
+        if 'timeout' in advice:
+            self.timeout = advice['timeout'] / 1000.0
+
+    # A handshake succeeded
+    def handshook(self, response):
+        self.reconnect = 'retry'
+        self.advise(response.get('advice'))
+        self.handshake_required = False
+        self.failures = 0
+        self.state = CONNECTING
+
+    # A connect succeeded
+    def connected(self, response):
+        self.advise(response.get('advice'))
+        self.failures = 0
+        self._follow_advice(CONNECTED)
+
+    # The server answered a handshake or connect with successful: false
+    def unsuccessful(self, response):
+        self.advise(response.get('advice'))
+        if response.get('error', '').startswith('403::Unknown client'):
+            self.handshake_required = True
+        self.failed()
+
+    # A handshake or connect failed: a timeout, a network error, a 5xx
+    # response or an unsuccessful one
+    def failed(self):
+        self.failures += 1
+        self._follow_advice(BACKING_OFF)
+
+    def _follow_advice(self, state):
+        if self.reconnect == 'none':
+            self.state = DISCONNECTED
+            return
+
+        if self.reconnect == 'handshake':
+            self.handshake_required = True
+        self.state = state
+
+    # The next handshake or connect is starting
+    def attempting(self):
+        if self.handshake_required:
+            self.state = HANDSHAKING
+        elif self.state != CONNECTED:
+            self.state = CONNECTING
+
+    # Seconds to wait before the next handshake or connect
+    def delay(self):
+        if self.failures == 0:
+            return self.interval
+
+        ceiling = min(self.max_backoff,
+                      self.backoff * 2 ** (self.failures - 1))
+        return self.interval + self.random() * ceiling
+
+    @property
+    def stopped(self):
+        return self.state == DISCONNECTED
@@ -0,0 +1,313 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import gevent
+import gevent.event
+import gevent.queue
+import simplejson as json
+
+from python_bayeux.message import encode_message
+
+# Every record is its length and crc32, then that many bytes of JSON.  Segment
+# files are zero filled when they are created, so a zero length marks the end
+# of what has been written.
+_HEADER = struct.Struct('<II')
+_SEGMENT_SUFFIX = '.seg'
+_COMMIT_FILE = 'commit'
+
+
+# An append-only log of messages in memory mapped segment files in directory.
+# Messages are appended by the connect side, read back in order by the execute
+# side, and commit() records how far the execute side has got.  Anything
+# appended but not committed is read again when the spool is reopened, so
+# messages that were received but not handled when the process died are
+# replayed on restart.
+#
+# Appends are flushed to disk at most every fsync_interval seconds, or every
+# fsync_batch records, whichever comes first; 0 for either flushes every
+# append.  Records appended just before a quiet spell are flushed by a timer
+# once fsync_interval is up, rather than waiting for the next append.  A new
+# segment is started when the current one reaches
+# segment_size, and segments are deleted once everything in them has been
+# committed.
+class SegmentSpool(object):
+    def __init__(self, directory, segment_size=64 * 1024 * 1024,
+                 fsync_interval=0.05, fsync_batch=1000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+
+        self.segments = {}
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.flush_timer = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        numbers = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(_SEGMENT_SUFFIX)
+        )
+
+        self.commit_position = self._read_commit() or \
+            ((numbers[0] if numbers else 0), 0)
+        self.read_position = self.commit_position
+
+        if not numbers:
+            numbers = [self.commit_position[0]]
+            self._create_segment(numbers[0], self.segment_size)
+
+        for number in numbers:
+            if number < self.commit_position[0]:
+                os.remove(self._segment_path(number))
+
+        self.write_segment = numbers[-1]
+        self.write_offset = self._scan_end(self.write_segment)
+
+    def append(self, messages):
+        for message in messages:
+            data = encode_message(message)
+            needed = _HEADER.size + len(data)
+
+            segment = self._segment(self.write_segment)
+            # Leave room for the zero length that ends the segment
+            if self.write_offset + needed + _HEADER.size > len(segment):
+                self._rotate(needed + _HEADER.size)
+                segment = self._segment(self.write_segment)
+
+            offset = self.write_offset
+            segment[offset + _HEADER.size:offset + needed] = data
+            segment[offset:offset + _HEADER.size] = _HEADER.pack(
+                len(data),
+                zlib.crc32(data)
+            )
+            self.write_offset += needed
+            self.unflushed += 1
+
+        since_flush = time.monotonic() - self.last_flush
+        if self.unflushed >= self.fsync_batch or \
+           since_flush >= self.fsync_interval:
+            self.flush()
+        elif self.unflushed and self.flush_timer is None:
+            self.flush_timer = gevent.spawn_later(
+                self.fsync_interval - since_flush,
+                self._timed_flush
+            )
+
+    def _timed_flush(self):
+        self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        if self.unflushed:
+            self._segment(self.write_segment).flush()
+            self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    # Up to max_messages of the messages after the read position.  The read
+    # position moves past them, but they are read again after a restart
+    # unless commit() is called.
+    def read(self, max_messages=None):
+        messages = []
+        number, offset = self.read_position
+        while max_messages is None or len(messages) < max_messages:
+            if (number, offset) == (self.write_segment, self.write_offset):
+                break
+
+            segment = self._segment(number)
+            length, crc = _HEADER.unpack_from(segment, offset) \
+                if offset + _HEADER.size <= len(segment) else (0, 0)
+            if length == 0:
+                # End of this segment; carry on with the next
+                number, offset = number + 1, 0
+                continue
+
+            start = offset + _HEADER.size
+            messages.append(json.loads(segment[start:start + length]))
+            offset = start + length
+
+        self.read_position = (number, offset)
+        return messages
+
+    def pending(self):
+        return self.read_position != (self.write_segment, self.write_offset)
+
+    # Records that everything read so far has been handled
+    def commit(self):
+        if self.commit_position == self.read_position:
+            return
+
+        committed_segment = self.commit_position[0]
+        self.commit_position = self.read_position
+
+        # Not fsynced: losing a commit after a crash only means handling
+        # some messages again
+        path = os.path.join(self.directory, _COMMIT_FILE)
+        with open(path + '.tmp', 'w') as commit_file:
+            json.dump(list(self.commit_position), commit_file)
+        os.replace(path + '.tmp', path)
+
+        for number in range(committed_segment, self.commit_position[0]):
+            self._close_segment(number)
+            os.remove(self._segment_path(number))
+
+    def close(self):
+        if self.flush_timer is not None:
+            self.flush_timer.kill()
+            self.flush_timer = None
+        self.flush()
+        for number in list(self.segments):
+            self._close_segment(number)
+
+    def _read_commit(self):
+        try:
+            with open(os.path.join(self.directory, _COMMIT_FILE)) as f:
+                return tuple(json.load(f))
+        except (IOError, ValueError):
+            return None
+
+    def _segment_path(self, number):
+        return os.path.join(
+            self.directory,
+            '{0:020d}{1}'.format(number, _SEGMENT_SUFFIX)
+        )
+
+    def _create_segment(self, number, size):
+        with open(self._segment_path(number), 'wb') as segment_file:
+            segment_file.truncate(size)
+
+    def _segment(self, number):
+        try:
+            return self.segments[number]
+        except KeyError:
+            pass
+
+        with open(self._segment_path(number), 'r+b') as segment_file:
+            segment = mmap.mmap(segment_file.fileno(), 0)
+        self.segments[number] = segment
+        return segment
+
+    def _close_segment(self, number):
+        segment = self.segments.pop(number, None)
+        if segment is not None:
+            segment.close()
+
+    def _rotate(self, needed):
+        self.flush()
+        if self.write_segment != self.read_position[0]:
+            self._close_segment(self.write_segment)
+
+        self.write_segment += 1
+        self.write_offset = 0
+        self._create_segment(
+            self.write_segment,
+            max(self.segment_size, needed)
+        )
+
+    # Finds the end of the valid records in a segment.  A torn or corrupt
+    # record from a crash ends it.
+    def _scan_end(self, number):
+        segment = self._segment(number)
+        offset = self.read_position[1] \
+            if number == self.read_position[0] else 0
+        while offset + _HEADER.size <= len(segment):
+            length, crc = _HEADER.unpack_from(segment, offset)
+            start = offset + _HEADER.size
+            if length == 0 or start + length > len(segment) or \
+               zlib.crc32(segment[start:start + length]) != crc:
+                break
+            offset = start + length
+
+        # Clear anything after the end, so new records aren't mistaken for
+        # the tail of a torn one
+        segment[offset:offset + _HEADER.size] = \
+            b'\0' * min(_HEADER.size, len(segment) - offset)
+        return offset
+
+
+# Stands in for the client's message queue, keeping messages in a
+# SegmentSpool instead of in memory.  get() returns up to max_batch spooled
+# messages, and the client calls commit() once it has handled them.
+class SpoolQueue(object):
+    def __init__(self, spool, max_batch=1000):
+        self.spool = spool
+        self.max_batch = max_batch
+        self.not_empty = gevent.event.Event()
+        self.enqueued = None
+        self.closed = False
+
+    def put(self, item):
+        enqueued, messages = item
+        self.spool.append(messages)
+        if self.enqueued is None:
+            self.enqueued = enqueued
+        self.not_empty.set()
+
+    def get(self, block=True, timeout=None):
+        while not self.spool.pending():
+            if self.closed:
+                raise gevent.queue.Empty()
+            self.not_empty.clear()
+            if not block or not self.not_empty.wait(timeout):
+                raise gevent.queue.Empty()
+
+        enqueued = self.enqueued if self.enqueued is not None \
+            else time.monotonic()
+        messages = self.spool.read(self.max_batch)
+        self.enqueued = None if not self.spool.pending() \
+            else time.monotonic()
+
+        return enqueued, messages
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def commit(self):
+        self.spool.commit()
+
+    def qsize(self):
+        return 1 if self.spool.pending() else 0
+
+    def empty(self):
+        return not self.spool.pending()
+
+    # Wakes get(), which raises Empty once everything is handled
+    def close(self):
+        self.closed = True
+        self.not_empty.set()
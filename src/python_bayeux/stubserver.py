@@ -0,0 +1,267 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import itertools
+import logging
+import socket
+import zlib
+
+import gevent.event
+import gevent.pywsgi
+import simplejson as json
+
+from python_bayeux.channels import ChannelTrie
+
+LOG = logging.getLogger('python_bayeux.stubserver')
+
+
+# A small in-process bayeux server, for tests and benchmarks.  It speaks
+# long-polling over HTTP on a gevent WSGI server: handshakes, held connects,
+# subscribes (wildcards included), unsubscribes, disconnects, and publishes,
+# which are pushed to every subscribed client.  Code running alongside it
+# can push with publish().
+#
+#     with StubServer() as server:
+#         client = BayeuxClient(server.url)
+#         ...
+#
+# Connects are held for up to timeout milliseconds, or until there is
+# something to push; that and interval are sent as advice.  requests counts
+# the messages received by channel, and http_requests the requests they came
+# in.
+class StubServer(object):
+    def __init__(self, host='127.0.0.1', port=0, path='/cometd',
+                 timeout=10000, interval=0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.interval = interval
+
+        self.clients = {}
+        self.client_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.requests = collections.Counter()
+        self.http_requests = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}{2}'.format(self.host, self.port, self.path)
+
+    def start(self):
+        self.server = _WSGIServer(
+            (self.host, self.port),
+            self.application,
+            log=None
+        )
+        self.server.start()
+        self.port = self.server.server_port
+
+    def stop(self):
+        self.wake()
+        if self.server is not None:
+            self.server.stop(timeout=1)
+            self.server = None
+
+    # Answers every held connect now
+    def wake(self):
+        for client in self.clients.values():
+            client.event.set()
+
+    # Pushes data on channel to every subscribed client, and returns the
+    # message
+    def publish(self, channel, data):
+        message = {
+            'channel': channel,
+            'data': data,
+            'id': str(next(self.message_ids))
+        }
+        for client in self.clients.values():
+            if client.subscriptions.match(channel):
+                client.pending.append(message)
+                client.event.set()
+        return message
+
+    def application(self, environ, start_response):
+        self.http_requests += 1
+        body = environ['wsgi.input'].read()
+        if environ.get('HTTP_CONTENT_ENCODING') in ('gzip', 'deflate'):
+            # Either a gzip or a zlib header
+            body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+
+        payload = json.loads(body)
+        status, responses = self.handle(
+            payload if isinstance(payload, list) else [payload]
+        )
+
+        content = b'' if responses is None \
+            else json.dumps(responses).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(content)))
+        ])
+        return [content]
+
+    # Returns the HTTP status and the response elements for the messages of
+    # one request.  A connect is answered last, so that it can be held
+    # without holding up the rest.
+    def handle(self, messages):
+        responses = []
+        connect = None
+        for message in messages:
+            channel = message['channel']
+            self.requests[channel] += 1
+            if channel == '/meta/connect':
+                connect = message
+                continue
+
+            handler = self.handlers.get(channel, StubServer._publish)
+            responses.append(handler(self, message))
+
+        if connect is not None:
+            responses.extend(self._connect(connect))
+
+        return '200 OK', responses
+
+    def _response(self, message, successful=True, **kwargs):
+        response = {
+            'channel': message['channel'],
+            'successful': successful
+        }
+        if 'id' in message:
+            response['id'] = message['id']
+        response.update(kwargs)
+        return response
+
+    def _unknown_client(self, message):
+        return self._response(
+            message,
+            successful=False,
+            error='403::Unknown client',
+            advice={'reconnect': 'handshake', 'interval': 0}
+        )
+
+    def _handshake(self, message):
+        client = _StubClient('stub-{0}'.format(next(self.client_ids)))
+        self.clients[client.client_id] = client
+        return self._response(
+            message,
+            clientId=client.client_id,
+            version='1.0',
+            supportedConnectionTypes=['long-polling'],
+            advice={'reconnect': 'retry', 'interval': self.interval,
+                    'timeout': self.timeout}
+        )
+
+    def _connect(self, message):
+        client = self.clients.get(message.get('clientId'))
+        if client is None:
+            return [self._unknown_client(message)]
+
+        # The first connect comes straight back with the advice
+        if client.connected and not client.pending:
+            client.event.clear()
+            client.event.wait(self.timeout / 1000.0)
+        client.connected = True
+
+        pushes = client.pending
+        client.pending = []
+        response = self._response(
+            message,
+            advice={'reconnect': 'retry', 'interval': self.interval,
+                    'timeout': self.timeout}
+        )
+        return [response] + pushes
+
+    def _subscribe(self, message):
+        client = self.clients.get(message.get('clientId'))
+        if client is None:
+            return self._unknown_client(message)
+
+        client.subscriptions.add(message['subscription'])
+        return self._response(message, subscription=message['subscription'])
+
+    def _unsubscribe(self, message):
+        client = self.clients.get(message.get('clientId'))
+        if client is None:
+            return self._unknown_client(message)
+
+        client.subscriptions.remove(message['subscription'])
+        return self._response(message, subscription=message['subscription'])
+
+    def _disconnect(self, message):
+        client = self.clients.pop(message.get('clientId'), None)
+        if client is None:
+            return self._unknown_client(message)
+
+        client.event.set()
+        return self._response(message)
+
+    def _publish(self, message):
+        if message.get('clientId') not in self.clients:
+            return self._unknown_client(message)
+
+        self.publish(message['channel'], message.get('data'))
+        return self._response(message)
+
+    handlers = {
+        '/meta/handshake': _handshake,
+        '/meta/subscribe': _subscribe,
+        '/meta/unsubscribe': _unsubscribe,
+        '/meta/disconnect': _disconnect,
+    }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+
+class _WSGIServer(gevent.pywsgi.WSGIServer):
+    # Otherwise every response waits on the client's delayed ACK
+    def handle(self, client_socket, address):
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super(_WSGIServer, self).handle(client_socket, address)
+
+
+class _StubClient(object):
+    __slots__ = ('client_id', 'subscriptions', 'pending', 'event',
+                 'connected')
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = ChannelTrie()
+        self.pending = []
+        self.event = gevent.event.Event()
+        self.connected = False
@@ -0,0 +1,238 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import collections
+import logging
+import sys
+
+from gevent import monkey
+
+LOG = logging.getLogger('python_bayeux.tracing')
+
+
+# Receives timed events from a BayeuxClient.  All durations are in seconds.
+# The methods here do nothing, except callback(), which warns about slow
+# callbacks if slow_callback_threshold is set; subclass and override the
+# events you care about.
+#
+# If profile_interval is set, a SamplingProfiler samples the client's stack
+# every profile_interval seconds while the client is running.
+class Tracer(object):
+    def __init__(self, slow_callback_threshold=None, profile_interval=None):
+        self.slow_callback_threshold = slow_callback_threshold
+        self.profiler = None \
+            if profile_interval is None \
+            else SamplingProfiler(profile_interval)
+
+    # handshake() finished, including the initial connect
+    def handshake(self, client, duration):
+        pass
+
+    # A /meta/connect long poll came back with message_count pushes
+    def connect(self, client, duration, message_count):
+        pass
+
+    # A request carrying messages for channels was sent and answered
+    def send(self, client, channels, duration):
+        pass
+
+    # An item spent duration waiting in queue_name ('message', 'subscription',
+    # 'unsubscription' or 'publication')
+    def queue_wait(self, client, queue_name, duration):
+        pass
+
+    # A request body of size bytes was compressed to compressed_size bytes
+    # with encoding ('gzip' or 'deflate')
+    def compress(self, client, encoding, size, compressed_size, duration):
+        pass
+
+    # Pushed messages were queued for their callbacks
+    def receive(self, client, messages):
+        pass
+
+    # A message from channel is about to go to its callbacks
+    def dispatch(self, client, channel):
+        pass
+
+    # After a re-handshake, channel_count channels were subscribed again
+    def resubscribe(self, client, channel_count, duration):
+        pass
+
+    # A callback handled a message from channel
+    def callback(self, client, channel, callback, duration):
+        if self.slow_callback_threshold is not None and \
+           duration >= self.slow_callback_threshold:
+            self.slow_callback(client, channel, callback, duration)
+
+    def slow_callback(self, client, channel, callback, duration):
+        LOG.warning(
+            'slow callback: client id %s took %.3f seconds running %s for '
+            'channel %s',
+            client.client_id,
+            duration,
+            callback_name(callback),
+            channel
+        )
+
+    def start(self, client):
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def stop(self, client):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+
+# Keeps simple aggregate timings for every event, which is usually enough to
+# tell whether time is going to the network or to callbacks
+class StatsTracer(Tracer):
+    def __init__(self, **kwargs):
+        super(StatsTracer, self).__init__(**kwargs)
+        self.stats = collections.defaultdict(TimingStats)
+        self.slow_callbacks = collections.Counter()
+        # By encoding, so the saving can be weighed against stats['compress:']
+        self.uncompressed_bytes = collections.Counter()
+        self.compressed_bytes = collections.Counter()
+
+    def handshake(self, client, duration):
+        self.stats['handshake'].add(duration)
+
+    def connect(self, client, duration, message_count):
+        self.stats['connect'].add(duration)
+
+    def send(self, client, channels, duration):
+        self.stats['send'].add(duration)
+
+    def queue_wait(self, client, queue_name, duration):
+        self.stats['queue_wait:' + queue_name].add(duration)
+
+    def compress(self, client, encoding, size, compressed_size, duration):
+        self.stats['compress:' + encoding].add(duration)
+        self.uncompressed_bytes[encoding] += size
+        self.compressed_bytes[encoding] += compressed_size
+
+    def callback(self, client, channel, callback, duration):
+        self.stats['callback:' + channel].add(duration)
+        super(StatsTracer, self).callback(client, channel, callback, duration)
+
+    def slow_callback(self, client, channel, callback, duration):
+        self.slow_callbacks[(channel, callback_name(callback))] += 1
+        super(StatsTracer, self).slow_callback(
+            client, channel, callback, duration
+        )
+
+
+class TimingStats(object):
+    __slots__ = ('count', 'total', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum:
+            self.maximum = duration
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return 'TimingStats(count={0}, mean={1:.6f}, maximum={2:.6f})'.format(
+            self.count,
+            self.mean,
+            self.maximum
+        )
+
+
+# Samples the stack of the thread that called start() from a real OS thread.
+# Every greenlet runs in that thread, so the samples show whatever greenlet
+# is holding the hub, which is where the time is going when throughput drops.
+class SamplingProfiler(object):
+    def __init__(self, interval=0.005, max_depth=20):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.running = False
+        self.thread_id = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+
+        # Even if threading is monkey patched, sample from a native thread,
+        # or we would only ever run when the hub lets us
+        get_ident = monkey.get_original('_thread', 'get_ident')
+        start_new_thread = monkey.get_original('_thread', 'start_new_thread')
+        self.thread_id = get_ident()
+        start_new_thread(self._run, ())
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        sleep = monkey.get_original('time', 'sleep')
+        while self.running:
+            sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+
+            self.samples[tuple(stack)] += 1
+            self.sample_count += 1
+
+    # The functions that were running (not just on the stack) most often, as
+    # ((filename, line number, function name), fraction of samples)
+    def top(self, count=10):
+        innermost = collections.Counter()
+        for stack, hits in list(self.samples.items()):
+            if stack:
+                innermost[stack[0]] += hits
+
+        total = float(self.sample_count) or 1.0
+        return [(frame, hits / total)
+                for frame, hits in innermost.most_common(count)]
+
+
+def callback_name(callback):
+    if isinstance(callback, str):
+        return callback
+    return getattr(callback, '__qualname__', None) or repr(callback)
@@ -0,0 +1,538 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import logging
+import socket
+import ssl
+from urllib.parse import urlsplit
+
+import gevent
+import gevent.event
+import gevent.lock
+import requests.exceptions
+
+from python_bayeux.message import parse_messages
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:  # pragma: no cover
+    h2 = None
+
+try:
+    import websocket
+except ImportError:  # pragma: no cover
+    websocket = None
+
+LOG = logging.getLogger('python_bayeux.transport')
+
+
+# A way of carrying bayeux messages other than long-polling over HTTP, which
+# BayeuxClient always supports.  The client offers connection_type in its
+# handshake, and if the server supports it too, calls open(); if open()
+# raises, the client stays with long-polling.  From then on, send() carries
+# every message except handshakes, and the transport puts pushed messages on
+# client.message_queue as they arrive.
+class Transport(object):
+    connection_type = None
+
+    def open(self, client):
+        pass
+
+    # Sends one message or a list of them, and returns the list of response
+    # elements.  Raises requests.exceptions.ReadTimeout after timeout
+    # seconds, and TransportClosedException if the transport stopped working.
+    def send(self, client, payload, timeout=None):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+# Raised by a Transport that can no longer carry messages.  Senders retry, as
+# they do after a timeout, while the connect greenlet handshakes again over
+# long-polling.
+class TransportClosedException(requests.exceptions.ReadTimeout):
+    pass
+
+
+# Bayeux over one persistent WebSocket, which carries connects, subscribes
+# and publishes with no HTTP request per message, and pushes as soon as the
+# server sends them, rather than when a long poll comes back.  Requires
+# websocket-client (pip install python-bayeux[websocket]).
+#
+# url defaults to the client's endpoint with ws:// or wss:// in place of
+# http:// or https://.  header is a list of extra headers for the upgrade
+# request, such as an Authorization header; the cookies in the client's
+# session are sent as well.
+class WebSocketTransport(Transport):
+    connection_type = 'websocket'
+
+    def __init__(self, url=None, header=None, open_timeout=10):
+        if websocket is None:
+            raise ImportError('WebSocketTransport requires websocket-client')
+
+        self.url = url
+        self.header = header
+        self.open_timeout = open_timeout
+        self.socket = None
+        self.reader = None
+        self.closed = False
+
+        # The responses we are waiting for, by message id
+        self.waiting = {}
+
+    def open(self, client):
+        url = self.url
+        if url is None:
+            url = 'ws' + client.endpoint[len('http'):]
+
+        cookies = getattr(client.oauth_session, 'cookies', None)
+        options = {}
+        if cookies:
+            options['cookie'] = '; '.join(
+                '{0}={1}'.format(name, value)
+                for name, value in cookies.items()
+            )
+
+        self.socket = websocket.create_connection(
+            url,
+            timeout=self.open_timeout,
+            header=self.header,
+            enable_multithread=True,
+            **options
+        )
+        # The reader waits for as long as it takes
+        self.socket.settimeout(None)
+        self.closed = False
+
+        self.reader = gevent.spawn(self._reader_greenlet, client)
+
+    def send(self, client, payload, timeout=None):
+        if self.closed:
+            raise TransportClosedException('websocket is closed')
+
+        messages = payload if isinstance(payload, list) else [payload]
+        ids = [message['id'] for message in messages if 'id' in message]
+
+        pending = _PendingResponse(len(ids))
+        for message_id in ids:
+            self.waiting[message_id] = pending
+
+        try:
+            self.socket.send(
+                client.codec.dumps(messages),
+                opcode=websocket.ABNF.OPCODE_TEXT
+            )
+            if not pending.event.wait(timeout=timeout):
+                raise requests.exceptions.ReadTimeout(
+                    'no response over websocket in {0} seconds'.format(
+                        timeout
+                    )
+                )
+        except (websocket.WebSocketException, OSError) as e:
+            self._closed(e)
+            raise TransportClosedException(str(e))
+        finally:
+            for message_id in ids:
+                self.waiting.pop(message_id, None)
+
+        if pending.exception is not None:
+            raise pending.exception
+
+        return pending.elements
+
+    def _reader_greenlet(self, client):
+        try:
+            while True:
+                opcode, data = self.socket.recv_data()
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    raise websocket.WebSocketConnectionClosedException(
+                        'closed by the server'
+                    )
+                self._received(client, data)
+        except Exception as e:
+            if not self.closed:
+                LOG.warning('websocket reader stopped: %s', e)
+            self._closed(e)
+
+    def _received(self, client, data):
+        if client.lazy_messages:
+            elements = parse_messages(data)
+        else:
+            elements = client.codec.loads(data)
+
+        pushes = []
+        for element in elements:
+            # Pushed messages may carry an id too, but never 'successful'
+            pending = None
+            if 'successful' in element or \
+               element['channel'].startswith('/meta/'):
+                pending = self.waiting.get(element.get('id'))
+
+            if pending is not None:
+                pending.add(element)
+            elif 'data' in element:
+                pushes.append(element)
+            else:
+                LOG.info('unexpected websocket message: %s', element)
+
+        # Straight to the callbacks, without waiting for a connect to return
+        if len(pushes) > 0:
+            client._queue_pushes(pushes)
+
+    def _closed(self, exception):
+        self.closed = True
+        for pending in set(self.waiting.values()):
+            pending.fail(TransportClosedException(str(exception)))
+
+    def close(self):
+        self.closed = True
+        if self.socket is not None:
+            # Don't wait for the server's close frame: the reader greenlet
+            # owns the receiving side of the socket
+            try:
+                self.socket.send_close()
+            except Exception:
+                pass
+            self.socket.shutdown()
+        if self.reader is not None and self.reader is not gevent.getcurrent():
+            self.reader.join(timeout=self.open_timeout)
+
+
+# Long-polling over a single HTTP/2 connection, on which the held connect
+# and any number of subscribes and publishes are concurrent streams, rather
+# than each taking a connection of its own.  Requires h2
+# (pip install python-bayeux[http2]).
+#
+# Cookies and headers are copied from the client's session when the
+# transport is opened; pass headers for any that the session adds per
+# request, such as an OAuth Authorization header.  For https endpoints,
+# HTTP/2 is negotiated with ALPN, and if the server doesn't support it the
+# client stays with HTTP/1.1.  For plain http, set prior_knowledge to speak
+# HTTP/2 directly.
+#
+# A connect that gets a 5xx response raises ServerErrorException, as it would
+# over long-polling.  Any other response that isn't 2xx, such as a 401 once
+# the copied headers have expired, closes the transport, and the client
+# handshakes again over long-polling.
+class HTTP2Transport(Transport):
+    connection_type = 'long-polling'
+
+    def __init__(self, headers=None, prior_knowledge=False, open_timeout=10,
+                 ssl_context=None):
+        if h2 is None:
+            raise ImportError('HTTP2Transport requires h2')
+
+        self.headers = headers
+        self.prior_knowledge = prior_knowledge
+        self.open_timeout = open_timeout
+        self.ssl_context = ssl_context
+
+        self.socket = None
+        self.connection = None
+        self.reader = None
+        self.closed = False
+        self.lock = gevent.lock.RLock()
+        self.window_open = gevent.event.Event()
+
+        # The streams we are waiting for, by stream id
+        self.streams = {}
+
+    def open(self, client):
+        parts = urlsplit(client.endpoint)
+        secure = parts.scheme == 'https'
+        if not secure and not self.prior_knowledge:
+            raise ValueError('plain http needs prior_knowledge')
+
+        port = parts.port or (443 if secure else 80)
+        self.socket = socket.create_connection(
+            (parts.hostname, port),
+            timeout=self.open_timeout
+        )
+        # Small frames for many streams go out as soon as they are written
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secure:
+            context = self.ssl_context or ssl.create_default_context()
+            context.set_alpn_protocols(['h2', 'http/1.1'])
+            self.socket = context.wrap_socket(
+                self.socket,
+                server_hostname=parts.hostname
+            )
+            if self.socket.selected_alpn_protocol() != 'h2':
+                self.socket.close()
+                raise ValueError('the server does not support HTTP/2')
+        # The reader waits for as long as it takes
+        self.socket.settimeout(None)
+
+        self.request_headers = [
+            (':method', 'POST'),
+            (':scheme', parts.scheme),
+            (':authority', parts.netloc),
+            (':path', (parts.path or '/') +
+             ('?' + parts.query if parts.query else '')),
+            ('content-type', 'application/json'),
+        ] + self._session_headers(client.oauth_session)
+
+        self.connection = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=True)
+        )
+        self.connection.initiate_connection()
+        self.closed = False
+        self._flush()
+
+        self.reader = gevent.spawn(self._reader_greenlet)
+
+    def _session_headers(self, session):
+        headers = {}
+        for name, value in (getattr(session, 'headers', None) or {}).items():
+            headers[name.lower()] = value
+        for name, value in (self.headers or {}).items():
+            headers[name.lower()] = value
+
+        cookies = getattr(session, 'cookies', None)
+        if cookies:
+            headers['cookie'] = '; '.join(
+                '{0}={1}'.format(name, value)
+                for name, value in cookies.items()
+            )
+
+        # Responses are read as they come, so don't ask for them compressed
+        return [(name, value) for name, value in headers.items()
+                if name not in _CONNECTION_HEADERS and
+                name != 'accept-encoding']
+
+    def send(self, client, payload, timeout=None):
+        if self.closed:
+            raise TransportClosedException('HTTP/2 connection is closed')
+
+        body = client.codec.dumps(payload)
+        stream = _Stream()
+        stream_id = None
+        try:
+            with self.lock:
+                stream_id = self.connection.get_next_available_stream_id()
+                self.streams[stream_id] = stream
+                self.connection.send_headers(
+                    stream_id,
+                    self.request_headers +
+                    [('content-length', str(len(body)))]
+                )
+            self._send_body(stream_id, body)
+
+            if not stream.event.wait(timeout=timeout):
+                with self.lock:
+                    self.connection.reset_stream(stream_id)
+                self._flush()
+                raise requests.exceptions.ReadTimeout(
+                    'no HTTP/2 response in {0} seconds'.format(timeout)
+                )
+        except (h2.exceptions.ProtocolError, OSError) as e:
+            self._closed(e)
+            raise TransportClosedException(str(e))
+        finally:
+            self.streams.pop(stream_id, None)
+
+        if stream.exception is not None:
+            raise stream.exception
+
+        content = bytes(stream.data)
+        LOG.info(
+            'HTTP2Transport.send(): response status code: %s  '
+            'response content: %s',
+            stream.status,
+            content
+        )
+
+        status = 200 if stream.status is None else int(stream.status)
+        if not 200 <= status < 300:
+            client._check_server_error(payload, status)
+            # Anything else, such as a 401 once the headers we copied from
+            # the session have expired, means we can't go on with them
+            error = TransportClosedException(
+                'HTTP/2 response status {0}'.format(status)
+            )
+            self._closed(error)
+            raise error
+
+        if len(content) == 0:
+            return ''
+
+        if client.lazy_messages and not isinstance(payload, list) and \
+           payload['channel'] == '/meta/connect':
+            return parse_messages(content)
+
+        return client.codec.loads(content)
+
+    # Sends as much of body as flow control allows at a time
+    def _send_body(self, stream_id, body):
+        position = 0
+        while True:
+            with self.lock:
+                size = min(
+                    len(body) - position,
+                    self.connection.local_flow_control_window(stream_id),
+                    self.connection.max_outbound_frame_size
+                )
+                if size > 0:
+                    self.connection.send_data(
+                        stream_id,
+                        body[position:position + size],
+                        end_stream=position + size == len(body)
+                    )
+                    position += size
+                else:
+                    self.window_open.clear()
+            self._flush()
+
+            if position == len(body):
+                return
+            if size <= 0:
+                self.window_open.wait()
+
+    def _flush(self):
+        with self.lock:
+            data = self.connection.data_to_send()
+            if data:
+                self.socket.sendall(data)
+
+    def _reader_greenlet(self):
+        try:
+            while True:
+                data = self.socket.recv(65536)
+                if not data:
+                    raise OSError('closed by the server')
+
+                with self.lock:
+                    events = self.connection.receive_data(data)
+                for event in events:
+                    self._handle_event(event)
+                self._flush()
+        except Exception as e:
+            if not self.closed:
+                LOG.warning('HTTP/2 reader stopped: %s', e)
+            self._closed(e)
+
+    def _handle_event(self, event):
+        stream = self.streams.get(getattr(event, 'stream_id', None))
+
+        if isinstance(event, h2.events.ResponseReceived):
+            if stream is not None:
+                stream.status = dict(event.headers).get(b':status')
+        elif isinstance(event, h2.events.DataReceived):
+            with self.lock:
+                self.connection.acknowledge_received_data(
+                    event.flow_controlled_length,
+                    event.stream_id
+                )
+            if stream is not None:
+                stream.data += event.data
+        elif isinstance(event, h2.events.StreamEnded):
+            if stream is not None:
+                stream.event.set()
+        elif isinstance(event, h2.events.StreamReset):
+            if stream is not None:
+                stream.fail(TransportClosedException(
+                    'stream reset with error code {0}'.format(
+                        event.error_code
+                    )
+                ))
+        elif isinstance(event, h2.events.WindowUpdated):
+            self.window_open.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            raise OSError('connection terminated by the server')
+
+    def _closed(self, exception):
+        self.closed = True
+        self.window_open.set()
+        for stream in list(self.streams.values()):
+            stream.fail(TransportClosedException(str(exception)))
+
+    def close(self):
+        self.closed = True
+        if self.socket is not None:
+            try:
+                with self.lock:
+                    self.connection.close_connection()
+                self._flush()
+            except Exception:
+                pass
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+        if self.reader is not None and self.reader is not gevent.getcurrent():
+            self.reader.join(timeout=self.open_timeout)
+
+
+# Headers that HTTP/2 doesn't allow
+_CONNECTION_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding',
+    'upgrade', 'host', 'te', 'content-length', 'content-type',
+])
+
+
+class _Stream(object):
+    __slots__ = ('status', 'data', 'exception', 'event')
+
+    def __init__(self):
+        self.status = None
+        self.data = bytearray()
+        self.exception = None
+        self.event = gevent.event.Event()
+
+    def fail(self, exception):
+        self.exception = exception
+        self.event.set()
+
+
+class _PendingResponse(object):
+    __slots__ = ('remaining', 'elements', 'exception', 'event')
+
+    def __init__(self, count):
+        self.remaining = count
+        self.elements = []
+        self.exception = None
+        self.event = gevent.event.Event()
+        if count == 0:
+            self.event.set()
+
+    def add(self, element):
+        self.elements.append(element)
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.event.set()
+
+    def fail(self, exception):
+        self.exception = exception
+        self.event.set()
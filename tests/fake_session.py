@@ -0,0 +1,109 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import simplejson as json
+import zlib
+
+
+class FakeResponse(object):
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self.content = body.encode('utf-8')
+        self.text = body
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+# Stands in for a requests.Session talking to a bayeux server.  Every message
+# is answered successfully, and every post is recorded so tests can look at
+# what went over the wire.
+class FakeSession(object):
+    def __init__(self, client_id='fake-client-id', connect_timeout=1000,
+                 connection_types=None, accepts_compression=True):
+        self.client_id = client_id
+        self.connect_timeout = connect_timeout
+        self.connection_types = connection_types
+        self.accepts_compression = accepts_compression
+        self.posts = []
+        self.content_encodings = []
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
+    def respond(self, message):
+        response = {
+            'channel': message['channel'],
+            'successful': True
+        }
+        if 'id' in message:
+            response['id'] = message['id']
+
+        if message['channel'] == '/meta/handshake':
+            response['clientId'] = self.client_id
+            if self.connection_types is not None:
+                response['supportedConnectionTypes'] = self.connection_types
+        elif message['channel'] == '/meta/connect':
+            response['advice'] = {
+                'reconnect': 'retry',
+                'interval': 0,
+                'timeout': self.connect_timeout
+            }
+        elif message['channel'] in ('/meta/subscribe', '/meta/unsubscribe'):
+            response['subscription'] = message['subscription']
+
+        return response
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        content_encoding = (headers or {}).get('Content-Encoding')
+        self.content_encodings.append(content_encoding)
+        if content_encoding is not None:
+            if not self.accepts_compression:
+                return FakeResponse('', status_code=415)
+            # Either gzip or zlib
+            data = zlib.decompress(data, 32 + zlib.MAX_WBITS)
+
+        payload = json.loads(data)
+        self.posts.append(payload)
+
+        if isinstance(payload, list):
+            body = [self.respond(message) for message in payload]
+        else:
+            body = [self.respond(payload)]
+
+        return FakeResponse(json.dumps(body))
@@ -0,0 +1,139 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+from socket import IPPROTO_TCP
+from socket import TCP_NODELAY
+
+import gevent
+import gevent.lock
+import simplejson as json
+from gevent.server import StreamServer
+
+import h2.config
+import h2.connection
+import h2.events
+
+from fake_session import FakeSession
+
+
+# Just enough of a bayeux server speaking HTTP/2 (with prior knowledge) to
+# test python_bayeux.transport.HTTP2Transport.  Requests are answered like
+# FakeSession answers them, except that connects are held for connect_hold
+# seconds, and requests for a channel in statuses get that HTTP status and
+# no bayeux response.  Every stream seen is recorded, with the connection it
+# came in on.
+class H2Server(object):
+    def __init__(self, connect_hold=0.5):
+        self.connect_hold = connect_hold
+        self.statuses = {}
+        self.bayeux = FakeSession()
+        self.server = StreamServer(('127.0.0.1', 0), self._handle)
+        self.connections = 0
+        self.streams = []
+
+    def start(self):
+        self.server.start()
+        self.url = 'http://127.0.0.1:{0}/cometd'.format(
+            self.server.server_port
+        )
+
+    def stop(self):
+        self.server.stop()
+
+    def _handle(self, socket, address):
+        socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.connections += 1
+        connection_number = self.connections
+
+        connection = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False)
+        )
+        lock = gevent.lock.Semaphore()
+        bodies = {}
+
+        def flush():
+            with lock:
+                data = connection.data_to_send()
+                if data:
+                    socket.sendall(data)
+
+        def respond(stream_id, body):
+            payload = json.loads(body)
+            messages = payload if isinstance(payload, list) else [payload]
+            if any(message['channel'] == '/meta/connect'
+                   for message in messages):
+                gevent.sleep(self.connect_hold)
+
+            status = self.statuses.get(messages[0]['channel'], 200)
+            if status == 200:
+                data = json.dumps(
+                    [self.bayeux.respond(message) for message in messages]
+                ).encode('utf-8')
+            else:
+                data = b'<html>error</html>'
+            with lock:
+                connection.send_headers(stream_id, [
+                    (':status', str(status)),
+                    ('content-type', 'application/json'),
+                    ('content-length', str(len(data))),
+                ])
+                connection.send_data(stream_id, data, end_stream=True)
+            flush()
+
+        connection.initiate_connection()
+        flush()
+        try:
+            while True:
+                data = socket.recv(65536)
+                if not data:
+                    break
+                with lock:
+                    events = connection.receive_data(data)
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        bodies[event.stream_id] = b''
+                    elif isinstance(event, h2.events.DataReceived):
+                        bodies[event.stream_id] += event.data
+                        with lock:
+                            connection.acknowledge_received_data(
+                                event.flow_controlled_length,
+                                event.stream_id
+                            )
+                    elif isinstance(event, h2.events.StreamEnded):
+                        body = bodies.pop(event.stream_id)
+                        self.streams.append(
+                            (connection_number, json.loads(body))
+                        )
+                        gevent.spawn(respond, event.stream_id, body)
+                flush()
+        except OSError:
+            pass
+        finally:
+            socket.close()
@@ -0,0 +1,149 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from pytest import importorskip
+from pytest import raises
+from python_bayeux import UnsuccessfulResponseException
+from python_bayeux.aio import AsyncBayeuxClient
+import asyncio
+import simplejson as json
+
+httpx = importorskip('httpx')
+
+
+# A bayeux server good enough for one client: pushes are handed to the
+# waiting /meta/connect as soon as something is published
+class FakeAsyncServer(object):
+    def __init__(self):
+        self.subscriptions = set()
+        self.pushes = asyncio.Queue()
+        self.connects = 0
+        self.requests = []
+
+    async def respond(self, message):
+        channel = message['channel']
+        response = {'channel': channel, 'successful': True,
+                    'id': message.get('id')}
+        if channel == '/meta/handshake':
+            response['clientId'] = 'fake-client-id'
+        elif channel == '/meta/connect':
+            self.connects += 1
+            response['advice'] = {'timeout': 100, 'reconnect': 'retry'}
+            if self.connects > 1:
+                try:
+                    push = await asyncio.wait_for(self.pushes.get(), 0.1)
+                except asyncio.TimeoutError:
+                    return [response]
+                return [response, push]
+        elif channel == '/meta/subscribe':
+            if message['subscription'] == '/forbidden':
+                response['successful'] = False
+                response['error'] = '403::forbidden'
+            self.subscriptions.add(message['subscription'])
+        elif channel == '/meta/unsubscribe':
+            self.subscriptions.discard(message['subscription'])
+        elif channel in self.subscriptions:
+            await self.pushes.put({'channel': channel,
+                                   'data': message['data']})
+        return [response]
+
+    async def handle(self, request):
+        message = json.loads(request.content)
+        self.requests.append(message)
+        return httpx.Response(200, json=await self.respond(message))
+
+
+def run(coroutine_function):
+    server = FakeAsyncServer()
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(
+        server.handle
+    ))
+
+    async def main():
+        try:
+            await coroutine_function(server, http_client)
+        finally:
+            await http_client.aclose()
+
+    asyncio.run(main())
+    return server
+
+
+def test_subscribe_publish_iterate():
+    async def scenario(server, http_client):
+        async with AsyncBayeuxClient('http://example.com/cometd',
+                                     http_client) as client:
+            response = await client.subscribe('/chat/demo')
+            assert response['successful']
+
+            published = await asyncio.gather(*[
+                client.publish('/chat/demo', {'chat': i}) for i in range(3)
+            ])
+            assert all(response['successful'] for response in published)
+
+            received = []
+            async for message in client:
+                received.append(message['data']['chat'])
+                if len(received) == 3:
+                    break
+            assert sorted(received) == [0, 1, 2]
+
+    server = run(scenario)
+    assert server.requests[-1]['channel'] == '/meta/disconnect'
+
+
+def test_run_dispatches_callbacks():
+    async def scenario(server, http_client):
+        received = []
+        client = AsyncBayeuxClient('http://example.com/cometd', http_client)
+        await client.start()
+
+        async def callback(message):
+            received.append(message['data'])
+            await client.shutdown()
+
+        await client.subscribe('/chat/demo', callback)
+        await client.publish('/chat/demo', 'hello')
+        await asyncio.wait_for(client.run(), 5)
+        assert received == ['hello']
+        assert client.disconnect_complete
+
+    run(scenario)
+
+
+def test_unsuccessful_subscribe_raises():
+    async def scenario(server, http_client):
+        async with AsyncBayeuxClient('http://example.com/cometd',
+                                     http_client) as client:
+            with raises(UnsuccessfulResponseException):
+                await client.subscribe('/forbidden')
+
+    run(scenario)
@@ -0,0 +1,207 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.tracing import StatsTracer
+from fake_session import FakeSession
+import gevent
+
+
+def run_batches(client):
+    batch_greenlet = gevent.spawn(client._batch_greenlet)
+    client.stop_greenlets = True
+    batch_greenlet.join(timeout=5)
+    assert batch_greenlet.successful()
+
+
+def test_batch_combines_queues():
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=10)
+    client.subscribe('/chat/demo')
+    client.unsubscribe('/chat/other')
+    for i in range(3):
+        client.publish('/chat/demo', {'chat': i})
+
+    run_batches(client)
+
+    # handshake, initial connect, then one batch
+    assert len(session.posts) == 3
+    batch = session.posts[2]
+    assert [message['channel'] for message in batch] == [
+        '/meta/subscribe',
+        '/meta/unsubscribe',
+        '/chat/demo',
+        '/chat/demo',
+        '/chat/demo'
+    ]
+    assert all(message['clientId'] == 'fake-client-id' for message in batch)
+    assert len(set(message['id'] for message in batch)) == len(batch)
+
+
+def test_batch_keeps_call_order():
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=10)
+    client.subscribe('/chat/demo')
+    run_batches(client)
+    client.stop_greenlets = False
+
+    client.publish('/chat/demo', {'chat': 'bye'})
+    client.unsubscribe('/chat/demo')
+    client.subscribe('/chat/demo')
+    run_batches(client)
+
+    assert [(message['channel'], message.get('subscription'))
+            for message in session.posts[-1]] == [
+        ('/chat/demo', None),
+        ('/meta/unsubscribe', '/chat/demo'),
+        ('/meta/subscribe', '/chat/demo')
+    ]
+    assert client.subscription_states == {'/chat/demo': 'subscribed'}
+
+
+def test_batch_respects_max_batch_size():
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=2)
+    for i in range(5):
+        client.publish('/chat/demo', {'chat': i})
+
+    run_batches(client)
+
+    assert [len(batch) for batch in session.posts[2:]] == [2, 2, 1]
+    assert [message['data']['chat'] for batch in session.posts[2:]
+            for message in batch] == [0, 1, 2, 3, 4]
+
+
+def test_batch_retries_unknown_client_subscription():
+    session = FakeSession()
+    real_respond = session.respond
+    failures = []
+
+    def respond(message):
+        response = real_respond(message)
+        if message['channel'] == '/meta/subscribe' and not failures:
+            failures.append(message)
+            response['successful'] = False
+            response['error'] = '403::Unknown client'
+        return response
+
+    session.respond = respond
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=10)
+    client.subscribe('/chat/demo')
+    client.publish('/chat/demo', {'chat': 'hi'})
+
+    run_batches(client)
+
+    assert len(failures) == 1
+    assert [message['channel'] for message in session.posts[3]] == [
+        '/meta/subscribe'
+    ]
+
+
+def test_resubscribe_sends_one_envelope():
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=1000)
+    channels = ['/topic/{0}'.format(n) for n in range(300)]
+    callbacks = {}
+    for channel in channels:
+        callbacks[channel] = lambda message: None
+        client.subscribe(channel, callbacks[channel])
+    client.subscribe('/topic/refused')
+    run_batches(client)
+    client.subscription_states['/topic/refused'] = 'failed'
+    dispatch_table = dict(client.dispatch_table)
+
+    # Dispatch waits until the server has confirmed every channel
+    real_post = session.post
+
+    def post(*args, **kwargs):
+        assert not client.subscriptions_ready.is_set()
+        return real_post(*args, **kwargs)
+
+    session.post = post
+    posts = len(session.posts)
+    client._resubscribe()
+
+    assert len(session.posts) == posts + 1
+    assert [message['subscription'] for message in session.posts[-1]] == \
+        channels
+    assert client.subscriptions_ready.is_set()
+    assert client.dispatch_table == dispatch_table
+    assert client.subscription_results['/topic/7'].get(timeout=1)[
+        'successful'
+    ]
+
+
+def test_large_batches_are_compressed_once():
+    session = FakeSession()
+    tracer = StatsTracer()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=10, compression='gzip',
+                          compression_threshold=1000, tracer=tracer)
+    for i in range(3):
+        client.publish('/chat/demo', {'chat': 'x' * 500})
+
+    run_batches(client)
+
+    # The handshake and connect were too small to bother
+    assert session.content_encodings == [None, None, 'gzip']
+    assert len(session.posts[2]) == 3
+    assert tracer.stats['compress:gzip'].count == 1
+    assert tracer.compressed_bytes['gzip'] < \
+        tracer.uncompressed_bytes['gzip'] / 10
+
+
+def test_compression_stops_when_the_server_refuses_it():
+    session = FakeSession(accepts_compression=False)
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          compression='deflate', compression_threshold=0)
+    for i in range(2):
+        client.publish('/chat/demo', {'chat': i})
+        publish_greenlet = gevent.spawn(client._publish_greenlet)
+        client.stop_greenlets = True
+        publish_greenlet.join(timeout=5)
+        client.stop_greenlets = False
+
+    # The handshake was refused and sent again uncompressed, and nothing
+    # after it was compressed
+    assert session.content_encodings == ['deflate', None, None, None, None]
+    assert [post['channel'] for post in session.posts] == [
+        '/meta/handshake', '/meta/connect', '/chat/demo', '/chat/demo'
+    ]
+    assert client.uncompressed_endpoints == {'http://example.com/cometd'}
@@ -0,0 +1,109 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from pytest import raises
+from python_bayeux import BayeuxClient
+from python_bayeux.channels import ChannelTrie
+from fake_session import FakeSession
+import time
+import gevent
+
+
+def test_wildcard_matching():
+    trie = ChannelTrie()
+    for pattern in ('/**', '/chat/*', '/chat/**', '/chat/demo',
+                    '/chat/demo/*'):
+        trie.add(pattern)
+
+    assert trie.match('/chat/demo') == ('/**', '/chat/**', '/chat/*',
+                                        '/chat/demo')
+    assert trie.match('/chat/demo/room') == ('/**', '/chat/**',
+                                             '/chat/demo/*')
+    assert trie.match('/chat/demo/room/table') == ('/**', '/chat/**')
+    assert trie.match('/chat') == ('/**',)
+    assert trie.match('/other') == ('/**',)
+
+    trie.remove('/**')
+    trie.remove('/chat/demo')
+    assert trie.match('/chat/demo') == ('/chat/**', '/chat/*')
+    assert trie.match('/other') == ()
+
+    for pattern in ('/chat/*', '/chat/**', '/chat/demo/*'):
+        trie.remove(pattern)
+    assert len(trie) == 0
+    assert trie.root.empty()
+
+
+def test_match_is_cached_until_patterns_change():
+    trie = ChannelTrie()
+    trie.add('/topic/*')
+    assert trie.match('/topic/a') is trie.match('/topic/a')
+
+    trie.add('/topic/a')
+    assert trie.match('/topic/a') == ('/topic/*', '/topic/a')
+
+
+def test_wildcards_only_at_the_end():
+    with raises(ValueError):
+        ChannelTrie().add('/chat/*/demo')
+
+
+class WildcardClient(BayeuxClient):
+    def any_topic(self, message):
+        self.handled.append(('any_topic', message['channel']))
+
+    def everything(self, message):
+        self.handled.append(('everything', message['channel']))
+
+
+def test_client_dispatches_wildcard_subscriptions():
+    client = WildcardClient('http://example.com/cometd', FakeSession(),
+                            start=False)
+    client.handled = []
+    client.subscribe('/topic/*', 'any_topic')
+    client.subscribe('/**', 'everything')
+
+    client.message_queue.put((time.monotonic(), [
+        {'channel': '/topic/Leads', 'data': {}},
+        {'channel': '/chat/demo/room', 'data': {}},
+    ]))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.get()
+
+    assert client.handled == [
+        ('everything', '/topic/Leads'),
+        ('any_topic', '/topic/Leads'),
+        ('everything', '/chat/demo/room'),
+    ]
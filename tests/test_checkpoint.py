@@ -0,0 +1,128 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from pytest import mark
+from python_bayeux import BayeuxClient
+from python_bayeux.checkpoint import FileCheckpointStore
+from python_bayeux.checkpoint import MemoryCheckpointStore
+from python_bayeux.checkpoint import ReplayCheckpointer
+from python_bayeux.checkpoint import SQLiteCheckpointStore
+from fake_session import FakeSession
+import os
+import time
+import gevent
+
+
+def event(channel, replay_id):
+    return {'channel': channel,
+            'data': {'event': {'replayId': replay_id}, 'payload': {}}}
+
+
+@mark.parametrize('make_store', [
+    lambda tmpdir: FileCheckpointStore(os.path.join(tmpdir, 'replay.json')),
+    lambda tmpdir: SQLiteCheckpointStore(os.path.join(tmpdir, 'replay.db')),
+])
+def test_stores_survive_reopening(tmpdir, make_store):
+    checkpointer = ReplayCheckpointer(make_store(str(tmpdir)))
+    checkpointer.update('/topic/a', 5)
+    checkpointer.update('/topic/b', 7)
+    checkpointer.update('/topic/a', 6)
+    checkpointer.close()
+
+    checkpointer = ReplayCheckpointer(make_store(str(tmpdir)))
+    assert checkpointer.get('/topic/a') == 6
+    assert checkpointer.get('/topic/b') == 7
+    assert checkpointer.get('/topic/c') is None
+    checkpointer.close()
+
+
+def test_writes_are_batched():
+    store = MemoryCheckpointStore()
+    checkpointer = ReplayCheckpointer(store, flush_every=3,
+                                      flush_interval=60)
+    checkpointer.update('/topic/a', 1)
+    checkpointer.update('/topic/a', 2)
+    assert store.checkpoints == {}
+
+    checkpointer.update('/topic/b', 1)
+    assert store.checkpoints == {'/topic/a': 2, '/topic/b': 1}
+    checkpointer.close()
+
+
+def test_quiet_checkpoints_are_saved_on_time():
+    store = MemoryCheckpointStore()
+    checkpointer = ReplayCheckpointer(store, flush_every=100,
+                                      flush_interval=0.05)
+    checkpointer.update('/topic/a', 1)
+    checkpointer.update('/topic/a', 2)
+    assert store.checkpoints == {}
+
+    # Nothing else is handled, but the checkpoint is still saved
+    gevent.sleep(0.1)
+    assert store.checkpoints == {'/topic/a': 2}
+    assert checkpointer.flush_timer is None
+    checkpointer.close()
+
+
+def test_client_resumes_from_checkpoints():
+    store = MemoryCheckpointStore()
+    store.save({'/topic/a': 10})
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          checkpoint_store=store, default_replay_id=-1)
+    client.subscribe('/topic/a', lambda message: None)
+    client.subscribe('/topic/b', lambda message: None)
+
+    subscribe_greenlet = gevent.spawn(client._subscribe_greenlet)
+    client.subscription_results['/topic/b'].get(timeout=5)
+    assert session.posts[0]['ext'] == {'replay': True}
+    assert session.posts[2]['ext'] == {'replay': {'/topic/a': 10}}
+    assert session.posts[3]['ext'] == {'replay': {'/topic/b': -1}}
+
+    client.message_queue.put((time.monotonic(), [
+        event('/topic/a', 11),
+        event('/topic/a', 12),
+    ]))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    gevent.joinall([execute_greenlet, subscribe_greenlet])
+    assert client.checkpointer.get('/topic/a') == 12
+
+    # After a re-handshake, we pick up where we left off
+    client._resubscribe()
+    resubscribe_payload = session.posts[-1]
+    assert resubscribe_payload[0]['ext'] == {'replay': {'/topic/a': 12}}
+
+    client.checkpointer.close()
+    assert store.checkpoints['/topic/a'] == 12
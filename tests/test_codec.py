@@ -0,0 +1,94 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from decimal import Decimal
+from pytest import importorskip
+from pytest import mark
+from python_bayeux import BayeuxClient
+from python_bayeux.codec import OrjsonCodec
+from python_bayeux.codec import SimplejsonCodec
+from fake_session import FakeResponse
+from fake_session import FakeSession
+
+
+def make_orjson_codec():
+    importorskip('orjson')
+    return OrjsonCodec()
+
+
+@mark.parametrize('make_codec', [SimplejsonCodec, make_orjson_codec])
+def test_codec_round_trip(make_codec):
+    codec = make_codec()
+    payload = [{'channel': '/chat/demo', 'data': {'chat': u'héllo'}}]
+    encoded = codec.dumps(payload)
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == payload
+
+
+@mark.parametrize('make_codec', [SimplejsonCodec, make_orjson_codec])
+def test_codecs_encode_the_same_payloads(make_codec):
+    codec = make_codec()
+    assert codec.loads(codec.dumps({'amount': Decimal('1.50')})) == \
+        {'amount': 1.5}
+    assert codec.loads(codec.dumps({1: 'a'})) == {'1': 'a'}
+
+
+class CountingResponse(FakeResponse):
+    @property
+    def text(self):
+        raise AssertionError('response.text should not be needed')
+
+    @text.setter
+    def text(self, value):
+        pass
+
+    def json(self):
+        raise AssertionError('response.json() should not be needed')
+
+
+class BytesOnlySession(FakeSession):
+    def post(self, url, data=None, **kwargs):
+        assert isinstance(data, bytes)
+        response = super(BytesOnlySession, self).post(url, data, **kwargs)
+        return CountingResponse(response.content.decode('utf-8'))
+
+
+@mark.parametrize('make_codec', [SimplejsonCodec, make_orjson_codec])
+def test_client_decodes_from_bytes(make_codec):
+    client = BayeuxClient('http://example.com/cometd', BytesOnlySession(),
+                          start=False, codec=make_codec())
+    assert client.client_id == 'fake-client-id'
+    response = client._send_message({'channel': '/chat/demo', 'id': None,
+                                     'data': 'hi'})
+    assert response[0]['successful']
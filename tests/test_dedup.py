@@ -0,0 +1,225 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.dedup import DedupCache
+from python_bayeux.hub import BayeuxHub
+from python_bayeux.spool import SegmentSpool
+from fake_session import FakeSession
+import gevent
+import pytest
+import time
+
+
+def event(channel, replay_id, message_id=None):
+    message = {'channel': channel,
+               'data': {'event': {'replayId': replay_id}}}
+    if message_id is not None:
+        message['id'] = message_id
+    return message
+
+
+def handle(cache, message):
+    for kept in cache.filter([message]):
+        cache.remember(kept)
+
+
+def test_duplicates_are_dropped_by_replay_id():
+    cache = DedupCache()
+    messages = [
+        event('/topic/a', 1, 'x'),
+        event('/topic/a', 1, 'y'),
+        event('/topic/b', 1),
+        {'channel': '/chat/demo', 'data': 'no key'},
+        {'channel': '/chat/demo', 'data': 'no key'},
+    ]
+    assert cache.filter(messages) == [messages[0], messages[2], messages[3],
+                                      messages[4]]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    by_data = DedupCache(key=lambda message: message['data'])
+    assert by_data.filter(messages[3:]) == [messages[3]]
+
+    with pytest.raises(ValueError):
+        DedupCache(key='sequence')
+
+
+def test_colliding_publisher_ids_are_not_duplicates():
+    # Two publishers, each counting its message ids from 1
+    messages = [
+        {'channel': '/chat/demo', 'id': '1', 'data': {'user': 'a'}},
+        {'channel': '/chat/demo', 'id': '1', 'data': {'user': 'b'}},
+    ]
+    cache = DedupCache()
+    for message in messages:
+        handle(cache, message)
+    assert cache.filter(messages) == messages
+    assert cache.hits == 0
+
+    # Which is why keying by message id has to be asked for
+    by_id = DedupCache(key='id')
+    assert by_id.filter(messages) == messages[:1]
+
+
+def test_only_handled_messages_are_remembered():
+    cache = DedupCache()
+    message = event('/topic/a', 1)
+    assert cache.filter([message]) == [message]
+    assert len(cache) == 0
+
+    # A copy that arrives while the first is being handled is dropped
+    assert cache.filter([message]) == []
+    assert cache.in_flight == {('/topic/a', 1)}
+
+    cache.remember(message)
+    assert cache.in_flight == set()
+    assert len(cache) == 1
+    assert cache.seen(message)
+
+
+def test_capacity_and_ttl():
+    cache = DedupCache(max_entries=2)
+    for replay_id in (1, 2, 1, 3):
+        handle(cache, event('/topic/a', replay_id))
+    # 1 was seen again, so 2 was the least recently seen
+    assert not cache.seen(event('/topic/a', 2))
+    assert cache.seen(event('/topic/a', 1))
+    assert cache.seen(event('/topic/a', 3))
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+    small = DedupCache(max_entries=None, max_bytes=1000)
+    for replay_id in range(100):
+        handle(small, event('/topic/a', replay_id))
+    assert 0 < small.size <= 1000
+    assert len(small) < 100
+
+    expiring = DedupCache(ttl=0.05)
+    handle(expiring, event('/topic/a', 1))
+    assert expiring.seen(event('/topic/a', 1))
+    time.sleep(0.1)
+    assert not expiring.seen(event('/topic/a', 1))
+
+
+def test_snapshot_survives_a_restart(tmpdir):
+    path = str(tmpdir.join('dedup.json'))
+    cache = DedupCache(snapshot_path=path, ttl=60)
+    handle(cache, event('/topic/a', 1))
+    # Not handled yet, so not saved
+    cache.filter([event('/topic/a', 2)])
+    cache.close()
+
+    restarted = DedupCache(snapshot_path=path)
+    assert restarted.seen(event('/topic/a', 1))
+    assert not restarted.seen(event('/topic/a', 2))
+
+
+def test_client_drops_redelivered_events():
+    handled = []
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False, dedup=DedupCache())
+    client.subscribe('/topic/a', lambda message: handled.append(
+        message['data']['event']['replayId']
+    ))
+    client.message_queue.put((time.monotonic(), [
+        event('/topic/a', 1), event('/topic/a', 2)
+    ]))
+    # Replayed after a re-handshake
+    client.message_queue.put((time.monotonic(), [
+        event('/topic/a', 2), event('/topic/a', 3)
+    ]))
+
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.get()
+
+    assert handled == [1, 2, 3]
+    assert client.dedup.hits == 1
+
+
+def test_failed_callback_is_handled_again_after_a_restart(tmpdir):
+    spool_path = str(tmpdir.join('spool'))
+    snapshot_path = str(tmpdir.join('dedup.json'))
+    message = event('/chat/demo', 1)
+
+    def fail(message):
+        raise ValueError('boom')
+
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False, spool=SegmentSpool(spool_path),
+                          dedup=DedupCache(snapshot_path=snapshot_path))
+    client.subscribe('/chat/demo', fail)
+    client.message_queue.put((time.monotonic(), [message]))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    execute_greenlet.join()
+    assert isinstance(execute_greenlet.exception, ValueError)
+    client.spool.close()
+    client.dedup.close()
+
+    # After a restart, the spool replays the message, and it isn't dropped
+    handled = []
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False, spool=SegmentSpool(spool_path),
+                          dedup=DedupCache(snapshot_path=snapshot_path))
+    client.subscribe('/chat/demo', handled.append)
+    assert client.spool.pending()
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.get()
+    client.spool.close()
+    client.dedup.close()
+
+    assert handled == [message]
+    assert client.dedup.hits == 0
+    assert client.dedup.seen(message)
+
+
+def test_hub_remembers_only_handled_messages():
+    message = event('/chat/demo', 1)
+
+    def fail(message):
+        raise ValueError('boom')
+
+    hub = BayeuxHub(dispatch_concurrency=1)
+    dedup = DedupCache()
+    client = hub.client('a', 'https://example.com/cometd', FakeSession(),
+                        dedup=dedup)
+    client.subscribe('/chat/demo', fail)
+    hub.dispatcher.start()
+    hub._put(client, (time.monotonic(), [message]))
+    client.shutdown_event.wait(timeout=5)
+
+    # The failed message can be handled when it is redelivered
+    assert not dedup.seen(message)
+    hub.shutdown()
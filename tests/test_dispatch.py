@@ -0,0 +1,119 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.dispatch import KeyedDispatcher
+from fake_session import FakeSession
+import time
+import gevent
+
+
+class RecordingClient(BayeuxClient):
+    def record(self, message):
+        if message['data'].get('slow'):
+            gevent.sleep(0.2)
+        self.handled.append((message['channel'], message['data']['n']))
+
+
+def test_keys_run_concurrently_and_in_order():
+    # str hashes vary between runs, so pin the channels to different workers
+    client = RecordingClient('http://example.com/cometd', FakeSession(),
+                             start=False, dispatch_concurrency=4,
+                             dispatch_key=lambda message:
+                             message['channel'] == '/slow')
+    client.handled = []
+    client.subscribe('/slow', 'record')
+    client.subscribe('/fast', 'record')
+    client.dispatcher.start()
+
+    client.message_queue.put((time.monotonic(), [
+        {'channel': '/slow', 'data': {'n': 0, 'slow': True}},
+        {'channel': '/slow', 'data': {'n': 1}},
+    ] + [
+        {'channel': '/fast', 'data': {'n': n}} for n in range(5)
+    ]))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.join()
+    client.dispatcher.shutdown()
+
+    # The slow handler didn't hold up the other channel...
+    assert client.handled[:5] == [('/fast', n) for n in range(5)]
+    # ...and each channel was handled in order
+    assert client.handled[5:] == [('/slow', 0), ('/slow', 1)]
+
+
+def test_custom_key_and_shutdown_from_handler():
+    handled = []
+
+    def handler(message):
+        handled.append(message['n'])
+        if message['n'] == 0:
+            dispatcher.shutdown()
+
+    dispatcher = KeyedDispatcher(handler, 3, key=lambda message: 'same')
+    dispatcher.start()
+    for n in range(10):
+        dispatcher.dispatch({'channel': '/any', 'n': n})
+
+    gevent.joinall(dispatcher.workers, timeout=5)
+    assert handled == list(range(10))
+    assert all(worker.dead for worker in dispatcher.workers)
+
+
+def test_dispatch_table_with_plain_functions():
+    handled = []
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False)
+    client.subscribe('/chat/demo', handled.append)
+    client.subscribe('/chat/other', lambda message: handled.append('other'))
+    assert client.dispatch_table['/chat/demo'] == \
+        ((handled.append, handled.append),)
+
+    client.unsubscribe('/chat/other')
+    assert '/chat/other' not in client.dispatch_table
+
+    client._resubscribe()
+    assert list(client.dispatch_table) == ['/chat/demo']
+
+    message = {'channel': '/chat/demo', 'data': 1}
+    client.message_queue.put((time.monotonic(), [
+        message,
+        {'channel': '/chat/other', 'data': 2}
+    ]))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.get()
+
+    assert handled == [message]
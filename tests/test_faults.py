@@ -0,0 +1,105 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.faults import FaultInjectingServer
+from python_bayeux.faults import measure_recovery
+import pytest
+import requests
+
+
+def client_factory(url):
+    return BayeuxClient(url, reconnect_backoff=0.05, max_network_delay=0.2)
+
+
+def test_recovery_is_measured():
+    baseline, unknown_client, server_error, slow = measure_recovery(
+        [
+            [{'kind': 'unknown_client'}],
+            [{'kind': 'server_error', 'count': 3}],
+            [{'kind': 'slow', 'delay': 0.8}],
+        ],
+        server_kwargs={'timeout': 500},
+        client_factory=client_factory,
+        messages=20,
+        interval=0.02,
+        settle=1.0
+    )
+
+    assert baseline['time_to_recover'] is None
+    assert baseline['lost'] == 0
+    assert baseline['extra_requests'] == 0
+
+    # The server forgot us, so we handshake and subscribe again, and miss
+    # what was published meanwhile
+    assert unknown_client['time_to_recover'] > 0
+    assert unknown_client['requests']['/meta/handshake'] == 1
+    assert unknown_client['requests']['/meta/subscribe'] == 1
+    assert unknown_client['extra_requests'] >= 2
+
+    # The server kept our messages while we backed off
+    assert server_error['faults'][0]['injected'] == 3
+    assert server_error['time_to_recover'] > 0
+    assert server_error['lost'] == 0
+
+    # The connect timed out, and we connected again
+    assert slow['time_to_recover'] > 0.7
+    assert slow['lost'] == 0
+
+    for result in (baseline, unknown_client, server_error, slow):
+        assert result['duplicated'] == 0
+        assert result['exception'] is None
+
+
+def test_faults_apply_to_their_channel():
+    with FaultInjectingServer() as server:
+        fault = server.inject('empty', channel='/meta/handshake', count=2)
+        for i in range(3):
+            response = requests.post(server.url, json={
+                'channel': '/meta/handshake',
+                'version': '1.0',
+                'supportedConnectionTypes': ['long-polling']
+            })
+        assert fault.done
+        assert response.json()[0]['successful']
+
+        server.inject('server_error', channel='/meta/subscribe')
+        assert requests.post(server.url, json={
+            'channel': '/meta/subscribe',
+            'clientId': 'stub-1',
+            'subscription': '/chat/demo'
+        }).status_code == 503
+
+    with pytest.raises(ValueError):
+        server.inject('gremlins')
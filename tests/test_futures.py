@@ -0,0 +1,166 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from pytest import raises
+from python_bayeux import BayeuxClient
+from python_bayeux import ClientShutdownException
+from python_bayeux import MissingResponseException
+from python_bayeux import RequestTimeoutException
+from python_bayeux import UnsuccessfulResponseException
+from fake_session import FakeSession
+import gevent
+
+
+def test_publish_result_resolved_by_id():
+    session = FakeSession()
+    client = BayeuxClient('http://example.com/cometd', session, start=False)
+    first = client.publish('/chat/demo', {'chat': 'one'})
+    second = client.publish('/chat/demo', {'chat': 'two'})
+    publish_greenlet = gevent.spawn(client._publish_greenlet)
+
+    assert second.get(timeout=5)['id'] == session.posts[-1]['id']
+    assert first.get(timeout=5)['id'] == session.posts[-2]['id']
+    assert client.pending_requests == {}
+
+    client.stop_greenlets = True
+    publish_greenlet.join()
+
+
+def test_batched_results_are_split_per_message():
+    session = FakeSession()
+    real_respond = session.respond
+
+    def respond(message):
+        response = real_respond(message)
+        if message['channel'] == '/meta/unsubscribe':
+            response['successful'] = False
+            response['error'] = '400::not subscribed'
+        return response
+
+    session.respond = respond
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          max_batch_size=10)
+    subscribed = client.subscribe('/chat/demo')
+    assert client.subscribe('/chat/demo', print) is subscribed
+    unsubscribed = client.unsubscribe('/chat/other')
+    published = client.publish('/chat/demo', {'chat': 'hi'})
+    batch_greenlet = gevent.spawn(client._batch_greenlet)
+
+    assert subscribed.get(timeout=5)['subscription'] == '/chat/demo'
+    assert published.get(timeout=5)['channel'] == '/chat/demo'
+    with raises(UnsuccessfulResponseException) as exc_info:
+        unsubscribed.get(timeout=5)
+    assert exc_info.value.response['error'] == '400::not subscribed'
+
+    client.stop_greenlets = True
+    batch_greenlet.join()
+
+
+def test_request_timeout():
+    session = FakeSession()
+    real_post = session.post
+
+    def post(url, data=None, **kwargs):
+        if b'/chat/demo' in data:
+            gevent.sleep(10)
+        return real_post(url, data=data, **kwargs)
+
+    session.post = post
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          request_timeout=0.1)
+    published = client.publish('/chat/demo', {'chat': 'hi'})
+    greenlets = [gevent.spawn(client._publish_greenlet),
+                 gevent.spawn(client._request_timeout_greenlet)]
+
+    with raises(RequestTimeoutException):
+        published.get(timeout=5)
+    assert client.pending_requests == {}
+
+    gevent.killall(greenlets)
+
+
+def test_requests_survive_a_handshake():
+    session = FakeSession()
+    real_post = session.post
+
+    def post(url, data=None, **kwargs):
+        if b'"late"' in data:
+            gevent.sleep(0.3)
+        return real_post(url, data=data, **kwargs)
+
+    session.post = post
+    client = BayeuxClient('http://example.com/cometd', session, start=False,
+                          request_timeout=1.0)
+    greenlets = [gevent.spawn(client._subscribe_greenlet),
+                 gevent.spawn(client._publish_greenlet),
+                 gevent.spawn(client._request_timeout_greenlet)]
+    client.subscribe('/chat/demo').get(timeout=5)
+
+    # The publish is still in flight when we handshake and resubscribe, and
+    # the resubscribe doesn't reuse its id
+    published = client.publish('/chat/demo', {'chat': 'late'})
+    gevent.sleep(0.05)
+    client.handshake()
+    client._resubscribe()
+
+    assert published.get(timeout=5)['successful']
+    ids = [post['id'] for post in session.posts if 'id' in post]
+    assert len(ids) == len(set(ids))
+    assert client.pending_requests == {}
+
+    gevent.killall(greenlets)
+
+
+def test_results_fail_instead_of_hanging():
+    session = FakeSession()
+    real_respond = session.respond
+
+    def respond(message):
+        if message['channel'] == '/chat/silent':
+            return {'channel': '/meta/unknown'}
+        return real_respond(message)
+
+    session.respond = respond
+    client = BayeuxClient('http://example.com/cometd', session, start=False)
+    silent = client.publish('/chat/silent', {'chat': 'hi'})
+    publish_greenlet = gevent.spawn(client._publish_greenlet)
+    with raises(MissingResponseException):
+        silent.get(timeout=5)
+    gevent.kill(publish_greenlet)
+
+    # Never sent
+    queued = client.publish('/chat/demo', {'chat': 'hi'})
+    client.shutdown()
+    with raises(ClientShutdownException):
+        queued.get(timeout=5)
@@ -0,0 +1,163 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+pytest.importorskip('h2')
+
+from python_bayeux import BayeuxClient
+from python_bayeux import ServerErrorException
+from python_bayeux.transport import HTTP2Transport
+from python_bayeux.transport import TransportClosedException
+from fake_session import FakeSession
+from h2_server import H2Server
+import gevent
+import requests
+import time
+
+
+@pytest.fixture
+def server():
+    server = H2Server(connect_hold=0.5)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_connect_and_publishes_share_one_connection(server):
+    session = FakeSession(connection_types=['long-polling'])
+    transport = HTTP2Transport(prior_knowledge=True)
+    client = BayeuxClient(server.url, session, start=False,
+                          transports=[transport])
+    assert client.transport is transport
+    assert [post['channel'] for post in session.posts] == ['/meta/handshake']
+
+    # While a connect is held, publishes still come straight back
+    started = time.monotonic()
+    connect = gevent.spawn(client.connect)
+    gevent.sleep(0.05)
+    publishes = [
+        gevent.spawn(client._send_message,
+                     client._publish_payload({'channel': '/chat/demo',
+                                              'payload': {'n': n}}))
+        for n in range(5)
+    ]
+    gevent.joinall(publishes, raise_error=True)
+    assert time.monotonic() - started < 0.4
+    assert all(publish.value[0]['successful'] for publish in publishes)
+    assert not connect.ready()
+
+    assert connect.get(timeout=5)[0]['channel'] == '/meta/connect'
+
+    # Bodies bigger than the flow control window go out as the server opens
+    # it
+    big = client._send_message(client._publish_payload({
+        'channel': '/chat/demo',
+        'payload': {'text': 'x' * 200000}
+    }))
+    assert big[0]['successful']
+    assert server.streams[-1][1]['data']['text'] == 'x' * 200000
+
+    # The initial connect, the held connect and the publishes were all
+    # streams on the same connection
+    assert server.connections == 1
+    assert len(server.streams) == 8
+
+    transport.close()
+
+
+def test_publish_is_retried_after_the_transport_closes(server):
+    session = FakeSession(connection_types=['long-polling'])
+    client = BayeuxClient(server.url, session, start=False,
+                          transports=[HTTP2Transport(prior_knowledge=True)])
+    for greenlet in client.inbound_greenlets:
+        greenlet.start()
+    publish_greenlet = gevent.spawn(client._publish_greenlet,
+                                    timeout_wait=0.1)
+
+    # A 401 closes the connection, and the publish goes again over plain
+    # long-polling once we have handshaken without it
+    server.statuses['/chat/demo'] = 401
+    published = client.publish('/chat/demo', {'n': 1})
+    assert published.get(timeout=5)['successful']
+    assert client.transport is None
+    assert not publish_greenlet.dead
+    assert [post['data'] for post in session.posts
+            if post['channel'] == '/chat/demo'] == [{'n': 1}]
+
+    gevent.kill(publish_greenlet)
+    client.shutdown()
+
+
+def test_unreachable_server_falls_back_to_long_polling(server):
+    server.stop()
+    session = FakeSession(connection_types=['long-polling'])
+    transport = HTTP2Transport(prior_knowledge=True, open_timeout=1)
+    client = BayeuxClient(server.url, session, start=False,
+                          transports=[transport])
+
+    assert client.transport is None
+    assert client.failed_transports == {transport}
+    # The initial connect was sent again, over the session
+    assert [post['channel'] for post in session.posts] == \
+        ['/meta/handshake', '/meta/connect']
+
+
+def test_error_statuses(server):
+    session = FakeSession(connection_types=['long-polling'])
+    transport = HTTP2Transport(prior_knowledge=True)
+    client = BayeuxClient(server.url, session, start=False,
+                          transports=[transport])
+
+    # We read responses as they come, so we don't ask for them compressed
+    headers = dict(transport._session_headers(requests.Session()))
+    assert 'accept-encoding' not in headers
+
+    # A connect that gets a 5xx is retried with backoff, on the same
+    # transport
+    server.statuses['/meta/connect'] = 503
+    with pytest.raises(ServerErrorException) as exc_info:
+        client.connect()
+    assert exc_info.value.status_code == 503
+    assert not transport.closed
+
+    # Anything else closes the transport
+    server.statuses['/chat/demo'] = 401
+    with pytest.raises(TransportClosedException):
+        client._send_message(client._publish_payload({
+            'channel': '/chat/demo',
+            'payload': {'n': 0}
+        }))
+    assert transport.closed
+
+    transport.close()
@@ -0,0 +1,185 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux.hub import BayeuxHub
+from fake_session import FakeSession
+import gevent
+import gevent.queue
+import simplejson as json
+
+
+# Holds each /meta/connect until a push is available, like a real long poll
+class LongPollSession(FakeSession):
+    def __init__(self, *args, **kwargs):
+        super(LongPollSession, self).__init__(*args, **kwargs)
+        self.pushes = gevent.queue.Queue()
+
+    def respond(self, message):
+        response = super(LongPollSession, self).respond(message)
+        if message['channel'] == '/meta/connect':
+            try:
+                return [response, self.pushes.get(timeout=0.05)]
+            except gevent.queue.Empty:
+                pass
+        return response
+
+    def post(self, url, data=None, **kwargs):
+        response = super(LongPollSession, self).post(url, data, **kwargs)
+        body = json.loads(response.content)
+        if isinstance(body[0], list):
+            body = body[0]
+        response.content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def test_clients_are_lazy_until_they_have_work():
+    hub = BayeuxHub()
+    sessions = [FakeSession('client-{0}'.format(n)) for n in range(50)]
+    clients = [
+        hub.client(n, 'https://example.com/cometd', session)
+        for n, session in enumerate(sessions)
+    ]
+
+    # No round trips and no greenlets yet, and one shared pool per host
+    assert all(session.posts == [] for session in sessions)
+    assert all(client.greenlets == [] for client in clients)
+    assert len(hub.adapters) == 1
+    adapter = hub.adapters['https://example.com/']
+    assert all(session.adapters['https://example.com/'] is adapter
+               for session in sessions)
+
+    hub.start()
+    result = clients[3].publish('/chat/demo', {'text': 'hi'})
+    assert result.get(timeout=5)['successful']
+
+    # Only the client with work handshook, and it has no connect greenlet
+    # because it hasn't subscribed
+    assert [len(session.posts) for session in sessions[2:5]] == [0, 3, 0]
+    assert clients[3].client_id == 'client-3'
+    assert clients[3].greenlets == []
+    assert hub.tenant_stats(3)['requests'] == 1
+
+    hub.shutdown()
+    assert hub.clients == {}
+
+
+def test_pushes_are_dispatched_per_tenant():
+    handled = []
+
+    def handler(message):
+        handled.append((message['data']['tenant'], message['data']['n']))
+        if message['data']['n'] == 'boom':
+            raise ValueError('boom')
+
+    hub = BayeuxHub(max_batch_size=10, dispatch_concurrency=4)
+    sessions = {}
+    for tenant in ('a', 'b'):
+        sessions[tenant] = LongPollSession(tenant)
+        client = hub.client(tenant, 'https://example.com/cometd',
+                            sessions[tenant])
+        client.subscribe('/topic/x', handler)
+        client.subscribe('/topic/y', handler)
+
+    b_stats = hub.stats['b']
+    with hub:
+        # Both subscribes went in one request
+        gevent.sleep(0.1)
+        subscribes = [post for post in sessions['a'].posts
+                      if isinstance(post, list)]
+        assert [len(post) for post in subscribes] == [2]
+
+        for n in range(3):
+            for tenant in ('a', 'b'):
+                sessions[tenant].pushes.put({
+                    'channel': '/topic/x',
+                    'data': {'tenant': tenant, 'n': n}
+                })
+        sessions['b'].pushes.put({
+            'channel': '/topic/x',
+            'data': {'tenant': 'b', 'n': 'boom'}
+        })
+
+        for i in range(100):
+            if len(handled) == 7 and 'b' not in hub.clients:
+                break
+            gevent.sleep(0.05)
+
+        assert [n for tenant, n in handled if tenant == 'a'] == [0, 1, 2]
+        assert [n for tenant, n in handled if tenant == 'b'] == \
+            [0, 1, 2, 'boom']
+
+        # The failing callback only took down its own client
+        assert 'b' not in hub.clients
+        assert hub.clients['a'].exception is None
+        stats = hub.tenant_stats('a')
+        assert stats['messages_received'] == 3
+        assert stats['messages_handled'] == 3
+        assert stats['errors'] == 0
+        assert stats['connected']
+        assert b_stats.errors == 1
+        assert 'b' not in hub.stats
+
+
+def test_resubscribing_tenant_does_not_hold_up_others():
+    handled = []
+
+    def handler(message):
+        handled.append((message['data']['tenant'], message['data']['n']))
+
+    # One worker, so both tenants share it
+    hub = BayeuxHub(dispatch_concurrency=1)
+    clients = {}
+    for tenant in ('a', 'b'):
+        clients[tenant] = hub.client(tenant, 'https://example.com/cometd',
+                                     FakeSession(tenant))
+        clients[tenant].subscribe('/topic/x', handler)
+    hub.dispatcher.start()
+
+    clients['a'].subscriptions_ready.clear()
+    for n in range(2):
+        for tenant in ('a', 'b'):
+            hub._put(clients[tenant], (0, [{
+                'channel': '/topic/x',
+                'data': {'tenant': tenant, 'n': n}
+            }]))
+    gevent.sleep(0.05)
+    assert handled == [('b', 0), ('b', 1)]
+
+    clients['a'].subscriptions_ready.set()
+    hub.releasers.join(timeout=5)
+    assert handled[2:] == [('a', 0), ('a', 1)]
+    assert hub.held == {}
+
+    hub.shutdown()
+    assert hub.stats == {}
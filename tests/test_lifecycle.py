@@ -0,0 +1,105 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.stubserver import StubServer
+from fake_session import FakeSession
+import gevent
+import simplejson as json
+import time
+
+
+# Holds each connect for a moment, as a server does when it has nothing to
+# push, and pushes one message on the second
+class HoldingSession(FakeSession):
+    def __init__(self, hold=0.05):
+        super(HoldingSession, self).__init__()
+        self.hold = hold
+        self.connects = 0
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        response = super(HoldingSession, self).post(url, data, headers,
+                                                    **kwargs)
+        if json.loads(data)['channel'] == '/meta/connect':
+            self.connects += 1
+            if self.connects > 1:
+                gevent.sleep(self.hold)
+            if self.connects == 2:
+                body = json.loads(response.content)
+                body.append({'channel': '/chat/demo', 'data': {'n': 1}})
+                response.content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def test_idle_client_shuts_down_promptly():
+    client = BayeuxClient('http://example.com/cometd', HoldingSession())
+    gevent.sleep(0.2)
+
+    started = time.monotonic()
+    client.shutdown()
+    assert time.monotonic() - started < 0.5
+    assert not any(client.greenlets)
+
+
+def test_shutdown_does_not_wait_out_a_held_connect():
+    with StubServer(timeout=5000) as server:
+        client = BayeuxClient(server.url)
+        client.subscribe('/chat/demo', lambda message: None).get(timeout=5)
+        # Let the connect greenlet's long poll be held
+        gevent.sleep(0.2)
+
+        started = time.monotonic()
+        client.shutdown()
+        assert time.monotonic() - started < 0.5
+        assert client.disconnect_complete
+        assert not any(client.greenlets)
+
+
+def test_shutdown_from_a_callback():
+    handled = []
+
+    class ShuttingDownClient(BayeuxClient):
+        def handle(self, message):
+            handled.append(message['data'])
+            self.shutdown()
+
+    client = ShuttingDownClient('http://example.com/cometd',
+                                HoldingSession())
+    client.subscribe('/chat/demo', 'handle')
+    client.go()
+
+    with gevent.Timeout(5):
+        client.block()
+    assert handled == [{'n': 1}]
+    assert client.shutdown_completed
@@ -0,0 +1,196 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux import UnexpectedConnectResponseException
+from python_bayeux.message import Message
+from python_bayeux.message import StreamSplitter
+from python_bayeux.message import parse_messages
+from python_bayeux.spool import SegmentSpool
+from fake_session import FakeSession
+import pickle
+import pytest
+import random
+import simplejson as json
+
+ELEMENTS = [
+    {'channel': '/meta/connect', 'successful': True, 'id': '7',
+     'advice': {'timeout': 110000, 'reconnect': 'retry'}},
+    {'channel': '/topic/Leads',
+     'data': {'event': {'replayId': 42, 'createdDate': '2020-01-01'},
+              'sobject': {'Name': u'Renée "Q" [x]', 'Id': '00Q'}}},
+    {'channel': '/chat/demo', 'data': {'chat': 'a}b{c', 'user': None},
+     'clientId': 'abc'},
+]
+
+
+def test_parse_matches_full_decode():
+    for body in (json.dumps(ELEMENTS), json.dumps(ELEMENTS, indent=2)):
+        messages = parse_messages(body.encode('utf-8'))
+        assert [message.to_dict() for message in messages] == ELEMENTS
+        assert [dict(message) for message in messages] == ELEMENTS
+
+
+def test_data_is_decoded_on_first_use():
+    connect, lead, chat = parse_messages(json.dumps(ELEMENTS).encode('utf-8'))
+
+    assert lead.channel == '/topic/Leads'
+    assert lead.replay_id == 42
+    assert connect.id == '7'
+    assert lead._decoded == {}
+
+    assert lead['data']['sobject']['Id'] == '00Q'
+    assert lead['data'] is lead['data']
+    assert 'advice' in connect
+    assert 'advice' not in lead
+    assert lead.get('advice') is None
+    assert chat['clientId'] == 'abc'
+    assert isinstance(lead, Message)
+
+
+def test_replay_id_comes_from_the_event():
+    elements = [
+        {'channel': '/topic/Leads',
+         'data': {'payload': {'replayId': 1}, 'event': {'replayId': 99}}},
+        {'channel': '/topic/Leads', 'data': {'payload': {'replayId': 1}}},
+        {'channel': '/topic/Leads', 'data': {'event': 'replayId'}},
+        {'channel': '/chat/demo', 'data': 'replayId'},
+    ]
+    messages = parse_messages(json.dumps(elements).encode('utf-8'))
+    assert [message.replay_id for message in messages] == [99, None, None, None]
+
+
+def test_messages_pickle_and_spool(tmpdir):
+    lead = parse_messages(json.dumps(ELEMENTS).encode('utf-8'))[1]
+    assert pickle.loads(pickle.dumps(lead)) == lead
+
+    spool = SegmentSpool(str(tmpdir))
+    spool.append([lead])
+    assert spool.read() == [ELEMENTS[1]]
+    spool.close()
+
+
+def test_splitter_handles_any_chunk_boundaries():
+    body = json.dumps(ELEMENTS, indent=2).encode('utf-8')
+    for _ in range(50):
+        splitter = StreamSplitter()
+        raws = []
+        position = 0
+        while position < len(body):
+            size = random.randint(1, 16)
+            raws.extend(splitter.feed(body[position:position + size]))
+            position += size
+
+        assert splitter.finished
+        assert [json.loads(raw) for raw in raws] == ELEMENTS
+
+    # Each element comes out as soon as its closing brace arrives
+    splitter = StreamSplitter()
+    assert splitter.feed(b'[{"a": "}"') == []
+    assert splitter.feed(b'}, {') == [b'{"a": "}"}']
+    assert splitter.buffer == bytearray(b'{')
+
+    with pytest.raises(ValueError):
+        StreamSplitter().feed(b'{"channel": "/meta/connect"}')
+
+
+class ConnectSession(FakeSession):
+    def respond(self, message):
+        response = super(ConnectSession, self).respond(message)
+        if message['channel'] == '/meta/connect':
+            return [response, ELEMENTS[1]]
+        return response
+
+    def post(self, url, data=None, **kwargs):
+        response = super(ConnectSession, self).post(url, data, **kwargs)
+        body = json.loads(response.content)
+        if isinstance(body[0], list):
+            body = body[0]
+        response.content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def test_client_returns_lazy_connect_responses():
+    client = BayeuxClient('http://example.com/cometd', ConnectSession(),
+                          start=False, lazy_messages=True)
+    connect_response = client.connect()
+    assert all(isinstance(element, Message) for element in connect_response)
+    assert connect_response[0]['successful']
+    assert connect_response[1].replay_id == 42
+
+    # Other responses are decoded as usual
+    client.handshake()
+    assert client.client_id == 'fake-client-id'
+
+
+class RecordingQueue(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+def test_streaming_connect_queues_each_push():
+    client = BayeuxClient('http://example.com/cometd', ConnectSession(),
+                          start=False, streaming_connect=True,
+                          stream_chunk_size=7)
+    client.message_queue = RecordingQueue()
+
+    pushes = 0
+    connect_response = client.connect()
+    for element in connect_response:
+        if element['channel'] != '/meta/connect':
+            pushes += 1
+    assert pushes == 1
+
+    client._handle_connect_response(client.connect())
+    assert [messages for _, messages in client.message_queue.items] == \
+        [[ELEMENTS[1]]]
+
+
+def test_streaming_connect_rejects_incomplete_responses():
+    class TruncatingSession(ConnectSession):
+        def post(self, url, data=None, **kwargs):
+            response = super(TruncatingSession, self).post(
+                url, data, **kwargs
+            )
+            if 'stream' in kwargs:
+                response.content = response.content[:-10]
+            return response
+
+    client = BayeuxClient('http://example.com/cometd', TruncatingSession(),
+                          start=False, streaming_connect=True)
+    with pytest.raises(UnexpectedConnectResponseException):
+        client._connect_greenlet()
@@ -0,0 +1,113 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.metrics import MetricsRegistry
+from python_bayeux.metrics import MetricsTracer
+from python_bayeux.stubserver import StubServer
+import gevent.queue
+import pytest
+import requests
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.counter('sent_total', 'Sent "things"', ('channel',))
+    histogram = registry.histogram('wait_seconds', 'Waits',
+                                   buckets=(0.1, 1))
+    registry.gauge('depth', 'Depth', lambda: [(('a\\b',), 3)], ('queue',))
+    registry.counter('idle_total', 'Never touched')
+
+    counter.inc(('/meta/connect',))
+    counter.inc(('/meta/connect',), 2)
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render() == '\n'.join([
+        '# HELP sent_total Sent "things"',
+        '# TYPE sent_total counter',
+        'sent_total{channel="/meta/connect"} 3',
+        '# HELP wait_seconds Waits',
+        '# TYPE wait_seconds histogram',
+        'wait_seconds_bucket{le="0.1"} 2',
+        'wait_seconds_bucket{le="1"} 3',
+        'wait_seconds_bucket{le="+Inf"} 4',
+        'wait_seconds_sum 5.65',
+        'wait_seconds_count 4',
+        '# HELP depth Depth',
+        '# TYPE depth gauge',
+        'depth{queue="a\\\\b"} 3',
+        '# HELP idle_total Never touched',
+        '# TYPE idle_total counter',
+        'idle_total 0',
+    ]) + '\n'
+
+    with pytest.raises(ValueError):
+        registry.counter('sent_total', 'Again')
+
+
+def test_client_metrics_are_served():
+    tracer = MetricsTracer()
+    received = gevent.queue.Queue()
+    with StubServer(timeout=1000) as server:
+        client = BayeuxClient(server.url, tracer=tracer)
+        client.subscribe('/chat/demo', received.put).get(timeout=5)
+        client.go()
+        client.publish('/chat/demo', {'chat': 'hi'}).get(timeout=5)
+        received.get(timeout=5)
+
+        port = tracer.registry.serve()
+        try:
+            response = requests.get(
+                'http://127.0.0.1:{0}/metrics'.format(port)
+            )
+        finally:
+            tracer.registry.stop()
+
+        client.shutdown()
+
+    assert response.headers['Content-Type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    for line in [
+            'bayeux_requests_total{channel="/meta/handshake"} 1',
+            'bayeux_requests_total{channel="/meta/subscribe"} 1',
+            'bayeux_requests_total{channel="publish"} 1',
+            'bayeux_handshakes_total 1',
+            'bayeux_messages_received_total{channel="/chat/demo"} 1',
+            'bayeux_messages_dispatched_total{channel="/chat/demo"} 1',
+            'bayeux_callback_duration_seconds_count{channel="/chat/demo"} 1',
+            'bayeux_queue_depth{queue="publication"} 0']:
+        assert line in lines
+    assert tracer.connect_duration.count() >= 1
+    assert tracer.clients == set()
@@ -0,0 +1,101 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from pytest import raises
+from python_bayeux import BayeuxClient
+from fake_session import FakeSession
+import os
+import time
+import gevent
+
+
+def square(message):
+    return message['data'] ** 2, os.getpid()
+
+
+def explode(message):
+    raise ValueError('bad message {0}'.format(message['data']))
+
+
+class OffloadClient(BayeuxClient):
+    def handler_result(self, message, callback, result):
+        self.results.append(result)
+
+
+def run_messages(client, messages):
+    client.message_queue.put((time.monotonic(), messages))
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.join()
+    client.offload_pool.shutdown()
+    return execute_greenlet
+
+
+def test_handlers_run_in_other_processes():
+    client = OffloadClient('http://example.com/cometd', FakeSession(),
+                           start=False, handler_processes=2,
+                           handler_batch_size=3)
+    client.results = []
+    client.subscribe('/numbers', square)
+
+    execute_greenlet = run_messages(client, [
+        {'channel': '/numbers', 'data': n} for n in range(10)
+    ])
+
+    assert execute_greenlet.successful()
+    assert [value for value, pid in client.results] == \
+        [n ** 2 for n in range(10)]
+    assert os.getpid() not in set(pid for value, pid in client.results)
+
+
+def test_handler_exceptions_come_back():
+    client = OffloadClient('http://example.com/cometd', FakeSession(),
+                           start=False, handler_processes=1)
+    client.results = []
+    client.subscribe('/numbers', explode)
+
+    execute_greenlet = run_messages(client, [
+        {'channel': '/numbers', 'data': 7}
+    ])
+
+    with raises(ValueError) as exc_info:
+        execute_greenlet.get()
+    assert str(exc_info.value) == 'bad message 7'
+
+
+def test_method_name_callbacks_are_rejected():
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False, handler_processes=1)
+    with raises(ValueError):
+        client.subscribe('/numbers', 'square')
@@ -0,0 +1,177 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from pytest import raises
+from python_bayeux import BayeuxClient
+from python_bayeux.queues import BoundedMessageQueue
+from fake_session import FakeSession
+import time
+import gevent
+import gevent.queue
+
+
+def messages(*numbers):
+    return [{'channel': '/numbers', 'data': n} for n in numbers]
+
+
+def data(item):
+    enqueued, got = item
+    return [message['data'] for message in got]
+
+
+def test_unbounded_queue_batches_everything():
+    queue = BoundedMessageQueue()
+    queue.put((1.0, messages(0, 1)))
+    queue.put((2.0, messages(2)))
+    assert queue.qsize() == 3
+
+    enqueued, got = queue.get()
+    assert enqueued == 1.0
+    assert [message['data'] for message in got] == [0, 1, 2]
+    with raises(gevent.queue.Empty):
+        queue.get(timeout=0.01)
+
+
+def test_drop_newest():
+    queue = BoundedMessageQueue(max_messages=2, overflow_policy='drop_newest')
+    queue.put((1.0, messages(0, 1, 2, 3)))
+    assert queue.dropped == 2
+    assert data(queue.get()) == [0, 1]
+
+
+def test_drop_oldest():
+    queue = BoundedMessageQueue(max_messages=2, overflow_policy='drop_oldest')
+    queue.put((1.0, messages(0, 1, 2, 3)))
+    assert queue.dropped == 2
+    assert data(queue.get()) == [2, 3]
+
+
+def test_max_bytes():
+    queue = BoundedMessageQueue(max_bytes=80, overflow_policy='drop_newest')
+    queue.put((1.0, messages(0, 1, 2, 3)))
+    assert queue.depth == 2
+    assert queue.depth_bytes <= 80
+
+
+def test_block_until_there_is_room():
+    queue = BoundedMessageQueue(max_messages=2)
+    putter = gevent.spawn(queue.put, (1.0, messages(0, 1, 2, 3, 4)))
+    gevent.sleep(0.01)
+    assert not putter.dead
+    assert queue.blocked == 1
+
+    got = data(queue.get())
+    while not putter.dead or queue.qsize():
+        got.extend(data(queue.get()))
+
+    assert got == [0, 1, 2, 3, 4]
+    assert queue.dropped == 0
+
+
+def test_close_releases_blocked_put():
+    queue = BoundedMessageQueue(max_messages=1)
+    putter = gevent.spawn(queue.put, (1.0, messages(0, 1)))
+    gevent.sleep(0.01)
+    queue.close()
+    putter.join(timeout=1)
+    assert putter.dead
+    assert data(queue.get()) == [0, 1]
+
+
+def test_spill_keeps_order(tmpdir):
+    queue = BoundedMessageQueue(max_messages=2, overflow_policy='spill',
+                                spill_directory=str(tmpdir))
+    queue.put((1.0, messages(0, 1, 2, 3)))
+    queue.put((2.0, messages(4)))
+    assert queue.spilled == 3
+    assert queue.qsize() == 5
+
+    got = []
+    while queue.qsize():
+        got.extend(data(queue.get()))
+
+    assert got == [0, 1, 2, 3, 4]
+    assert queue.dropped == 0
+    assert queue.spill_pending == 0
+
+
+def test_bound_applies_with_dispatch_concurrency():
+    def slow(message):
+        gevent.sleep(0.01)
+
+    client = BayeuxClient('http://example.com/cometd', FakeSession(),
+                          start=False, dispatch_concurrency=4,
+                          max_queue_messages=10,
+                          overflow_policy='drop_newest')
+    client.subscribe('/numbers', slow)
+    client.dispatcher.start()
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+
+    for n in range(100):
+        client.message_queue.put((time.monotonic(), messages(n)))
+        gevent.sleep(0)
+
+    # The workers only took what they could run, so the queue filled up and
+    # its overflow policy applied
+    assert client.dispatcher.qsize() <= 4
+    assert client.message_queue.depth == 10
+    assert client.message_queue.dropped > 0
+
+    client.stop_greenlets = True
+    execute_greenlet.join(timeout=5)
+    client.dispatcher.shutdown()
+
+
+def test_callback_can_shut_down_a_bounded_dispatch():
+    class StoppingClient(BayeuxClient):
+        def stop(self, message):
+            self.handled.append(message['data'])
+            if message['data'] == 0:
+                self.shutdown()
+
+    client = StoppingClient('http://example.com/cometd', FakeSession(),
+                            start=False, dispatch_concurrency=2,
+                            max_queue_messages=100)
+    client.handled = []
+    client.subscribe('/numbers', 'stop')
+    client.dispatcher.start(client._exception_callback)
+    client.message_queue.put((time.monotonic(), messages(*range(10))))
+    client.go()
+
+    # The only busy worker is the one shutting down, so the execute greenlet
+    # must not wait for it to make room
+    with gevent.Timeout(5):
+        client.shutdown_event.wait()
+    assert client.shutdown_completed
+    assert client.handled[0] == 0
@@ -0,0 +1,168 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux import ReconnectRefusedException
+from python_bayeux.reconnect import BACKING_OFF
+from python_bayeux.reconnect import CONNECTED
+from python_bayeux.reconnect import DISCONNECTED
+from python_bayeux.reconnect import Reconnector
+from fake_session import FakeResponse
+from fake_session import FakeSession
+import gevent
+import simplejson as json
+
+
+def test_backoff_grows_and_is_jittered():
+    reconnector = Reconnector(backoff=1, max_backoff=5,
+                              random=lambda: 0.5)
+    reconnector.handshook({'advice': {'interval': 2000}})
+    assert reconnector.delay() == 2.0
+
+    delays = []
+    for _ in range(5):
+        reconnector.failed()
+        delays.append(reconnector.delay())
+    assert delays == [2.5, 3.0, 4.0, 4.5, 4.5]
+    assert reconnector.state == BACKING_OFF
+
+    reconnector.connected({'successful': True})
+    assert reconnector.delay() == 2.0
+    assert reconnector.state == CONNECTED
+
+
+def test_follows_reconnect_advice():
+    reconnector = Reconnector()
+    reconnector.handshook({})
+    assert not reconnector.handshake_required
+
+    reconnector.unsuccessful({'error': '403::Unknown client',
+                              'advice': {'reconnect': 'handshake'}})
+    assert reconnector.handshake_required
+
+    reconnector.handshook({})
+    reconnector.unsuccessful({'error': '500::server restarting',
+                              'advice': {'reconnect': 'none'}})
+    assert reconnector.stopped
+    assert reconnector.state == DISCONNECTED
+
+
+# Answers connects with 503 a few times before letting them through
+class FlakySession(FakeSession):
+    def __init__(self, failures, advice=None):
+        super(FlakySession, self).__init__(connect_timeout=2000)
+        self.failures = failures
+        self.advice = advice
+        self.connect_timeouts = []
+        self.connects = 0
+
+    def respond(self, message):
+        response = super(FlakySession, self).respond(message)
+        if message['channel'] == '/meta/connect' and self.advice and \
+           self.connects > 1:
+            response['successful'] = False
+            response['error'] = '402::Unknown error'
+            response['advice'] = self.advice
+        return response
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        if json.loads(data)['channel'] == '/meta/connect':
+            self.connects += 1
+            self.connect_timeouts.append(kwargs.get('timeout'))
+            if self.connects > 1:
+                gevent.sleep(0.01)
+            if 1 < self.connects <= 1 + self.failures:
+                return FakeResponse('', status_code=503)
+        return super(FlakySession, self).post(url, data, headers, **kwargs)
+
+
+def test_server_errors_back_off_and_recover():
+    session = FlakySession(failures=3)
+    client = BayeuxClient('http://localhost/cometd', session,
+                          reconnect_backoff=0.01)
+    states = []
+    while session.connects < 8:
+        states.append(client.connection_state)
+        gevent.sleep(0.005)
+    client.shutdown()
+
+    assert client.exception is None
+    assert BACKING_OFF in states
+    assert states[-1] == CONNECTED
+    assert client.reconnector.failures == 0
+
+    # The advised timeout is kept, plus time for the network
+    assert client.connect_timeout == 2.0
+    assert session.connect_timeouts[0] is None
+    assert set(session.connect_timeouts[1:]) == {12.0}
+
+
+def test_reconnect_none_stops_the_client():
+    session = FlakySession(failures=0, advice={'reconnect': 'none'})
+    client = BayeuxClient('http://localhost/cometd', session)
+    gevent.sleep(0.2)
+
+    assert isinstance(client.exception, ReconnectRefusedException)
+    assert client.connection_state == DISCONNECTED
+    assert client.shutdown_called
+    assert session.connects == 2
+
+
+def test_unsuccessful_handshake_counts_once():
+    session = FakeSession()
+    client = BayeuxClient('http://localhost/cometd', session, start=False,
+                          reconnect_backoff=60)
+    real_respond = session.respond
+
+    def respond(message):
+        response = real_respond(message)
+        if message['channel'] == '/meta/handshake':
+            response['successful'] = False
+            response['error'] = '500::try again'
+        return response
+
+    session.respond = respond
+    client.reconnector.handshake_required = True
+    connect_greenlet = gevent.spawn(client._connect_greenlet)
+    gevent.sleep(0.05)
+
+    # One handshake failed, and the next waits for the first backoff step
+    assert [post['channel'] for post in session.posts].count(
+        '/meta/handshake') == 2
+    assert client.reconnector.failures == 1
+    assert client.connection_state == BACKING_OFF
+
+    client.stop_greenlets = True
+    connect_greenlet.join(timeout=1)
+    assert connect_greenlet.successful()
@@ -0,0 +1,140 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.spool import SegmentSpool
+from fake_session import FakeSession
+import os
+import time
+import gevent
+
+
+def messages(*numbers):
+    return [{'channel': '/numbers', 'data': n} for n in numbers]
+
+
+def data(got):
+    return [message['data'] for message in got]
+
+
+def test_uncommitted_messages_are_replayed(tmpdir):
+    spool = SegmentSpool(str(tmpdir), fsync_interval=0)
+    spool.append(messages(0, 1, 2))
+    assert data(spool.read(2)) == [0, 1]
+    spool.commit()
+    assert data(spool.read()) == [2]
+    spool.append(messages(3))
+    spool.close()
+
+    spool = SegmentSpool(str(tmpdir))
+    assert data(spool.read()) == [2, 3]
+    assert not spool.pending()
+    spool.close()
+
+
+def test_segments_rotate_and_are_removed(tmpdir):
+    spool = SegmentSpool(str(tmpdir), segment_size=256, fsync_batch=10)
+    spool.append(messages(*range(20)))
+    segments = [name for name in os.listdir(str(tmpdir))
+                if name.endswith('.seg')]
+    assert len(segments) > 2
+
+    assert data(spool.read()) == list(range(20))
+    spool.commit()
+    segments = [name for name in os.listdir(str(tmpdir))
+                if name.endswith('.seg')]
+    assert len(segments) == 1
+    spool.close()
+
+    spool = SegmentSpool(str(tmpdir), segment_size=256)
+    assert spool.read() == []
+    spool.append(messages(20))
+    assert data(spool.read()) == [20]
+    spool.close()
+
+
+def test_quiet_spool_is_flushed_on_time(tmpdir):
+    spool = SegmentSpool(str(tmpdir), fsync_interval=0.05)
+    spool.append(messages(0))
+    spool.append(messages(1))
+    assert spool.unflushed == 2
+
+    # Nothing else is appended, but the records are still flushed
+    gevent.sleep(0.1)
+    assert spool.unflushed == 0
+    assert spool.flush_timer is None
+    spool.close()
+
+
+def test_torn_record_ends_the_log(tmpdir):
+    spool = SegmentSpool(str(tmpdir), fsync_interval=0)
+    spool.append(messages(0, 1))
+    # Corrupt the last record, as a crash in the middle of writing might
+    segment = spool._segment(spool.write_segment)
+    segment[spool.write_offset - 2] = ord('x')
+    spool.close()
+
+    spool = SegmentSpool(str(tmpdir))
+    assert data(spool.read()) == [0]
+    spool.append(messages(2))
+    assert data(spool.read()) == [2]
+    spool.close()
+
+
+class CountingClient(BayeuxClient):
+    def count(self, message):
+        self.handled.append(message['data'])
+
+
+def test_client_replays_spool_on_restart(tmpdir):
+    spool = SegmentSpool(str(tmpdir))
+    spool.append(messages(0, 1))
+    spool.close()
+
+    client = CountingClient('http://example.com/cometd', FakeSession(),
+                            start=False, spool=SegmentSpool(str(tmpdir)),
+                            dispatch_concurrency=2)
+    client.handled = []
+    client.subscribe('/numbers', 'count')
+    client.dispatcher.start()
+    client.message_queue.put((time.monotonic(), messages(2)))
+
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    client.stop_greenlets = True
+    execute_greenlet.get()
+    client.dispatcher.shutdown()
+    client.spool.close()
+
+    assert client.handled == [0, 1, 2]
+    assert SegmentSpool(str(tmpdir)).read() == []
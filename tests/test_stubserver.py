@@ -0,0 +1,86 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.stubserver import StubServer
+import gevent
+import gevent.queue
+import pytest
+import requests
+
+
+@pytest.fixture
+def server():
+    with StubServer(timeout=1000) as server:
+        yield server
+
+
+def test_publishes_fan_out_to_subscribers(server):
+    received = gevent.queue.Queue()
+    clients = [BayeuxClient(server.url, max_batch_size=10)
+               for i in range(2)]
+    clients[0].subscribe('/chat/*', received.put).get(timeout=5)
+    clients[1].subscribe('/chat/demo', received.put).get(timeout=5)
+    for client in clients:
+        client.go()
+
+    clients[0].publish('/chat/demo', {'chat': 'hi'}).get(timeout=5)
+    server.publish('/chat/other', {'chat': 'server'})
+
+    pushes = sorted(
+        (received.get(timeout=5)['data']['chat'] for i in range(3))
+    )
+    assert pushes == ['hi', 'hi', 'server']
+    assert server.requests['/meta/handshake'] == 2
+    assert server.requests['/chat/demo'] == 1
+
+    gevent.joinall([gevent.spawn(client.shutdown) for client in clients])
+    assert server.clients == {}
+
+
+def test_unknown_clients_are_told_to_handshake(server):
+    response = requests.post(server.url, json={
+        'channel': '/meta/connect',
+        'clientId': 'nobody',
+        'connectionType': 'long-polling',
+        'id': '1'
+    }).json()
+
+    assert response == [{
+        'channel': '/meta/connect',
+        'successful': False,
+        'error': '403::Unknown client',
+        'advice': {'reconnect': 'handshake', 'interval': 0},
+        'id': '1'
+    }]
@@ -0,0 +1,94 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+from python_bayeux import BayeuxClient
+from python_bayeux.tracing import SamplingProfiler
+from python_bayeux.tracing import StatsTracer
+from fake_session import FakeSession
+import time
+import gevent
+
+
+class SlowClient(BayeuxClient):
+    def slow_callback(self, message):
+        gevent.sleep(0.05)
+
+    def fast_callback(self, message):
+        pass
+
+
+def test_tracer_receives_timings(caplog):
+    tracer = StatsTracer(slow_callback_threshold=0.04)
+    client = SlowClient('http://example.com/cometd', FakeSession(),
+                        start=False, tracer=tracer)
+    client.subscribe('/slow', 'slow_callback')
+    client.subscribe('/fast', 'fast_callback')
+    client.message_queue.put((time.monotonic(), [
+        {'channel': '/slow', 'data': 1},
+        {'channel': '/fast', 'data': 2}
+    ]))
+
+    execute_greenlet = gevent.spawn(client._execute_greenlet)
+    publish_greenlet = gevent.spawn(client._publish_greenlet)
+    client.publish('/fast', 'hello').get(timeout=5)
+    client.stop_greenlets = True
+    gevent.joinall([execute_greenlet, publish_greenlet])
+
+    assert tracer.stats['handshake'].count == 1
+    # handshake, initial connect and the publish
+    assert tracer.stats['send'].count == 3
+    assert tracer.stats['queue_wait:message'].count == 1
+    assert tracer.stats['queue_wait:publication'].count == 1
+    assert tracer.stats['callback:/slow'].count == 1
+    assert tracer.stats['callback:/fast'].count == 1
+    assert tracer.slow_callbacks == {('/slow', 'slow_callback'): 1}
+    assert 'slow_callback' in caplog.text
+    assert '/slow' in caplog.text
+
+
+def busy_loop(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_sampling_profiler_finds_busy_function():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_loop(0.2)
+    profiler.stop()
+
+    assert profiler.sample_count > 0
+    assert any(function == 'busy_loop'
+               for (filename, line, function), share in profiler.top(3))
@@ -0,0 +1,170 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+pytest.importorskip('websocket')
+
+from python_bayeux import BayeuxClient
+from python_bayeux.transport import WebSocketTransport
+from fake_session import FakeSession
+from websocket_server import WebSocketServer
+import gevent
+import gevent.queue
+import time
+
+
+# Long polls take a little while, so the connect greenlet doesn't spin
+class LongPollSession(FakeSession):
+    def post(self, url, data=None, **kwargs):
+        response = super(LongPollSession, self).post(url, data, **kwargs)
+        if b'/meta/connect' in data:
+            gevent.sleep(0.05)
+        return response
+
+
+@pytest.fixture
+def server():
+    server = WebSocketServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_pushes_arrive_over_the_websocket(server):
+    session = FakeSession(connection_types=['websocket', 'long-polling'])
+    client = BayeuxClient('http://127.0.0.1/cometd', session, start=False,
+                          transports=[WebSocketTransport(url=server.url)])
+    assert session.posts[0]['supportedConnectionTypes'] == \
+        ['websocket', 'long-polling']
+    assert client.transport is not None
+
+    received = gevent.queue.Queue()
+    subscribed = client.subscribe(
+        '/chat/demo',
+        lambda message: received.put((time.monotonic(), message))
+    )
+    client.start()
+    client.go()
+    assert subscribed.get(timeout=5)['subscription'] == '/chat/demo'
+
+    sent = time.monotonic()
+    server.push('/chat/demo', {'n': 1})
+    arrived, message = received.get(timeout=5)
+    assert message['data'] == {'n': 1}
+    # Well inside the 0.2 seconds the server holds each connect
+    assert arrived - sent < 0.1
+
+    # Publishes are answered over the socket too
+    assert client.publish('/chat/demo', {'n': 2}).get(timeout=5)['successful']
+    assert received.get(timeout=5)[1]['data'] == {'n': 2}
+
+    # Only the handshake was an HTTP request
+    assert [post['channel'] for post in session.posts] == ['/meta/handshake']
+    assert {'/meta/connect', '/meta/subscribe', '/chat/demo'} <= \
+        set(message['channel'] for message in server.received)
+    assert all(message['connectionType'] == 'websocket'
+               for message in server.received
+               if message['channel'] == '/meta/connect')
+
+    client.shutdown()
+    assert server.received[-1]['channel'] == '/meta/disconnect'
+
+
+def test_falls_back_to_long_polling(server):
+    # The server doesn't support websockets
+    client = BayeuxClient('http://127.0.0.1/cometd', FakeSession(),
+                          start=False,
+                          transports=[WebSocketTransport(url=server.url)])
+    assert client.transport is None
+    assert server.received == []
+
+    # The server does, but we can't connect
+    server.stop()
+    transport = WebSocketTransport(url=server.url, open_timeout=1)
+    session = FakeSession(connection_types=['websocket', 'long-polling'])
+    client = BayeuxClient('http://127.0.0.1/cometd', session, start=False,
+                          transports=[transport])
+    assert client.transport is None
+    assert client.failed_transports == {transport}
+    assert session.posts[-1]['connectionType'] == 'long-polling'
+
+
+def test_lost_websocket_handshakes_again_without_it(server):
+    session = LongPollSession(connection_types=['websocket', 'long-polling'])
+    client = BayeuxClient('http://127.0.0.1/cometd', session,
+                          transports=[WebSocketTransport(url=server.url)])
+    client.subscribe('/chat/demo', print).get(timeout=5)
+    assert client.transport is not None
+
+    server.drop()
+    # The subscription comes back in one batched request
+    for i in range(100):
+        if client.transport is None and any(
+                isinstance(post, list) for post in session.posts):
+            break
+        gevent.sleep(0.05)
+
+    channels = [post['channel'] for post in session.posts
+                if isinstance(post, dict)]
+    assert channels.count('/meta/handshake') == 2
+    assert [post for post in session.posts if isinstance(post, list)][0][0][
+        'subscription'] == '/chat/demo'
+    assert session.posts[1]['supportedConnectionTypes'] == ['long-polling']
+
+    client.shutdown()
+
+
+def test_publish_survives_a_lost_websocket(server):
+    session = LongPollSession(connection_types=['websocket', 'long-polling'])
+    client = BayeuxClient('http://127.0.0.1/cometd', session, start=False,
+                          transports=[WebSocketTransport(url=server.url)])
+    for greenlet in client.inbound_greenlets:
+        greenlet.start()
+    publish_greenlet = gevent.spawn(client._publish_greenlet,
+                                    timeout_wait=0.1)
+    assert client.publish('/chat/demo', {'n': 1}).get(timeout=5)['successful']
+
+    # The socket goes while the publish is on it, and the publish goes again
+    # over long-polling once we have handshaken without the websocket
+    server.drop()
+    published = client.publish('/chat/demo', {'n': 2})
+    assert published.get(timeout=5)['successful']
+    assert client.transport is None
+    assert not publish_greenlet.dead
+    assert [post['data'] for post in session.posts
+            if isinstance(post, dict) and
+            post['channel'] == '/chat/demo'] == [{'n': 2}]
+
+    gevent.kill(publish_greenlet)
+    client.shutdown()
@@ -0,0 +1,185 @@
+'''
+    Copyright (c) 2016, Salesforce.org
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Salesforce.org nor the names of
+      its contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+    "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+    LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+    FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+    COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+    INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+    BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+    ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+    POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import base64
+import hashlib
+import socket
+import struct
+
+import gevent
+import gevent.lock
+import simplejson as json
+from gevent.server import StreamServer
+
+_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+# Just enough of a bayeux server speaking RFC 6455 to test
+# python_bayeux.transport.WebSocketTransport.  Connects are held for
+# connect_hold seconds, everything else is answered at once, and publishes
+# are pushed back to every connection.
+class WebSocketServer(object):
+    def __init__(self, connect_hold=0.2):
+        self.connect_hold = connect_hold
+        self.server = StreamServer(('127.0.0.1', 0), self._handle)
+        self.connections = []
+        self.received = []
+
+    def start(self):
+        self.server.start()
+        self.url = 'ws://127.0.0.1:{0}/cometd'.format(self.server.server_port)
+
+    def stop(self):
+        self.drop()
+        self.server.stop()
+
+    def push(self, channel, data):
+        for connection in list(self.connections):
+            connection.send([{'channel': channel, 'data': data}])
+
+    # Closes every connection without a closing handshake
+    def drop(self):
+        for connection in list(self.connections):
+            try:
+                connection.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _handle(self, connection_socket, address):
+        connection = _Connection(connection_socket)
+        if not connection.accept():
+            return
+
+        self.connections.append(connection)
+        try:
+            while True:
+                opcode, payload = connection.read_frame()
+                if opcode is None or opcode == 0x8:
+                    break
+                elif opcode == 0x9:
+                    connection.send_frame(payload, 0xA)
+                elif opcode == 0x1:
+                    for message in json.loads(payload):
+                        self.received.append(message)
+                        self._respond(connection, message)
+        finally:
+            self.connections.remove(connection)
+            connection_socket.close()
+
+    def _respond(self, connection, message):
+        response = {
+            'channel': message['channel'],
+            'successful': True,
+            'id': message.get('id')
+        }
+
+        if message['channel'] == '/meta/connect':
+            response['advice'] = {'reconnect': 'retry', 'interval': 0,
+                                  'timeout': int(self.connect_hold * 1000)}
+            gevent.spawn_later(self.connect_hold, connection.send, [response])
+            return
+
+        if message['channel'] in ('/meta/subscribe', '/meta/unsubscribe'):
+            response['subscription'] = message['subscription']
+
+        connection.send([response])
+        if not message['channel'].startswith('/meta/'):
+            self.push(message['channel'], message['data'])
+
+
+class _Connection(object):
+    def __init__(self, socket):
+        self.socket = socket
+        self.rfile = socket.makefile('rb')
+        self.lock = gevent.lock.Semaphore()
+
+    def accept(self):
+        headers = {}
+        self.rfile.readline()
+        while True:
+            line = self.rfile.readline().strip()
+            if not line:
+                break
+            name, value = line.split(b':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if b'sec-websocket-key' not in headers:
+            return False
+
+        accept = base64.b64encode(
+            hashlib.sha1(headers[b'sec-websocket-key'] + _GUID).digest()
+        )
+        self.socket.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+        return True
+
+    def read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, None
+
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length, = struct.unpack('>H', self.rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack('>Q', self.rfile.read(8))
+
+        # Frames from clients are always masked
+        mask = self.rfile.read(4)
+        payload = bytearray(self.rfile.read(length))
+        for i in range(len(payload)):
+            payload[i] ^= mask[i % 4]
+
+        return opcode, bytes(payload)
+
+    def send(self, messages):
+        self.send_frame(json.dumps(messages).encode('utf-8'))
+
+    def send_frame(self, payload, opcode=0x1):
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(len(payload))
+        elif len(payload) < 65536:
+            header.append(126)
+            header += struct.pack('>H', len(payload))
+        else:
+            header.append(127)
+            header += struct.pack('>Q', len(payload))
+
+        with self.lock:
+            try:
+                self.socket.sendall(bytes(header) + payload)
+            except OSError:
+                pass